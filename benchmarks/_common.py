@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Shared helpers for the benchmark scripts.
+The scripts benchmark the package from this source tree, not an installed copy.
+"""
+import sys
+import time
+from pathlib import Path
+
+_root = Path(__file__).parent.parent.absolute()
+if str(_root) not in sys.path:
+    sys.path.insert(0, str(_root))
+
+from pyTelegramBotCaptcha import telebot_captcha  # noqa: E402
+
+
+def find_fonts():
+    """
+    Returns the bundled .ttf fonts.
+    The font folder is spelled differently on case sensitive file systems.
+    """
+    for package in ("pyTelegramBotCaptcha", "pyTelegramBotCAPTCHA"):
+        fonts = sorted(str(f) for f in (_root / package / "data" / "fonts").glob("*.ttf"))
+        if fonts:
+            return fonts
+    return []
+
+
+def setup_fonts():
+    if not telebot_captcha._fonts:
+        telebot_captcha._fonts.extend(find_fonts())
+    return telebot_captcha._fonts
+
+
+def measure(function, repeat=20, warmup=2):
+    """
+    Calls `function` `repeat` times and returns the timings in seconds (sorted).
+    """
+    for _ in range(warmup):
+        function()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings
+
+
+def summary(timings):
+    return {
+        "min_ms": timings[0] * 1000,
+        "median_ms": timings[len(timings) // 2] * 1000,
+        "mean_ms": sum(timings) / len(timings) * 1000,
+    }
+
+
+def print_row(name, timings):
+    s = summary(timings)
+    print(
+        f"{name:<40} min {s['min_ms']:9.3f} ms   "
+        f"median {s['median_ms']:9.3f} ms   mean {s['mean_ms']:9.3f} ms"
+    )
+
+
+class FakeMessage:
+    def __init__(self, chat_id, message_id, photo=None):
+        self.chat = FakeChat(chat_id)
+        self.message_id = message_id
+        self.date = int(time.time())
+        self.reply_markup = None
+        self.photo = photo
+
+
+class FakePhotoSize:
+    def __init__(self, file_id):
+        self.file_id = file_id
+
+
+class FakeChat:
+    def __init__(self, chat_id, type="supergroup", title="bench", username=None):
+        self.id = chat_id
+        self.type = type
+        self.title = title
+        self.username = username
+
+
+class FakeBot:
+    """
+    Stands in for `telebot.TeleBot`. Records the Bot API calls instead of sending them.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.uploads = 0
+        self.upload_bytes = 0
+        self._message_id = 0
+
+    def _record(self, method):
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+    def _photo(self, photo):
+        # a str is the file_id of an image that was uploaded before
+        if isinstance(photo, str):
+            return [FakePhotoSize(photo)]
+        self.uploads += 1
+        self.upload_bytes += len(photo)
+        return [FakePhotoSize(f"file-{self.uploads}")]
+
+    def send_photo(self, chat_id, photo, caption=None, reply_markup=None, **kwargs):
+        self._record("send_photo")
+        self._message_id += 1
+        return FakeMessage(chat_id, self._message_id, self._photo(photo))
+
+    def edit_message_media(self, media, chat_id=None, message_id=None, **kwargs):
+        self._record("edit_message_media")
+        return FakeMessage(chat_id, message_id, self._photo(media.media))
+
+    def edit_message_caption(self, caption, chat_id=None, message_id=None, **kwargs):
+        self._record("edit_message_caption")
+        return True
+
+    def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+        self._record("answer_callback_query")
+        return True
+
+    def delete_message(self, chat_id, message_id, **kwargs):
+        self._record("delete_message")
+        return True
+
+    def restrict_chat_member(self, chat_id, user_id, **kwargs):
+        self._record("restrict_chat_member")
+        return True
+
+
+def fake_user(user_id, first_name="Bench"):
+    from telebot import types
+
+    return types.User(id=user_id, is_bot=False, first_name=first_name)
+
+
+class FakeCallback:
+    def __init__(self, captcha, data, from_user=None):
+        self.id = "0"
+        self.data = data
+        self.from_user = from_user or captcha.user
+        self.message = FakeMessage(captcha.chat.id, captcha.message_id)
+
+
+def press(manager, bot, captcha, button):
+    """
+    Simulates a press on a button of the captcha keyboard.
+    """
+    data = telebot_captcha._callback_data(button)
+    data = data.replace(telebot_captcha._HANDLE, captcha.handle)
+    manager.update_captcha(bot, FakeCallback(captcha, data))
+
+
+async def press_async(manager, bot, captcha, button):
+    """
+    Simulates a press on a button of the captcha keyboard of an `AsyncCaptchaManager`.
+    """
+    data = telebot_captcha._callback_data(button)
+    data = data.replace(telebot_captcha._HANDLE, captcha.handle)
+    await manager.update_captcha(bot, FakeCallback(captcha, data))
+
+
+def new_manager(**kwargs):
+    """
+    A `CaptchaManager` with no-op handlers that saves into a temporary directory.
+    """
+    import tempfile
+
+    kwargs.setdefault("fonts", find_fonts())
+    if "storage" not in kwargs:
+        from pyTelegramBotCaptcha.storage import DirectoryStorage
+
+        kwargs["storage"] = DirectoryStorage(tempfile.mkdtemp())
+    manager = telebot_captcha.CaptchaManager(kwargs.pop("bot_id", 1), **kwargs)
+    manager.on_captcha_correct(lambda captcha: None)
+    manager.on_captcha_not_correct(lambda captcha: None)
+    manager.on_captcha_timeout(lambda captcha: None)
+    return manager
+
+
+class FakeAsyncBot(FakeBot):
+    """
+    Stands in for `telebot.async_telebot.AsyncTeleBot`.
+    """
+
+    def __getattribute__(self, name):
+        attribute = super().__getattribute__(name)
+        if name.startswith("_") or not callable(attribute) or name in ("calls",):
+            return attribute
+
+        async def coroutine(*args, **kwargs):
+            return attribute(*args, **kwargs)
+
+        return coroutine
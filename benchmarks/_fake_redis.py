@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+A local stand-in for a Redis server, for the benchmark scripts.
+It speaks the Redis protocol (RESP2) and knows the commands `RedisStorage` sends.
+Instead of Lua, EVAL runs a Python version of the scripts of `RedisStorage`.
+All data is kept in memory, every command and every MULTI/EXEC runs under one lock.
+"""
+import bisect
+import socketserver
+import threading
+import time
+
+from pyTelegramBotCaptcha import storage
+
+
+class FakeRedis:
+    def __init__(self):
+        self.strings = {}
+        self.sets = {}
+        self.zsets = {}
+        # key -> time.monotonic() when the key expires
+        self.expires = {}
+        self.lock = threading.Lock()
+        self.commands = 0
+        self.scripts = {
+            storage._UNLOCK_SCRIPT: self._unlock,
+            storage._CLAIM_SCRIPT: self._claim,
+        }
+
+    def _expire(self, key):
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self._delete(key)
+
+    def _delete(self, key):
+        self.expires.pop(key, None)
+        found = False
+        for store in (self.strings, self.sets, self.zsets):
+            found = store.pop(key, None) is not None or found
+        return found
+
+    def run(self, args):
+        self.commands += 1
+        name = args[0].upper().decode()
+        handler = getattr(self, "cmd_" + name.lower(), None)
+        if handler is None:
+            return Error(f"ERR unknown command '{name}'")
+        for key in args[1:2]:
+            self._expire(key)
+        try:
+            return handler(*args[1:])
+        except (TypeError, ValueError, IndexError) as e:
+            return Error(f"ERR wrong arguments for '{name}': {e}")
+
+    def cmd_eval(self, script, numkeys, *args):
+        script = self.scripts.get(script.decode())
+        if script is None:
+            return Error("NOSCRIPT the fake only runs the scripts of RedisStorage")
+        numkeys = int(numkeys)
+        keys, argv = args[:numkeys], args[numkeys:]
+        for key in keys:
+            self._expire(key)
+        return script(keys, argv)
+
+    def _unlock(self, keys, argv):
+        if self.strings.get(keys[0]) == argv[0]:
+            return self.cmd_del(keys[0])
+        return 0
+
+    def _claim(self, keys, argv):
+        due = self.cmd_zrangebyscore(keys[0], b"-inf", argv[0], b"LIMIT", b"0", argv[1])
+        for member in due:
+            self.cmd_zadd(keys[0], argv[2], member)
+        return due
+
+    def cmd_ping(self, *args):
+        return Status("PONG")
+
+    def cmd_select(self, db):
+        return Status("OK")
+
+    def cmd_auth(self, *args):
+        return Status("OK")
+
+    def cmd_flushdb(self):
+        self.strings.clear()
+        self.sets.clear()
+        self.zsets.clear()
+        self.expires.clear()
+        return Status("OK")
+
+    def cmd_get(self, key):
+        return self.strings.get(key)
+
+    def cmd_mget(self, *keys):
+        for key in keys:
+            self._expire(key)
+        return [self.strings.get(key) for key in keys]
+
+    def cmd_set(self, key, value, *options):
+        options = [o.upper() for o in options]
+        if b"NX" in options and key in self.strings:
+            return None
+        self._delete(key)
+        self.strings[key] = value
+        if b"PX" in options:
+            ms = int(options[options.index(b"PX") + 1])
+            self.expires[key] = time.monotonic() + ms / 1000
+        return Status("OK")
+
+    def cmd_del(self, *keys):
+        return sum(1 for key in keys if self._delete(key))
+
+    def cmd_sadd(self, key, *members):
+        members_set = self.sets.setdefault(key, set())
+        before = len(members_set)
+        members_set.update(members)
+        return len(members_set) - before
+
+    def cmd_srem(self, key, *members):
+        members_set = self.sets.get(key, set())
+        removed = sum(1 for m in members if m in members_set)
+        members_set.difference_update(members)
+        if not members_set:
+            self.sets.pop(key, None)
+        return removed
+
+    def cmd_smembers(self, key):
+        return list(self.sets.get(key, ()))
+
+    def cmd_zadd(self, key, *pairs):
+        zset = self.zsets.setdefault(key, {})
+        added = 0
+        for i in range(0, len(pairs), 2):
+            member = pairs[i + 1]
+            added += member not in zset
+            zset[member] = float(pairs[i])
+        return added
+
+    def cmd_zrem(self, key, *members):
+        zset = self.zsets.get(key, {})
+        removed = sum(1 for m in members if zset.pop(m, None) is not None)
+        if not zset:
+            self.zsets.pop(key, None)
+        return removed
+
+    def _sorted(self, key):
+        return sorted(self.zsets.get(key, {}).items(), key=lambda i: (i[1], i[0]))
+
+    def cmd_zrange(self, key, start, stop, *options):
+        items = self._sorted(key)
+        start, stop = int(start), int(stop)
+        stop = len(items) + stop if stop < 0 else stop
+        items = items[start : stop + 1]
+        if options and options[0].upper() == b"WITHSCORES":
+            return [x for member, score in items for x in (member, repr(score).encode())]
+        return [member for member, _ in items]
+
+    def cmd_zrangebyscore(self, key, low, high, *options):
+        items = self._sorted(key)
+        scores = [score for _, score in items]
+        low_open, high_open = low.startswith(b"("), high.startswith(b"(")
+        low, high = float(low.lstrip(b"(")), float(high.lstrip(b"("))
+        first = (bisect.bisect_right if low_open else bisect.bisect_left)(scores, low)
+        last = (bisect.bisect_left if high_open else bisect.bisect_right)(scores, high)
+        items = items[first:last]
+        options = [o.upper() for o in options]
+        if b"LIMIT" in options:
+            i = options.index(b"LIMIT")
+            offset, count = int(options[i + 1]), int(options[i + 2])
+            items = items[offset : offset + count if count >= 0 else None]
+        return [member for member, _ in items]
+
+
+class Status(str):
+    pass
+
+
+class Error(str):
+    pass
+
+
+def _encode(reply):
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, Error):
+        return b"-" + reply.encode() + b"\r\n"
+    if isinstance(reply, Status):
+        return b"+" + reply.encode() + b"\r\n"
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, bytes):
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+    if isinstance(reply, list):
+        return b"*%d\r\n" % len(reply) + b"".join(_encode(r) for r in reply)
+    raise TypeError(reply)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        db = self.server.db
+        queued = None
+        while True:
+            args = self._read_command()
+            if args is None:
+                return
+            name = args[0].upper()
+            if name == b"MULTI":
+                queued = []
+                reply = Status("OK")
+            elif name == b"EXEC" and queued is not None:
+                with db.lock:
+                    reply = [db.run(command) for command in queued]
+                queued = None
+            elif name == b"DISCARD" and queued is not None:
+                queued = None
+                reply = Status("OK")
+            elif queued is not None:
+                queued.append(args)
+                reply = Status("QUEUED")
+            else:
+                with db.lock:
+                    reply = db.run(args)
+            self.wfile.write(_encode(reply))
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        count = int(line[1:-2])
+        args = []
+        for _ in range(count):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def handle_error(self, request, client_address):
+        # clients that disconnect are not an error
+        pass
+
+
+def start_fake_redis():
+    """
+    Starts a fake Redis server on a free local port.
+    :return: (server, url). Call `server.shutdown()` to stop it, `server.db` has the data.
+    """
+    server = _Server(("127.0.0.1", 0), _Handler)
+    server.db = FakeRedis()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return server, f"redis://{host}:{port}/0"
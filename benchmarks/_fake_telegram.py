@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+An in-memory stand-in for the Telegram Bot API, for load tests.
+Every request waits a random latency, can be rejected with a 429 "Too Many Requests"
+like Telegram does it, and is recorded.
+"""
+import random
+import threading
+import time
+from collections import deque
+
+from telebot.apihelper import ApiTelegramException
+
+from _common import FakeBot
+
+# requests that post or change a message in the chat, Telegram limits them per chat
+MESSAGE_METHODS = ("send_photo", "edit_message_caption", "edit_message_media")
+
+
+class Call:
+    __slots__ = ("method", "chat_id", "start", "latency", "error")
+
+    def __init__(self, method, chat_id, start, latency, error):
+        self.method = method
+        self.chat_id = chat_id
+        self.start = start
+        self.latency = latency
+        # None, or the error code Telegram answered with
+        self.error = error
+
+
+class FakeTelegram(FakeBot):
+    def __init__(
+        self,
+        latency=0.05,
+        jitter=0.5,
+        error_rate=0.0,
+        chat_limit=0,
+        retry_after=5,
+        seed=None,
+    ):
+        """
+        Stands in for `telebot.TeleBot`, with the latency and flood limits of Telegram.
+        :param latency: the median latency of a request in seconds
+        :param jitter: the sigma of the lognormal latency. 0.5: the p99 is 3x the median
+        :param error_rate: the share of requests that are answered with a 429 at random
+        :param chat_limit: how many messages (sent or edited) a chat accepts per minute
+            before it answers with 429. Telegram allows about 20 in a group. 0: any
+        :param retry_after: the `retry_after` of the 429 answers, in seconds
+        :param seed: the seed of the random latencies and errors
+        """
+        super().__init__()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.chat_limit = chat_limit
+        self.retry_after = retry_after
+        self.log = []
+        self._random = random.Random(seed)
+        # chat_id -> times of the accepted messages within the last minute
+        self._sent = {}
+        self._lock = threading.Lock()
+
+    def _request(self, method, chat_id):
+        start = time.monotonic()
+        with self._lock:
+            delay = self._random.lognormvariate(0, self.jitter) * self.latency
+            error = None
+            if self._random.random() < self.error_rate:
+                error = 429
+            elif self.chat_limit and method in MESSAGE_METHODS:
+                sent = self._sent.setdefault(chat_id, deque())
+                while sent and sent[0] <= start - 60:
+                    sent.popleft()
+                if len(sent) >= self.chat_limit:
+                    error = 429
+                else:
+                    sent.append(start)
+            self.calls[method] = self.calls.get(method, 0) + 1
+        time.sleep(delay)
+        self.log.append(Call(method, chat_id, start, time.monotonic() - start, error))
+        if error is not None:
+            raise ApiTelegramException(
+                method,
+                None,
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                },
+            )
+
+    def send_photo(self, chat_id, photo, caption=None, reply_markup=None, **kwargs):
+        self._request("send_photo", chat_id)
+        return super().send_photo(chat_id, photo, caption, reply_markup, **kwargs)
+
+    def edit_message_media(self, media, chat_id=None, message_id=None, **kwargs):
+        self._request("edit_message_media", chat_id)
+        return super().edit_message_media(media, chat_id, message_id, **kwargs)
+
+    def edit_message_caption(self, caption, chat_id=None, message_id=None, **kwargs):
+        self._request("edit_message_caption", chat_id)
+        return super().edit_message_caption(caption, chat_id, message_id, **kwargs)
+
+    def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+        self._request("answer_callback_query", None)
+        return super().answer_callback_query(callback_query_id, text, **kwargs)
+
+    def delete_message(self, chat_id, message_id, **kwargs):
+        self._request("delete_message", chat_id)
+        return super().delete_message(chat_id, message_id, **kwargs)
+
+    def restrict_chat_member(self, chat_id, user_id, **kwargs):
+        self._request("restrict_chat_member", chat_id)
+        return super().restrict_chat_member(chat_id, user_id, **kwargs)
+
+    def _record(self, method):
+        # counted in _request, also the rejected requests
+        pass
+
+    def errors(self):
+        """
+        :return: the number of rejected requests per method
+        """
+        errors = {}
+        for call in self.log:
+            if call.error is not None:
+                errors[call.method] = errors.get(call.method, 0) + 1
+        return errors
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+A mass join sent one captcha at a time and with `send_new_captchas`.
+One of the users can not get a captcha, the others must not notice.
+
+    python benchmarks/bench_batch.py [joiners]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from _common import FakeBot, FakeChat, fake_user, new_manager
+from pyTelegramBotCaptcha.storage import SQLiteStorage
+
+
+class FailingBot(FakeBot):
+    def send_photo(self, chat_id, photo, caption=None, reply_markup=None, **kwargs):
+        if "id=13'" in caption:
+            raise RuntimeError("Bad Request: user 13 left the chat")
+        return super().send_photo(chat_id, photo, caption, reply_markup, **kwargs)
+
+
+def main():
+    joiners = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    users = [fake_user(user_id) for user_id in range(1, joiners + 1)]
+
+    for name in ("one by one", "send_new_captchas"):
+        for pool_size in (0, joiners):
+            storage = SQLiteStorage(os.path.join(tempfile.mkdtemp(), "bench.sqlite3"))
+            manager = new_manager(
+                storage=storage, pool_size=pool_size, pool_workers=2
+            )
+            manager.warm_up()
+            bot = FailingBot()
+            chat = FakeChat(-100)
+
+            start = time.perf_counter()
+            if name == "one by one":
+                captchas, errors = [], {}
+                for user in users:
+                    try:
+                        captchas.append(manager.send_new_captcha(bot, chat, user))
+                    except Exception as e:
+                        errors[user.id] = e
+            else:
+                captchas, errors = manager.send_new_captchas(bot, chat, users)
+            elapsed = time.perf_counter() - start
+
+            saved = sum(1 for _ in storage.index(1))
+            print(
+                f"{name:<18} pool={pool_size:<4} {len(captchas)} sent, {saved} saved, "
+                f"errors {sorted(errors)} in {elapsed * 1000:7.1f} ms"
+            )
+            manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Time to render the caption of a captcha on a key press, compared to building it from the language texts.
+
+    python benchmarks/bench_caption.py
+"""
+from _common import fake_user, measure, print_row, telebot_captcha
+
+
+def legacy_caption(captcha, show_code=False):
+    # `Captcha._caption` before captions were compiled
+    language = telebot_captcha.languages[captcha.options.language]
+    chars = {"&": "&amp;", "<": "&lt;", ">": "&gt"}
+    name = captcha.user.first_name
+    for old, new in chars.items():
+        name = name.replace(old, new)
+    link = f"<a href='tg://user?id={captcha.user.id}'>{name}</a>"
+    text = language["text"].replace("#USER", link) + "\n"
+    if captcha.previous_tries > 0:
+        text += language["try_again"] + "\n"
+    text += language["your_code"]
+    if show_code:
+        text += f"<pre>{captcha.users_code}</pre>"
+    return text
+
+
+def main():
+    captcha = telebot_captcha.Captcha.__new__(telebot_captcha.Captcha)
+    captcha.options = telebot_captcha.CaptchaOptions()
+    captcha.user = fake_user(123456789, "<Bench & Co>")
+    captcha._user_link = None
+    captcha.users_code = "1A2B"
+
+    for language in ("en", "de", "ar"):
+        captcha.options.language = language
+        for tries in (0, 1):
+            captcha.previous_tries = tries
+            assert legacy_caption(captcha, True) == captcha._caption(True)
+            assert legacy_caption(captcha) == captcha._caption()
+
+    captcha.options.language = "en"
+    print_row(
+        "caption, from the language texts",
+        measure(lambda: legacy_caption(captcha, True), repeat=20000),
+    )
+    print_row(
+        "caption, compiled template",
+        measure(lambda: captcha._caption(True), repeat=20000),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Bot API calls per solved captcha of fast typists, with and without debounced caption edits.
+
+    python benchmarks/bench_edits.py [typists]
+"""
+import sys
+import time
+from threading import Thread
+
+from _common import FakeBot, FakeChat, fake_user, new_manager, press
+from pyTelegramBotCaptcha.storage import MemoryStorage
+
+KEY_DELAY = 0.08
+
+
+def type_code(manager, bot, captcha):
+    # a BACK on the empty code, a typo, the code and two presses past its end
+    buttons = ["BACK", "0", "BACK"] + list(captcha.correct_code) + ["1", "2", "OK"]
+    for button in buttons:
+        press(manager, bot, captcha, button)
+        time.sleep(KEY_DELAY)
+
+
+def run(manager, typists):
+    bot = FakeBot()
+    chat = FakeChat(-100)
+    captchas = [
+        manager.send_new_captcha(bot, chat, fake_user(user_id))
+        for user_id in range(1, typists + 1)
+    ]
+    threads = [
+        Thread(target=type_code, args=(manager, bot, captcha)) for captcha in captchas
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    solved = sum(captcha.solved for captcha in captchas)
+    return bot, solved
+
+
+def main():
+    typists = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    for interval in (0, 0.5, 1.0):
+        manager = new_manager(edit_interval=interval, storage=MemoryStorage())
+        bot, solved = run(manager, typists)
+        edits = bot.calls.get("edit_message_caption", 0)
+        calls = sum(bot.calls.values())
+        print(
+            f"edit_interval={interval:<4} {solved} solved, "
+            f"{edits / solved:5.1f} caption edits and {calls / solved:5.1f} API calls per captcha"
+        )
+        print(f"{'':<18}{manager.edit_stats()}")
+        manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Encode time and upload size of the captcha image per generator and image format.
+
+    python benchmarks/bench_encoding.py
+"""
+from _common import measure, setup_fonts, summary, telebot_captcha
+
+
+def main():
+    setup_fonts()
+    print(f"{'generator':<11} {'format':<6} {'quality':>7} {'encode':>10} {'bytes':>8}")
+    for generator in ("default", "multicolor", "math"):
+        options = telebot_captcha.CaptchaOptions(generator=generator)
+        # render once, without encoding
+        options.image_format = "PNG"
+        code, _ = telebot_captcha._random_codeimage(options)
+        if generator == "default":
+            image = telebot_captcha._add_noise(
+                telebot_captcha._image_captcha().generate_image(code)
+            )
+        elif generator == "multicolor":
+            image = telebot_captcha.captcha_generator.gen_captcha_image(
+                difficult_level=2, multicolor=True, chars_mode="hex"
+            )["image"]
+        else:
+            image = telebot_captcha.captcha_generator.gen_math_captcha_image()["image"]
+
+        for image_format, quality in (
+            ("PNG", None),
+            ("JPEG", 95),
+            ("JPEG", 85),
+            ("JPEG", 70),
+            ("WEBP", 85),
+            ("WEBP", 70),
+        ):
+            encode = lambda: telebot_captcha._encode_image(image, image_format, quality)
+            timings = measure(encode, repeat=30)
+            size = len(encode())
+            print(
+                f"{generator:<11} {image_format:<6} {quality or '-':>7} "
+                f"{summary(timings)['median_ms']:7.2f} ms {size:>8}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Photo uploads of a join raid with and without the file_id library.
+The fake bot hands out a file_id for every uploaded image, like Telegram does.
+
+    python benchmarks/bench_file_id.py
+"""
+import time
+
+from _common import FakeBot, FakeChat, fake_user, new_manager, press
+
+
+def raid(manager, joins=200):
+    bot = FakeBot()
+    chat = FakeChat(-100)
+    start = time.perf_counter()
+    for user_id in range(1, joins + 1):
+        captcha = manager.send_new_captcha(bot, chat, fake_user(user_id))
+        if user_id % 10 == 0:
+            press(manager, bot, captcha, "RELOAD")
+        manager._cancel_timeout(captcha)
+    return bot, time.perf_counter() - start
+
+
+def main():
+    for kwargs in ({}, {"library_size": 16, "library_max_uses": 10}):
+        manager = new_manager(**kwargs)
+        bot, elapsed = raid(manager)
+        sends = bot.calls["send_photo"] + bot.calls.get("edit_message_media", 0)
+        name = "with library" if kwargs else "without library"
+        print(
+            f"{name:<16} {sends} photos sent, {bot.uploads} uploaded "
+            f"({bot.upload_bytes / 1024:.0f} KiB) in {elapsed:.2f} s"
+        )
+        if manager.library:
+            print(f"{'':<16} {manager.library_stats()}")
+        manager.close()
+
+
+if __name__ == "__main__":
+    main()
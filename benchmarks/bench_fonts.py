@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+Render time of the `default` generator with a cold and a warm font/renderer cache.
+A cold cache is what every captcha paid before the cache existed.
+
+    python benchmarks/bench_fonts.py
+"""
+from _common import measure, print_row, setup_fonts, summary, telebot_captcha
+
+
+def _clear_cache():
+    telebot_captcha._renderer_cache.clear()
+
+
+def main():
+    fonts = setup_fonts()
+    options = telebot_captcha.CaptchaOptions(add_noise=False)
+    print(f"{len(fonts)} fonts x {len(telebot_captcha.FONT_SIZES)} sizes")
+
+    def cold():
+        _clear_cache()
+        telebot_captcha._random_codeimage(options)
+
+    def warm():
+        telebot_captcha._random_codeimage(options)
+
+    cold_timings = measure(cold, repeat=30)
+    telebot_captcha.preload_fonts(fonts)
+    warm_timings = measure(warm, repeat=30)
+
+    print_row("render, cold font cache", cold_timings)
+    print_row("render, warm font cache", warm_timings)
+    saved = summary(cold_timings)["median_ms"] - summary(warm_timings)["median_ms"]
+    print(f"saved per captcha: {saved:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+The keyzend client against a local stand-in of the keyzend server:
+latency of a bare `requests.get` and of the pooled client, prefetching,
+and the circuit breaker falling back to the local generator while the server is slow or down.
+
+    python benchmarks/bench_keyzend.py
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import requests
+
+from _common import find_fonts, measure, print_row, telebot_captcha
+from pyTelegramBotCaptcha.keyzend import KeyzendClient
+
+IMAGE = telebot_captcha._random_codeimage(
+    telebot_captcha.CaptchaOptions(), find_fonts()
+)[1]
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    mode = "ok"
+    requests = 0
+
+    def handle_error(self, request, client_address):
+        # the client gave up on a slow response
+        pass
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.server.requests += 1
+        if self.server.mode == "down":
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.server.mode == "slow":
+            time.sleep(2)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("answer", "abcde")
+        self.send_header("Content-Length", str(len(IMAGE)))
+        self.end_headers()
+        self.wfile.write(IMAGE)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_keyzend():
+    """
+    Starts a stand-in of the keyzend server on a free local port.
+    :return: (server, url). Set `server.mode` to "ok", "slow" or "down".
+    """
+    server = Server(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/captcha.png"
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    telebot_captcha._fonts = find_fonts()
+    server, url = start_keyzend()
+
+    options = telebot_captcha.CaptchaOptions()
+    options.generator = "keyzend"
+
+    print_row("requests.get per captcha", measure(lambda: requests.get(url), 50))
+    client = KeyzendClient(url, timeout=(0.5, 0.5), reset_timeout=1)
+    telebot_captcha._keyzend = client
+    print_row(
+        "pooled client per captcha",
+        measure(lambda: telebot_captcha._random_codeimage(options), 50),
+    )
+    client.close()
+
+    client = KeyzendClient(url, timeout=(0.5, 0.5), prefetch=8, reset_timeout=1)
+    telebot_captcha._keyzend = client
+    time.sleep(0.5)
+    print_row(
+        "prefetched captcha",
+        measure(lambda: telebot_captcha._random_codeimage(options), 8, warmup=0),
+    )
+
+    for mode in ("slow", "down", "ok"):
+        server.mode = mode
+        time.sleep(1.5)
+        before = server.requests
+        timings, codes = [], []
+        for _ in range(10):
+            (code, _), ms = timed(lambda: telebot_captcha._random_codeimage(options))
+            timings.append(ms)
+            codes.append(code)
+        local = sum(code != "ABCDE" for code in codes)
+        print(
+            f"server {mode:<5} {client.state:<9} max {max(timings):7.1f} ms, "
+            f"{local}/10 rendered locally, {server.requests - before} requests to keyzend"
+        )
+    print(client.stats())
+    client.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Several bots in one process, each with its own `CaptchaManager`.
+The same users join the same chat id of every bot and solve their captchas.
+Every manager must only see the captchas of its own bot.
+The managers either start their own pool and timeout threads or share those of the first one.
+
+    python benchmarks/bench_managers.py [bots] [joiners]
+"""
+import sys
+import threading
+import time
+
+from _common import FakeBot, FakeChat, fake_user, new_manager, press
+
+
+def run(bots, joiners, shared):
+    threads_before = threading.active_count()
+    managers = []
+    solved = {}
+    for bot_id in range(1, bots + 1):
+        manager = new_manager(
+            bot_id=bot_id,
+            pool_size=8,
+            pool_workers=2,
+            share_with=managers[0] if shared and managers else None,
+        )
+        solved[bot_id] = []
+        manager.on_captcha_correct(
+            lambda captcha, bot_id=bot_id: solved[bot_id].append(captcha)
+        )
+        managers.append(manager)
+    for manager in managers:
+        manager.warm_up()
+    threads = threading.active_count() - threads_before
+
+    chat = FakeChat(-100)
+    start = time.perf_counter()
+    for manager in managers:
+        bot = FakeBot()
+        for user_id in range(1, joiners + 1):
+            captcha = manager.send_new_captcha(bot, chat, fake_user(user_id))
+            for button in list(captcha.correct_code) + ["OK"]:
+                press(manager, bot, captcha, button)
+    elapsed = time.perf_counter() - start
+
+    isolated = all(
+        len(solved[bot_id]) == joiners
+        and all(c._captcha_id.startswith(f"{bot_id}=") for c in solved[bot_id])
+        for bot_id in solved
+    )
+    pending = sum(manager.pending_timeouts for manager in managers)
+    for manager in managers:
+        manager.close()
+    time.sleep(0.2)
+    left = threading.active_count() - threads_before
+    return threads, elapsed, isolated, pending, left
+
+
+def main():
+    bots = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    joiners = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    for shared in (False, True):
+        threads, elapsed, isolated, pending, left = run(bots, joiners, shared)
+        name = "shared" if shared else "one per bot"
+        print(
+            f"{bots} managers, {name:<12} {threads:3d} threads   "
+            f"{bots * joiners} solved in {elapsed * 1000:7.1f} ms   "
+            f"isolated {isolated}   pending timeouts {pending}   "
+            f"threads after close {left}"
+        )
+
+
+if __name__ == "__main__":
+    main()
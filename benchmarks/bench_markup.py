@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Build and serialization time of the captcha keyboard, compared to building every button
+again, and its size with the callback data of version 1.1.4 (`?cap={user_id}={button}`).
+
+    python benchmarks/bench_markup.py
+"""
+from _common import fake_user, measure, print_row, telebot_captcha
+
+from telebot import types
+
+
+def old_callback_data(captcha, button):
+    return f"?cap={captcha.user.id}={button}"
+
+
+def callback_data(captcha, button):
+    return telebot_captcha._callback_data(button).replace(
+        telebot_captcha._HANDLE, captcha.handle
+    )
+
+
+def legacy_code_input_markup(captcha, data=callback_data):
+    # `_code_input_markup` before keyboard templates were cached
+    values = {}
+    row_width = 5
+    display_attempts_left = captcha.options.max_attempts - captcha.previous_tries
+    if captcha.options.max_incorrect_to_auto_reload <= 0:
+        display_attempts_left = 0
+    display_attempts_left = (
+        "" if display_attempts_left <= 0 else str(display_attempts_left)
+    )
+    chars = (
+        telebot_captcha.digits
+        if captcha.options.only_digits
+        else telebot_captcha.hexdigits
+    )
+    for char in chars:
+        values[char] = {"callback_data": data(captcha, char)}
+    if not captcha.options.only_digits:
+        row_width = 4
+    if captcha.user_reloads_left > 0:
+        values[f"🔄 {captcha.user_reloads_left}"] = {
+            "callback_data": data(captcha, "RELOAD")
+        }
+    values = {
+        **values,
+        "⬅️": {"callback_data": data(captcha, "BACK")},
+        f"✅ {display_attempts_left}": {"callback_data": data(captcha, "OK")},
+    }
+    markup = types.InlineKeyboardMarkup(row_width=row_width)
+    markup.add(
+        *(types.InlineKeyboardButton(text=t, **kwargs) for t, kwargs in values.items())
+    )
+    return markup
+
+
+class StubCaptcha:
+    def __init__(self, user_id, only_digits):
+        self.options = telebot_captcha.CaptchaOptions()
+        self.options.only_digits = only_digits
+        self.user = fake_user(user_id)
+        self.handle = telebot_captcha._base36(user_id)
+        self.previous_tries = 1
+        self.user_reloads_left = 2
+        self.correct_code = "0" * self.options.code_length
+
+
+def main():
+    for only_digits in (True, False):
+        captcha = StubCaptcha(123456789, only_digits)
+        legacy = legacy_code_input_markup(captcha).to_json()
+        cached = telebot_captcha._code_input_markup(captcha).to_json()
+        assert legacy == cached, (legacy, cached)
+        old = legacy_code_input_markup(captcha, old_callback_data).to_json()
+
+        name = "digits" if only_digits else "hexdigits"
+        print(
+            f"{name}: keyboard {len(old.encode())} bytes with the old callback data, "
+            f"{len(cached.encode())} bytes now"
+        )
+        print_row(
+            f"{name}: build + to_json, per button",
+            measure(
+                lambda: legacy_code_input_markup(captcha).to_json(), repeat=2000
+            ),
+        )
+        print_row(
+            f"{name}: build + to_json, template",
+            measure(
+                lambda: telebot_captcha._code_input_markup(captcha).to_json(),
+                repeat=2000,
+            ),
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Memory per pending captcha (tracemalloc), with 10k captchas waiting to be solved.
+Every captcha gets its own copy of one rendered image, so rendering does not dominate the run.
+The chats and users count as well if a captcha keeps them.
+
+    python benchmarks/bench_memory.py [captchas]
+"""
+import sys
+import tracemalloc
+
+from _common import FakeBot, fake_user, new_manager, telebot_captcha
+from pyTelegramBotCaptcha.storage import MemoryStorage
+
+from telebot import types
+
+
+class NullStorage(MemoryStorage):
+    # keeps nothing, only the captchas themselves are measured
+    def save(self, captcha_id, data, deadline=None):
+        pass
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    manager = new_manager(storage=NullStorage(), registry_size=0)
+    code, image = manager._shared.render(manager.default_options)
+    manager._new_photo = lambda options, exclude=None: (
+        code,
+        bytes(bytearray(image)),
+        None,
+    )
+
+    bot = FakeBot()
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for i in range(count):
+        # what the bot gets from the update, it is only kept if the captcha keeps it
+        chat = types.Chat.de_json({"id": -1000 - i, "type": "supergroup"})
+        manager.send_new_captcha(bot, chat, fake_user(i + 1))
+    del chat
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    print(
+        f"{count} pending captchas: {size / 2 ** 20:.1f} MiB, "
+        f"{size / count:.0f} bytes per captcha"
+    )
+    print(f"image: {len(image)} bytes ({manager.default_options.image_format})")
+    for stat in after.compare_to(before, "lineno")[:8]:
+        print(f"  {stat}")
+    manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+The metrics of a join raid against a slow Bot API that sometimes fails,
+exported in the Prometheus text format, and the cost of recording them.
+
+    python benchmarks/bench_metrics.py [joiners]
+"""
+import random
+import re
+import sys
+import time
+
+from _common import FakeBot, FakeChat, fake_user, new_manager, press
+from pyTelegramBotCaptcha.metrics import Histogram
+
+SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-z_]+="[^"]*",?)*\})? \S+$')
+
+
+class SlowBot(FakeBot):
+    """
+    Every request takes 5-30 ms, some much longer. One in 20 caption edits fails.
+    """
+
+    def _wait(self):
+        delay = random.uniform(0.005, 0.03)
+        if random.random() < 0.02:
+            delay += 0.2
+        time.sleep(delay)
+
+    def send_photo(self, *args, **kwargs):
+        self._wait()
+        return super().send_photo(*args, **kwargs)
+
+    def edit_message_caption(self, *args, **kwargs):
+        self._wait()
+        if random.random() < 0.05:
+            raise RuntimeError("Too Many Requests: retry after 1")
+        return super().edit_message_caption(*args, **kwargs)
+
+    def delete_message(self, *args, **kwargs):
+        self._wait()
+        return super().delete_message(*args, **kwargs)
+
+
+def main():
+    joiners = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    manager = new_manager()
+    manager.on_captcha_correct(lambda c: manager.delete_captcha(bot, c))
+    manager.on_captcha_not_correct(lambda c: manager.delete_captcha(bot, c))
+    bot = SlowBot()
+    chat = FakeChat(-100)
+
+    captchas = [
+        manager.send_new_captcha(bot, chat, fake_user(user_id))
+        for user_id in range(1, joiners + 1)
+    ]
+    for i, captcha in enumerate(captchas):
+        # every fourth user gets it wrong
+        code = captcha.correct_code if i % 4 else "0" * len(captcha.correct_code)
+        for button in list(code) + ["OK"]:
+            press(manager, bot, captcha, button)
+
+    text = manager.metrics.to_prometheus()
+    invalid = [
+        line
+        for line in text.splitlines()
+        if not line.startswith("#") and not SAMPLE.match(line)
+    ]
+    print(text)
+    print(f"{len(text.splitlines())} lines, {len(invalid)} invalid: {invalid[:3]}")
+
+    api = manager.metrics["captcha_telegram_request_seconds"]
+    for method in ("send_photo", "edit_message_caption"):
+        print(
+            f"{method:<22} p50 {api.quantile(0.5, method) * 1000:6.1f} ms   "
+            f"p99 {api.quantile(0.99, method) * 1000:6.1f} ms"
+        )
+
+    histogram = Histogram("bench_seconds", "bench", ("label",))
+    n = 200000
+    start = time.perf_counter()
+    for i in range(n):
+        histogram.observe(0.0123, "send_photo")
+    elapsed = time.perf_counter() - start
+    print(f"Histogram.observe: {elapsed / n * 1e9:.0f} ns per observation")
+    manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Time spent in `send_new_captcha` with and without the pre-rendered captcha pool.
+
+    python benchmarks/bench_pool.py
+"""
+import itertools
+import tempfile
+import time
+
+from _common import FakeBot, FakeChat, fake_user, find_fonts, print_row, telebot_captcha
+
+
+def main():
+    telebot_captcha._captcha_saves = telebot_captcha.Path(tempfile.mkdtemp())
+    manager = telebot_captcha.CaptchaManager(
+        1, fonts=find_fonts(), pool_size=32, pool_low_water=16, pool_workers=2
+    )
+    manager.on_captcha_correct(lambda captcha: None)
+    manager.on_captcha_not_correct(lambda captcha: None)
+    manager.on_captcha_timeout(lambda captcha: None)
+
+    bot = FakeBot()
+    chat = FakeChat(-100)
+    user_ids = itertools.count(1)
+    pool = manager.pool
+
+    def send():
+        captcha = manager.send_new_captcha(bot, chat, fake_user(next(user_ids)))
+        manager._cancel_timeout(captcha)
+
+    def measure_sends(n):
+        timings = []
+        for _ in range(n):
+            start = time.perf_counter()
+            send()
+            timings.append(time.perf_counter() - start)
+            # a join every 50ms, a small raid
+            time.sleep(0.05)
+        return sorted(timings)
+
+    manager.pool = None
+    print_row("send_new_captcha without pool", measure_sends(20))
+
+    manager.pool = pool
+    start = time.perf_counter()
+    manager.warm_up()
+    print(f"warm_up: {time.perf_counter() - start:.2f} s")
+    print_row("send_new_captcha with pool", measure_sends(20))
+    print(manager.pool_stats())
+    pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Render throughput (captchas per second) of a burst of joins, in threads and in 1..N worker processes.
+
+    python benchmarks/bench_processes.py [captchas] [max_processes]
+"""
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from _common import new_manager, telebot_captcha
+
+# the worker threads of TeleBot that handle the join updates
+THREADS = 8
+
+
+def throughput(manager, options, count):
+    with ThreadPoolExecutor(THREADS) as threads:
+        start = time.perf_counter()
+        results = list(threads.map(manager._new_codeimage, [options] * count))
+        elapsed = time.perf_counter() - start
+    assert all(isinstance(image, bytes) for _, image in results)
+    return count / elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    max_processes = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1
+    print(f"{os.cpu_count()} cores, {THREADS} threads, {count} captchas per run")
+
+    for generator in ("default", "multicolor"):
+        options = telebot_captcha.CaptchaOptions()
+        options.generator = generator
+        for processes in range(max_processes + 1):
+            manager = new_manager(render_processes=processes)
+            # the first render of a process loads its fonts
+            throughput(manager, options, processes or 1)
+            rate = throughput(manager, options, count)
+            name = f"{processes} processes" if processes else "threads only"
+            print(f"{generator:<12} {name:<14} {rate:7.1f} captchas/s")
+            manager.close()
+
+
+if __name__ == "__main__":
+    main()
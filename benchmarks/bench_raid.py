@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+A join raid against a `CaptchaManager`, with an in-memory stand-in for the Bot API
+(`_fake_telegram.py`) that has latency and answers with 429 like Telegram.
+
+Users join at `--rate` per second (a Poisson process) and are handled by `--threads`
+worker threads, like the update workers of a `TeleBot`. Most of them are bots of the
+raid that never press a button, the humans type their code key by key and some get it
+wrong. `--speed` divides the think times of the users and the captcha timeout, the join
+rate and the latency of the Bot API stay real.
+
+Reported: the handler latency (from the arrival of an update until its handler returned)
+per kind of update, the threads and the memory of the process and the Bot API requests
+per join.
+
+    python benchmarks/bench_raid.py --joins 2000 --rate 50 --chat-limit 20 --speed 5
+"""
+import argparse
+import heapq
+import queue
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+
+from _common import FakeChat, fake_user, new_manager, press
+from _fake_telegram import FakeTelegram
+from pyTelegramBotCaptcha import CaptchaOptions
+from pyTelegramBotCaptcha.storage import MemoryStorage
+
+
+def rss_mb():
+    # the resident memory of the process: the current one on Linux, else the peak
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * 4096 / 2 ** 20
+    except OSError:
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+class Raid:
+    def __init__(self, args, bot, manager):
+        self.args = args
+        self.bot = bot
+        self.manager = manager
+        self.random = random.Random(args.seed)
+        self.chats = [FakeChat(-100 - i) for i in range(args.chats)]
+        self.options = CaptchaOptions()
+        # below the minimum timeout of the options, to compress the time
+        self.options._timeout = args.timeout / args.speed
+        # (due, sequence, kind, arguments) of the updates that did not arrive yet
+        self._events = []
+        self._sequence = 0
+        self._condition = threading.Condition()
+        self._updates = queue.Queue()
+        self._open = 0
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.outcomes = Counter()
+        self.sent = 0
+        self._lock = threading.Lock()
+
+    def at(self, due, kind, *args):
+        with self._condition:
+            self._sequence += 1
+            self._open += 1
+            heapq.heappush(self._events, (due, self._sequence, kind, args))
+            self._condition.notify()
+
+    def think(self, seconds):
+        # a lognormal think time of a user with the given median
+        return self.random.lognormvariate(0, 0.4) * seconds / self.args.speed
+
+    def run(self):
+        start = time.monotonic()
+        due = start
+        for user_id in range(1, self.args.joins + 1):
+            due += self.random.expovariate(self.args.rate)
+            self.at(due, "join", self.random.choice(self.chats), fake_user(user_id))
+        workers = [
+            threading.Thread(target=self._work, daemon=True)
+            for _ in range(self.args.threads)
+        ]
+        for worker in workers:
+            worker.start()
+        self._dispatch()
+        for _ in workers:
+            self._updates.put(None)
+        for worker in workers:
+            worker.join()
+        return time.monotonic() - start
+
+    def _dispatch(self):
+        # hands the updates to the workers when they arrive
+        while True:
+            with self._condition:
+                if not self._open:
+                    return
+                if not self._events:
+                    self._condition.wait()
+                    continue
+                wait = self._events[0][0] - time.monotonic()
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+                event = heapq.heappop(self._events)
+            self._updates.put(event)
+
+    def _work(self):
+        while True:
+            event = self._updates.get()
+            if event is None:
+                return
+            due, _, kind, args = event
+            try:
+                getattr(self, "_" + kind)(*args)
+            except Exception as e:
+                with self._lock:
+                    self.errors[kind, type(e).__name__] += 1
+            self.latencies[kind].append(time.monotonic() - due)
+            with self._condition:
+                self._open -= 1
+                self._condition.notify()
+
+    def _join(self, chat, user):
+        self.manager.restrict_chat_member(self.bot, chat.id, user.id)
+        captcha = self.manager.send_new_captcha(self.bot, chat, user, self.options)
+        kind = self.random.random()
+        if kind < self.args.humans * (1 - self.args.typos):
+            user_kind, code = "human", captcha.correct_code
+        elif kind < self.args.humans:
+            length = len(captcha.correct_code)
+            user_kind = "typo"
+            code = "".join(self.random.choice("0123456789") for _ in range(length))
+        else:
+            user_kind, code = "raid bot", None
+        with self._lock:
+            self.sent += 1
+            self.outcomes[user_kind] += 1
+        if code is None:
+            return
+        self.at(time.monotonic() + self.think(3), "press", captcha, list(code) + ["OK"])
+
+    def _press(self, captcha, buttons):
+        press(self.manager, self.bot, captcha, buttons[0])
+        # the message of a deleted captcha is gone, its user can not press any more
+        deleted = self.manager.captchas.get(captcha._captcha_id) is not captcha
+        if len(buttons) > 1 and not deleted:
+            delay = self.think(1.5 if len(buttons) == 2 else 0.5)
+            self.at(time.monotonic() + delay, "press", captcha, buttons[1:])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--joins", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=50, help="joins per second")
+    parser.add_argument("--chats", type=int, default=1, help="groups the raid joins")
+    parser.add_argument("--threads", type=int, default=4, help="update worker threads")
+    parser.add_argument(
+        "--humans", type=float, default=0.3, help="share of the joins that type a code"
+    )
+    parser.add_argument(
+        "--typos", type=float, default=0.2, help="share of the humans that get it wrong"
+    )
+    parser.add_argument("--timeout", type=float, default=90, help="captcha timeout")
+    parser.add_argument(
+        "--speed", type=float, default=1, help="divides think times and the timeout"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="median Bot API latency in seconds"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="share of random 429 answers"
+    )
+    parser.add_argument(
+        "--chat-limit", type=int, default=0, help="messages per minute and chat, 0: any"
+    )
+    parser.add_argument("--pool-size", type=int, default=0)
+    parser.add_argument("--edit-interval", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    bot = FakeTelegram(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        chat_limit=args.chat_limit,
+        seed=args.seed,
+    )
+    manager = new_manager(
+        storage=MemoryStorage(),
+        pool_size=args.pool_size,
+        edit_interval=args.edit_interval,
+    )
+
+    def correct(captcha):
+        manager.unrestrict_chat_member(bot, captcha.chat.id, captcha.user.id)
+        manager.delete_captcha(bot, captcha)
+
+    manager.on_captcha_correct(correct)
+    manager.on_captcha_not_correct(lambda captcha: manager.delete_captcha(bot, captcha))
+    manager.on_captcha_timeout(lambda captcha: manager.delete_captcha(bot, captcha))
+
+    raid = Raid(args, bot, manager)
+    samples = []
+    running = threading.Event()
+    running.set()
+
+    def sample():
+        while running.is_set():
+            samples.append((threading.active_count(), rss_mb()))
+            time.sleep(0.1)
+
+    rss_before = rss_mb()
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    elapsed = raid.run()
+    # the captchas of the raid bots time out after the last update
+    deadline = time.monotonic() + raid.options.timeout + 2
+    while manager.pending_timeouts and time.monotonic() < deadline:
+        time.sleep(0.1)
+    running.clear()
+    sampler.join()
+
+    results = manager.metrics["captcha_results_total"]
+    solved, failed, timed_out = (
+        results.value(result) for result in ("solved", "failed", "timeout")
+    )
+    print(
+        f"{args.joins} joins at {args.rate:g}/s into {args.chats} chat(s), "
+        f"{args.threads} threads: updates handled in {elapsed:.1f} s"
+    )
+    print(f"users: {dict(raid.outcomes)}")
+    print(
+        f"captchas: {raid.sent} sent, {solved:.0f} solved, {failed:.0f} failed, "
+        f"{timed_out:.0f} timed out, {len(manager.captchas)} left in memory"
+    )
+    stale = manager.metrics["captcha_stale_callbacks_total"].value()
+    print(f"{stale:.0f} button presses on captchas that were deleted or timed out")
+    for kind, latencies in sorted(raid.latencies.items()):
+        print(
+            f"{kind:<6} {len(latencies):6} updates   "
+            f"p50 {percentile(latencies, 0.5) * 1000:8.1f} ms   "
+            f"p99 {percentile(latencies, 0.99) * 1000:8.1f} ms   "
+            f"max {max(latencies) * 1000:8.1f} ms"
+        )
+    for (kind, error), count in sorted(raid.errors.items()):
+        print(f"{kind:<6} {count:6} failed with {error}")
+    threads = [count for count, _ in samples]
+    memory = [mb for _, mb in samples]
+    print(
+        f"threads: max {max(threads)}, at the end {threading.active_count()}   "
+        f"memory: {rss_before:.0f} MB before, peak {max(memory):.0f} MB, "
+        f"at the end {rss_mb():.0f} MB"
+    )
+    rejected = bot.errors()
+    print("Bot API requests per join:")
+    for method, count in sorted(bot.calls.items()):
+        print(
+            f"  {method:<22} {count / args.joins:6.2f}   "
+            f"({rejected.get(method, 0)} rejected)"
+        )
+    manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Encode and decode throughput and bytes per saved captcha:
+the JSON of `to_json()` (saved up to version 1.1.x) against the compact `to_record()`,
+for captchas with the default options, an options profile and options that are not one.
+
+    python benchmarks/bench_records.py
+"""
+from _common import FakeBot, FakeChat, fake_user, measure, new_manager, press
+from pyTelegramBotCaptcha import CaptchaOptions
+from pyTelegramBotCaptcha import telebot_captcha
+from pyTelegramBotCaptcha.telebot_captcha import Captcha
+
+N = 2000
+
+
+def per_second(function):
+    timings = measure(lambda: [function() for _ in range(N)], repeat=10)
+    return N / timings[len(timings) // 2]
+
+
+def main():
+    profile = CaptchaOptions(timeout=120, code_length=6, only_digits=True)
+    manager = new_manager(options_profiles={"strict": profile})
+    bot = FakeBot()
+    chat = FakeChat(-1001234567890, title="A group with a longer title")
+    captchas = {
+        "default options": manager.send_new_captcha(bot, chat, fake_user(1)),
+        "options profile": manager.send_new_captcha(bot, chat, fake_user(2), profile),
+        "other options": manager.send_new_captcha(
+            bot, chat, fake_user(3), CaptchaOptions(language="de")
+        ),
+    }
+    backend = "orjson" if telebot_captcha.orjson else telebot_captcha.json.__name__
+    print(f"JSON library: {backend}")
+    for name, captcha in captchas.items():
+        # a user typed half of the code
+        for button in captcha.correct_code[: len(captcha.correct_code) // 2]:
+            press(manager, bot, captcha, button)
+        old, new = captcha.to_json(), captcha.to_record()
+        print(f"{name}: {len(old.encode())} -> {len(new.encode())} bytes per record")
+        for label, encode, decode, data in (
+            ("to_json/de_json", captcha.to_json, Captcha.de_json, old),
+            ("to_record/from_record", captcha.to_record, Captcha.from_record, new),
+        ):
+            print(
+                f"  {label:<22} encode {per_second(encode):9.0f}/s   "
+                f"decode {per_second(lambda: decode(data, manager)):9.0f}/s"
+            )
+    manager.close()
+
+
+if __name__ == "__main__":
+    main()
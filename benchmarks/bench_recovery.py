@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Startup time of `CaptchaManager` against the number of saved captchas.
+Half of the saved captchas timed out an hour ago.
+"Eager" is the recovery used up to version 1.1.4: every file is parsed at startup.
+
+    python benchmarks/bench_recovery.py
+"""
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from _common import find_fonts, telebot_captcha
+from pyTelegramBotCaptcha.storage import DirectoryStorage, SQLiteStorage
+
+RECORD = (
+    '{"chat": {"id": -100, "type": "supergroup", "title": "bench", "username": null}, '
+    '"user": {"id": %d, "is_bot": false, "first_name": "Bench"}, "users_code": "", '
+    '"correct_code": "1A2B3C4D", "message_id": 42, "date": %d, "captcha_id": "%s", '
+    '"previous_tries": 0, "user_reloads_left": 2, "options": null}'
+)
+
+
+def fill(storage, count):
+    now = int(time.time())
+    items = []
+    for user_id in range(count):
+        captcha_id = f"1=-100={user_id}"
+        date = now - 3600 if user_id % 2 else now
+        items.append((captcha_id, RECORD % (user_id, date, captcha_id), date + 600))
+    storage.save_many(items)
+
+
+def start_manager(storage):
+    start = time.perf_counter()
+    manager = telebot_captcha.CaptchaManager(1, fonts=find_fonts(), storage=storage)
+    elapsed = time.perf_counter() - start
+    manager.close()
+    return elapsed, len(manager._unloaded)
+
+
+def eager(storage, manager):
+    start = time.perf_counter()
+    captchas = [
+        telebot_captcha.Captcha.de_json(s, manager) for s in storage.load_all(1)
+    ]
+    return time.perf_counter() - start, len(captchas)
+
+
+def main():
+    # the default options are needed to parse captchas without own options
+    parser = telebot_captcha.CaptchaManager(
+        1, fonts=find_fonts(), storage=DirectoryStorage(tempfile.mkdtemp())
+    )
+    parser.close()
+    for count in (100, 1000, 10000):
+        for name, factory in (
+            ("DirectoryStorage", lambda path: DirectoryStorage(path / "saves")),
+            ("SQLiteStorage", lambda path: SQLiteStorage(path / "saves.sqlite3")),
+        ):
+            workdir = Path(tempfile.mkdtemp())
+            try:
+                fill(factory(workdir), count)
+                eager_time, eager_loaded = eager(factory(workdir), parser)
+                lazy_time, pending = start_manager(factory(workdir))
+                print(
+                    f"{name:<17} {count:>6} saved: eager {eager_time * 1000:8.1f} ms "
+                    f"({eager_loaded} parsed)   lazy {lazy_time * 1000:8.1f} ms "
+                    f"({count - pending} purged, {pending} indexed)"
+                )
+            finally:
+                shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+A soak test: captchas are sent, solved and timed out for `--duration` seconds and
+the handlers never delete them, like a bot that only restricts and unrestricts users.
+Every `--interval` seconds it prints the captchas in memory, the saved records and
+the memory of the process. With the registry limits both stay flat, with
+`--no-eviction` (the behaviour before) they grow for the whole run.
+
+Saved captchas of a "crashed" earlier run that timed out long ago are added after the
+start, the sweep deletes them.
+
+It exits with status 1 if the second half of the run keeps more captchas in memory or
+in the storage than were sent in the last timeout + registry ttl + two sweep intervals
+(so `--no-eviction` fails).
+
+    python benchmarks/bench_soak.py --duration 600 --rate 100
+    python benchmarks/bench_soak.py --duration 60 --no-eviction
+"""
+import argparse
+import gc
+import random
+import sys
+import time
+
+from _common import FakeBot, FakeChat, fake_user, new_manager, press, telebot_captcha
+from bench_raid import rss_mb
+from pyTelegramBotCaptcha import CaptchaOptions
+from pyTelegramBotCaptcha.storage import MemoryStorage
+
+
+def slope(points):
+    # least squares slope of (x, y) points
+    n = len(points)
+    if n < 2:
+        return 0.0
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    covariance = sum((x - mean_x) * (y - mean_y) for x, y in points)
+    return covariance / variance if variance else 0.0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=float, default=120, help="seconds")
+    parser.add_argument("--rate", type=float, default=50, help="joins per second")
+    parser.add_argument("--solve", type=float, default=0.5, help="share that solve")
+    parser.add_argument("--timeout", type=float, default=5, help="captcha timeout")
+    parser.add_argument("--interval", type=float, default=10, help="seconds per line")
+    parser.add_argument("--registry-size", type=int, default=10000)
+    parser.add_argument("--registry-ttl", type=float, default=5)
+    parser.add_argument("--sweep-interval", type=float, default=2)
+    parser.add_argument("--recovery-grace", type=float, default=30)
+    parser.add_argument(
+        "--orphans", type=int, default=5000, help="saves of a crashed earlier run"
+    )
+    parser.add_argument(
+        "--no-eviction", action="store_true", help="keep every captcha, never sweep"
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args(argv)
+
+
+def bound(args):
+    # a captcha is kept until it timed out, its ttl ran out and a sweep dropped it
+    return args.rate * (args.timeout + args.registry_ttl + 2 * args.sweep_interval)
+
+
+def soak(args):
+    """
+    Sends captchas for `args.duration` seconds and prints a line every `args.interval`.
+    :return: the samples (seconds, captchas in memory, records, RSS MB)
+    """
+    limits = {
+        "registry_size": args.registry_size,
+        "registry_ttl": args.registry_ttl,
+        "sweep_interval": args.sweep_interval,
+    }
+    if args.no_eviction:
+        limits = {"registry_size": 0, "registry_ttl": float("inf"), "sweep_interval": 0}
+    storage = MemoryStorage()
+    manager = new_manager(
+        storage=storage,
+        **limits,
+        recovery_grace=args.recovery_grace,
+    )
+    # one rendered image for all, rendering would limit the rate
+    code, image = manager._shared.render(manager.default_options)
+    manager._new_photo = lambda options, exclude=None: (
+        code,
+        bytes(bytearray(image)),
+        None,
+    )
+    old = time.time() - args.recovery_grace - 3600
+    storage.save_many(
+        (f"1=-300={user_id}", "[]", old) for user_id in range(args.orphans)
+    )
+
+    bot = FakeBot()
+    chat = FakeChat(-200)
+    options = CaptchaOptions()
+    # below the minimum timeout of the options, to compress the time
+    options._timeout = args.timeout
+    rng = random.Random(args.seed)
+
+    print(
+        f"{'seconds':>8} {'sent':>8} {'in memory':>10} {'finished':>9} "
+        f"{'records':>8} {'evicted':>8} {'purged':>7} {'RSS MB':>7}"
+    )
+    evictions = manager.metrics["captcha_evictions_total"]
+    purged = manager.metrics["captcha_purged_total"]
+    samples = []
+    start = time.monotonic()
+    next_sample = start
+    sent = 0
+    while True:
+        now = time.monotonic()
+        if now >= next_sample:
+            gc.collect()
+            elapsed = now - start
+            records = sum(1 for _ in storage.index(1))
+            evicted = sum(evictions.value(r) for r in ("ttl", "finished", "pending"))
+            samples.append((elapsed, len(manager.captchas), records, rss_mb()))
+            print(
+                f"{elapsed:8.0f} {sent:8} {len(manager.captchas):10} "
+                f"{manager.captchas.finished:9} {records:8} {evicted:8.0f} "
+                f"{purged.value():7.0f} {rss_mb():7.1f}",
+                flush=True,
+            )
+            next_sample += args.interval
+            if elapsed >= args.duration:
+                break
+        sent += 1
+        captcha = manager.send_new_captcha(bot, chat, fake_user(sent), options)
+        if rng.random() < args.solve:
+            for button in list(captcha.correct_code) + ["OK"]:
+                press(manager, bot, captcha, button)
+        time.sleep(max(0.0, start + sent / args.rate - time.monotonic()))
+    manager.close()
+    return samples
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    samples = soak(args)
+
+    # after the first timeouts and evictions the numbers should be flat
+    half = [sample for sample in samples if sample[0] >= args.duration / 2]
+    per_minute = [
+        slope([(elapsed, sample[i]) for elapsed, *sample in half]) * 60
+        for i in range(3)
+    ]
+    print(
+        f"growth per minute in the second half: {per_minute[0]:+.0f} captchas, "
+        f"{per_minute[1]:+.0f} records, {per_minute[2]:+.2f} MB RSS"
+    )
+    kept = max(max(in_memory, records) for _, in_memory, records, _ in half)
+    if kept > bound(args):
+        sys.exit(f"{kept} captchas kept, the bound is {bound(args):.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Create, update and delete cycles of captcha records for every storage backend.
+
+    python benchmarks/bench_storage.py [count]
+"""
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from _common import telebot_captcha  # noqa: F401 (sets up sys.path)
+from pyTelegramBotCaptcha.storage import DirectoryStorage, MemoryStorage, SQLiteStorage
+
+# roughly the size of a real `Captcha.to_json()`
+RECORD = '{"chat": {"id": -1001234567890, "type": "supergroup", "title": "bench", "username": null}, ' + (
+    '"user": {"id": 123456789, "is_bot": false, "first_name": "Bench"}, "users_code": "", '
+    '"correct_code": "1A2B3C4D", "message_id": 42, "date": 1640995200, "captcha_id": "%s", '
+    '"previous_tries": 0, "user_reloads_left": 2, "options": null}'
+)
+UPDATES = 10
+
+
+def run(storage, count, batched=False):
+    ids = [f"1=-100={user_id}" for user_id in range(count)]
+    start = time.perf_counter()
+    if batched:
+        storage.save_many((captcha_id, RECORD % captcha_id, None) for captcha_id in ids)
+    else:
+        for captcha_id in ids:
+            storage.save(captcha_id, RECORD % captcha_id)
+    for _ in range(UPDATES):
+        if batched:
+            storage.save_many((captcha_id, RECORD % captcha_id, None) for captcha_id in ids)
+        else:
+            for captcha_id in ids:
+                storage.save(captcha_id, RECORD % captcha_id)
+    loaded = sum(1 for _ in storage.load_all(1))
+    if batched:
+        storage.delete_many(ids)
+    else:
+        for captcha_id in ids:
+            storage.delete(captcha_id)
+    elapsed = time.perf_counter() - start
+    assert loaded == count
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    workdir = Path(tempfile.mkdtemp())
+    try:
+        backends = (
+            ("DirectoryStorage", lambda: DirectoryStorage(workdir / "saves"), False),
+            ("MemoryStorage", MemoryStorage, False),
+            ("SQLiteStorage", lambda: SQLiteStorage(workdir / "a.sqlite3"), False),
+            ("SQLiteStorage save_many", lambda: SQLiteStorage(workdir / "b.sqlite3"), True),
+        )
+        writes = count * (UPDATES + 2)
+        for name, factory, batched in backends:
+            storage = factory()
+            elapsed = run(storage, count, batched)
+            storage.close()
+            print(
+                f"{name:<26} {writes} writes: {elapsed * 1000:9.1f} ms "
+                f"({elapsed / writes * 1e6:7.1f} us/write)"
+            )
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
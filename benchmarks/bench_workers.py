@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Several workers of one bot (e.g. webhook workers behind a load balancer) share their
+captchas in a `RedisStorage`. The workers are managers in one process here, each with
+its own connections to a local stand-in for Redis (`_fake_redis.py`).
+
+Every button press lands on a random worker and the OK button is pressed on two workers
+at the same time. Each captcha must be solved exactly once.
+Then captchas time out: exactly one worker must fire each `on_timeout`.
+It exits with status 1 if a captcha was solved or timed out twice or not at all.
+
+    python benchmarks/bench_workers.py [workers] [users]
+"""
+import random
+import sys
+import time
+from collections import Counter
+from threading import Lock, Thread
+
+from _common import FakeBot, FakeChat, fake_user, new_manager, press
+from _fake_redis import start_fake_redis
+from pyTelegramBotCaptcha import CaptchaOptions, RedisStorage
+
+
+def start_workers(url, count, bot, events, lock):
+    workers = []
+    for worker in range(count):
+        manager = new_manager(storage=RedisStorage(url), claim_interval=0.1)
+
+        def record(kind, worker=worker, manager=manager):
+            def handler(captcha):
+                with lock:
+                    events.append((kind, worker, captcha._captcha_id, time.time()))
+                manager.delete_captcha(bot, captcha)
+
+            return handler
+
+        manager.on_captcha_correct(record("correct"))
+        manager.on_captcha_not_correct(record("not_correct"))
+        manager.on_captcha_timeout(record("timeout"))
+        workers.append(manager)
+    return workers
+
+
+def solve(workers, bot, captcha):
+    for button in captcha.correct_code:
+        press(random.choice(workers), bot, captcha, button)
+    # a double tap on OK that two workers receive
+    threads = [
+        Thread(target=press, args=(worker, bot, captcha, "OK"))
+        for worker in random.sample(workers, 2)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    server, url = start_fake_redis()
+    events, lock = [], Lock()
+    bot = FakeBot()
+    workers = start_workers(url, count, bot, events, lock)
+    chat = FakeChat(-100)
+
+    # the captchas are sent by one worker and solved on all of them
+    captchas = [
+        workers[0].send_new_captcha(bot, chat, fake_user(user_id))
+        for user_id in range(1, users + 1)
+    ]
+    start = time.perf_counter()
+    threads = [
+        Thread(target=solve, args=(workers, bot, captcha))
+        for captcha in captchas
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    # the second OK finds the captcha solved and deleted by the other worker
+    stale = sum(w.metrics["captcha_stale_callbacks_total"].value() for w in workers)
+    solved = Counter(c for kind, _, c, _ in events if kind == "correct")
+    failed = len(solved) != users or any(n > 1 for n in solved.values())
+    print(
+        f"{count} workers, {users} captchas solved on random workers in "
+        f"{elapsed * 1000:7.1f} ms: {len(solved)} solved, "
+        f"{sum(n > 1 for n in solved.values())} solved twice, "
+        f"{stale:.0f} second OKs on a deleted captcha"
+    )
+
+    # captchas that time out one second after they were sent
+    options = CaptchaOptions()
+    options._timeout = 1
+    del events[:]
+    sent = {}
+    for user_id in range(1000, 1000 + users):
+        worker = random.choice(workers)
+        captcha = worker.send_new_captcha(bot, chat, fake_user(user_id), options)
+        sent[captcha._captcha_id] = captcha.deadline
+    time.sleep(2.5)
+    fired = Counter(c for kind, _, c, _ in events if kind == "timeout")
+    delays = sorted(at - sent[captcha_id] for _, _, captcha_id, at in events)
+    median = delays[len(delays) // 2] if delays else 0.0
+    per_worker = Counter(worker for _, worker, _, _ in events)
+    failed = failed or set(fired) != set(sent) or any(n > 1 for n in fired.values())
+    print(
+        f"{count} workers, {users} timeouts: {len(fired)} fired, "
+        f"{sum(n > 1 for n in fired.values())} fired twice, "
+        f"{len(set(sent) - set(fired))} missed, "
+        f"per worker {dict(sorted(per_worker.items()))}, "
+        f"delay median {median * 1000:.0f} ms"
+    )
+    print(f"{server.db.commands} Redis commands")
+
+    for worker in workers:
+        worker.close()
+    server.shutdown()
+    if failed:
+        sys.exit("a captcha was not handled exactly once")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Storage writes and time per button press, with and without write-behind.
+
+    python benchmarks/bench_write_behind.py [captchas]
+"""
+import sys
+import time
+
+from _common import FakeBot, FakeChat, fake_user, new_manager, press, telebot_captcha
+from pyTelegramBotCaptcha.storage import DirectoryStorage
+
+
+class CountingStorage(DirectoryStorage):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.writes = 0
+
+    def save(self, captcha_id, data, deadline=None):
+        self.writes += 1
+        super().save(captcha_id, data, deadline)
+
+
+def run(manager, storage, count):
+    bot = FakeBot()
+    chat = FakeChat(-100)
+    captchas = [
+        manager.send_new_captcha(bot, chat, fake_user(user_id))
+        for user_id in range(count)
+    ]
+    writes = storage.writes
+    presses = 0
+    start = time.perf_counter()
+    for captcha in captchas:
+        # 8 chars with two typos
+        for button in list(captcha.correct_code[:3]) + ["0", "BACK", "1", "BACK"]:
+            press(manager, bot, captcha, button)
+            presses += 1
+        for button in captcha.correct_code[3:]:
+            press(manager, bot, captcha, button)
+            presses += 1
+    elapsed = time.perf_counter() - start
+    if manager._write_behind:
+        manager._write_behind.flush()
+    for captcha in captchas:
+        manager._cancel_timeout(captcha)
+    return presses, storage.writes - writes, elapsed
+
+
+def main():
+    import tempfile
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    storage = CountingStorage(tempfile.mkdtemp())
+    manager = new_manager(storage=storage, write_behind_interval=1.0)
+    write_behind = manager._write_behind
+
+    for name, enabled in (("synchronous", False), ("write-behind", True)):
+        manager._write_behind = write_behind if enabled else None
+        presses, writes, elapsed = run(manager, storage, count)
+        print(
+            f"{name:<14} {presses} presses: {elapsed / presses * 1e6:8.1f} us/press, "
+            f"{writes} storage writes during the presses"
+        )
+    manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of every hot path of `telebot_captcha`, with a fake in-process `TeleBot`.
+The results are printed and can be written as JSON. Compared with the results of
+an earlier run, regressions show up before a release.
+
+    python benchmarks/suite.py                          # run and print
+    python benchmarks/suite.py --json results.json      # also write the results
+    python benchmarks/suite.py --baseline results.json  # compare, exit 1 if slower
+    python benchmarks/suite.py --quick --filter render  # fewer runs of some benchmarks
+
+Baselines only compare on the same machine and Python version.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import ExitStack
+from datetime import datetime, timezone
+
+from PIL import Image
+
+from _common import (
+    FakeBot,
+    FakeChat,
+    fake_user,
+    find_fonts,
+    new_manager,
+    press,
+    summary,
+    telebot_captcha,
+)
+from bench_recovery import fill
+from pyTelegramBotCaptcha.storage import DirectoryStorage
+
+# name -> (factory, repeat, warmup, slow). A factory gets an ExitStack for its cleanup
+# and returns the function to time, or (function, setup) if `setup` must run untimed
+# before every call.
+BENCHMARKS = {}
+
+
+def benchmark(name, repeat=20, warmup=2, slow=False):
+    def register(factory):
+        BENCHMARKS[name] = (factory, repeat, warmup, slow)
+        return factory
+
+    return register
+
+
+def register_render(generator, noise):
+    @benchmark(f"render/{generator}/{'noise' if noise else 'clean'}")
+    def factory(stack):
+        options = telebot_captcha.CaptchaOptions(generator=generator, add_noise=noise)
+        return lambda: telebot_captcha._random_codeimage(options)
+
+
+for _generator in ("default", "multicolor", "math"):
+    for _noise in (True, False):
+        register_render(_generator, _noise)
+
+
+@benchmark("render/keyzend/local-server")
+def render_keyzend(stack):
+    # the network is not measured: a local stand-in answers at once
+    from bench_keyzend import Handler, Server
+    from pyTelegramBotCaptcha.keyzend import KeyzendClient
+
+    server = Server(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    stack.callback(server.shutdown)
+    url = f"http://127.0.0.1:{server.server_address[1]}/captcha.png"
+    client = KeyzendClient(url)
+    stack.callback(client.close)
+    stack.callback(setattr, telebot_captcha, "_keyzend", telebot_captcha._keyzend)
+    telebot_captcha._keyzend = client
+    options = telebot_captcha.CaptchaOptions(generator="keyzend")
+    return lambda: telebot_captcha._random_codeimage(options)
+
+
+@benchmark("add_noise/300x128", repeat=50)
+def add_noise(stack):
+    image = Image.new("RGB", (300, 128), (120, 120, 120))
+    return lambda: telebot_captcha._add_noise(image.copy())
+
+
+def sent_captcha(stack):
+    manager = new_manager()
+    stack.callback(manager.close)
+    return manager, manager.send_new_captcha(FakeBot(), FakeChat(-100), fake_user(1))
+
+
+@benchmark("markup/code_input", repeat=2000)
+def code_input_markup(stack):
+    _, captcha = sent_captcha(stack)
+    return lambda: telebot_captcha._code_input_markup(captcha).to_json()
+
+
+@benchmark("json/round_trip", repeat=2000)
+def json_round_trip(stack):
+    manager, captcha = sent_captcha(stack)
+    return lambda: telebot_captcha.Captcha.de_json(captcha.to_json(), manager)
+
+
+@benchmark("record/round_trip", repeat=2000)
+def record_round_trip(stack):
+    manager, captcha = sent_captcha(stack)
+    return lambda: telebot_captcha.Captcha.from_record(captcha.to_record(), manager)
+
+
+def register_recovery(count):
+    @benchmark(f"recovery/{count}", repeat=5, warmup=1, slow=count > 1000)
+    def factory(stack):
+        path = tempfile.mkdtemp()
+        stack.callback(shutil.rmtree, path, True)
+        fonts = find_fonts()
+
+        def start():
+            telebot_captcha.CaptchaManager(
+                1, fonts=fonts, storage=DirectoryStorage(path)
+            ).close()
+
+        # the startup purges the captchas that timed out, so the saves are written again
+        return start, lambda: fill(DirectoryStorage(path), count)
+
+
+for _count in (100, 1000, 10000):
+    register_recovery(_count)
+
+
+@benchmark("e2e/send_type_solve", repeat=20)
+def send_type_solve(stack):
+    manager = new_manager()
+    stack.callback(manager.close)
+    bot = FakeBot()
+    chat = FakeChat(-100)
+    manager.on_captcha_correct(lambda captcha: manager.delete_captcha(bot, captcha))
+    users = iter(range(1, 10 ** 9))
+
+    def run():
+        captcha = manager.send_new_captcha(bot, chat, fake_user(next(users)))
+        for button in list(captcha.correct_code) + ["OK"]:
+            press(manager, bot, captcha, button)
+        assert captcha.solved
+
+    return run
+
+
+def measure(function, setup, repeat, warmup):
+    """
+    Like `_common.measure`, but calls `setup` untimed before every call.
+    """
+    timings = []
+    for i in range(warmup + repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        if i >= warmup:
+            timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings
+
+
+def run_benchmarks(names, quick):
+    results = {}
+    for name in names:
+        factory, repeat, warmup, slow = BENCHMARKS[name]
+        if quick:
+            repeat = max(3, repeat // 10)
+        with ExitStack() as stack:
+            function, setup = factory(stack), None
+            if isinstance(function, tuple):
+                function, setup = function
+            timings = measure(function, setup, repeat, warmup)
+        result = summary(timings)
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        result["p95_ms"] = p95 * 1000
+        result["repeat"] = repeat
+        results[name] = result
+        print(
+            f"{name:<32} median {result['median_ms']:10.3f} ms   "
+            f"p95 {result['p95_ms']:10.3f} ms   min {result['min_ms']:10.3f} ms",
+            flush=True,
+        )
+    return results
+
+
+def metadata():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "date": datetime.now(timezone.utc).isoformat(),
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints the change of every median against the baseline.
+    :return: the names of the benchmarks that are more than `threshold` slower
+    """
+    regressions = []
+    meta = baseline["meta"]
+    print(f"\ncompared with {meta.get('commit')} ({meta.get('date')})")
+    if meta.get("python") != platform.python_version():
+        print(f"warning: the baseline ran on Python {meta.get('python')}")
+    for name, result in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"{name:<32} new")
+            continue
+        ratio = result["median_ms"] / before["median_ms"] if before["median_ms"] else 1
+        status = ""
+        if ratio > 1 + threshold:
+            status = "REGRESSION"
+            regressions.append(name)
+        elif ratio < 1 / (1 + threshold):
+            status = "faster"
+        line = (
+            f"{name:<32} {before['median_ms']:10.3f} -> {result['median_ms']:10.3f} ms "
+            f"{(ratio - 1) * 100:+7.1f}%  {status}"
+        )
+        print(line.rstrip())
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare with the results in this file")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="a median more than this much slower is a regression (default: 0.25)",
+    )
+    parser.add_argument(
+        "--filter", default="", help="only run the benchmarks with this in the name"
+    )
+    parser.add_argument(
+        "--quick", action="store_true", help="fewer runs, skip the slow benchmarks"
+    )
+    args = parser.parse_args(argv)
+
+    telebot_captcha._fonts = find_fonts()
+    names = [
+        name
+        for name, (_, _, _, slow) in BENCHMARKS.items()
+        if args.filter in name and not (args.quick and slow)
+    ]
+    results = run_benchmarks(names, args.quick)
+    report = {"meta": metadata(), "results": results}
+    if args.json:
+        with open(args.json, "w", encoding="utf8") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regressions: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
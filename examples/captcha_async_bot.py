@@ -0,0 +1,58 @@
+import asyncio
+
+from telebot.async_telebot import AsyncTeleBot
+from pyTelegramBotCAPTCHA import AsyncCaptchaManager, CaptchaOptions
+
+TOKEN = "TOKEN"
+BOT_ID = 123456789  # the number before the colon of your token
+
+bot = AsyncTeleBot(TOKEN)
+
+options = CaptchaOptions()
+options.generator = "default"  # "default", "keyzend", "multicolor", "math"
+
+captcha_manager = AsyncCaptchaManager(BOT_ID, default_options=options)
+
+# Test command handler
+@bot.message_handler(commands=["test"])
+async def test_captcha(message):
+    await captcha_manager.send_new_captcha(bot, message.chat, message.from_user)
+
+
+# Callback query handler
+@bot.callback_query_handler(func=lambda callback: True)
+async def on_callback(callback):
+    await captcha_manager.update_captcha(bot, callback)
+
+
+# Handler for correct solved CAPTCHAs
+@captcha_manager.on_captcha_correct
+async def on_correct(captcha):
+    await bot.send_message(captcha.chat.id, "✅ : Congrats! You solved the CAPTCHA!")
+    await captcha_manager.delete_captcha(bot, captcha)
+
+
+# Handler for wrong solved CAPTCHAs
+@captcha_manager.on_captcha_not_correct
+async def on_not_correct(captcha):
+    await bot.send_message(captcha.chat.id, f"❌ : You failed solving the CAPTCHA!")
+    await captcha_manager.delete_captcha(bot, captcha)
+
+
+# Handler for timed out CAPTCHAS
+@captcha_manager.on_captcha_timeout
+async def on_timeout(captcha):
+    await bot.send_message(captcha.chat.id, f"❌ : You did not solve the CAPTCHA!")
+    await captcha_manager.delete_captcha(bot, captcha)
+
+
+async def main():
+    # continues the timeouts of the CAPTCHAs saved before a restart
+    await captcha_manager.start()
+    try:
+        await bot.polling()
+    finally:
+        captcha_manager.close()
+
+
+asyncio.run(main())
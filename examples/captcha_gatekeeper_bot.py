@@ -1,5 +1,5 @@
 from telebot import TeleBot
-from pyTelegramBotCAPTCHA import CaptchaManager
+from pyTelegramBotCAPTCHA import CaptchaManager, CaptchaOptions
 from datetime import datetime, timedelta
 
 bot = TeleBot("TOKEN")
@@ -13,7 +13,11 @@ MAX_WRONG_DIGITS = 2
 def new_member(message):
     for user in message.new_chat_members:
         captcha_manager.restrict_chat_member(bot, message.chat.id, user.id)
-        captcha_manager.send_random_captcha(bot, message.chat, user, timeout=60)
+    options = CaptchaOptions()
+    options.timeout = 60
+    captcha_manager.send_new_captchas(
+        bot, message.chat, message.new_chat_members, options
+    )
 
 
 # Callback query handler
@@ -1,4 +1,15 @@
 from .telebot_captcha import CaptchaManager, Captcha, CaptchaOptions, CustomLanguage
+from .async_telebot_captcha import AsyncCaptchaManager
+from .keyzend import KeyzendClient
+from .metrics import Metrics
+from .resp import RedisClient
+from .storage import (
+    CaptchaStorage,
+    DirectoryStorage,
+    MemoryStorage,
+    RedisStorage,
+    SQLiteStorage,
+)
 
 
 __author__ = "SwissCorePy"
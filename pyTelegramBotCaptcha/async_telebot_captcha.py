@@ -0,0 +1,614 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import functools
+import inspect
+import logging
+import time
+from concurrent.futures import Executor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from telebot import types
+
+from .telebot_captcha import (
+    Captcha,
+    CaptchaManager,
+    CaptchaOptions,
+    _unique_users,
+    languages,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncCaptchaManager(CaptchaManager):
+    def __init__(
+        self, bot_id: int, *args, render_executor: Optional[Executor] = None, **kwargs
+    ) -> None:
+        """
+        The Captcha Manager for `telebot.async_telebot.AsyncTeleBot`.
+
+        It takes the same parameters as `CaptchaManager` and has the same methods,
+        but all methods that call the Bot API are coroutines and the handlers
+        can be coroutine functions.
+        Timeouts run on the event loop. Images are rendered and captchas are saved
+        in `render_executor` (default: the default executor of the loop),
+        so the loop never waits for PIL or the disk.
+
+        Call `await captcha_manager.start()` before polling to continue the timeouts of
+        captchas that were saved before a restart.
+        With a shared storage it also starts to claim the due timeouts.
+
+        :param render_executor: the executor to render and save captchas in
+        """
+        super().__init__(bot_id, *args, **kwargs)
+        self._executor = render_executor
+        self._timeouts: Set[asyncio.TimerHandle] = set()
+        # the loop only keeps weak references to its tasks
+        self._tasks: Set[asyncio.Task] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._started = False
+
+    @property
+    def pending_timeouts(self) -> int:
+        """
+        The number of captchas with a running timeout.
+        """
+        return len(self._timeouts)
+
+    async def start(self) -> None:
+        """
+        Continues the timeouts of the captchas that were saved before a restart.
+        Must be called from the running event loop, after the `on_captcha_timeout` handler is set.
+        It is called by the first `send_new_captcha` or `update_captcha` if you do not call it.
+        """
+        loop = self._loop = asyncio.get_running_loop()
+        if self._started or not self._handlers["on_timeout"]:
+            return
+        self._started = True
+        if self.storage.shared and self._claim_handle is None:
+            self._claim_handle = self._scheduler.schedule(0, self._claim_timeouts)
+        for captcha in list(self.captchas.values()):
+            captcha._continue_timeout()
+        now = loop.time()
+        wall_clock_now = _now()
+        with self._load_lock:
+            for captcha_id, unloaded in self._unloaded.items():
+                deadline = unloaded[0]
+                delay = max(deadline - wall_clock_now, 1) if deadline is not None else 1
+                unloaded[1] = self._call_later(
+                    loop, now + delay, self._recovered_timeout, captcha_id
+                )
+
+    async def send_new_captcha(
+        self,
+        bot,
+        chat: types.Chat,
+        user: types.User,
+        options: CaptchaOptions = None,
+    ) -> Captcha:
+        """
+        sends a randomly generated captcha into your chat.
+        :param bot: your AsyncTeleBot instance
+        :param chat: the chat (chat not chat_id)
+        :param user: the user who must solve the captcha (user not user_id)
+        :param options: options profile to use
+        :return: the generated Captcha object
+        """
+        self._check_handlers()
+        await self.start()
+
+        captcha_id = f"{self._bot_id}={chat.id}={user.id}"
+        old_captcha = await self._get_captcha_async(captcha_id)
+
+        photo = await self._run(self._new_photo, options or self.default_options)
+        captcha = await self._send_captcha(bot, chat, user, options, *photo)
+
+        if old_captcha:
+            self.captchas.pop(captcha_id, None)
+            self._cancel_timeout(old_captcha)
+            await self.delete_captcha(bot, old_captcha)
+
+        self._schedule_timeout(captcha, captcha.options.timeout)
+        await self._run(self._save, captcha)
+        self.captchas[captcha_id] = captcha
+        return captcha
+
+    async def send_new_captchas(
+        self,
+        bot,
+        chat: types.Chat,
+        users: List[types.User],
+        options: CaptchaOptions = None,
+    ) -> Tuple[List[Captcha], Dict[int, Exception]]:
+        """
+        sends a captcha to every user of a mass join, e.g. `message.new_chat_members`.
+        The images are rendered in parallel, the new captchas are saved in one batch
+        and their timeouts are scheduled at once.
+        A user whose captcha could not be rendered or sent does not stop the others.
+        A user who is in `users` more than once gets a single captcha.
+        :param bot: your AsyncTeleBot instance
+        :param chat: the chat (chat not chat_id)
+        :param users: the users who must solve a captcha (users not user_ids)
+        :param options: options profile to use
+        :return: the generated Captcha objects and the exception per user_id of the users without one
+        """
+        self._check_handlers()
+        await self.start()
+
+        users = _unique_users(users)
+        photos = await self._run(
+            self._new_photos, options or self.default_options, len(users)
+        )
+        captchas: List[Captcha] = []
+        errors: Dict[int, Exception] = {}
+        for user, photo in zip(users, photos):
+            try:
+                if isinstance(photo, Exception):
+                    raise photo
+                await self._get_captcha_async(f"{self._bot_id}={chat.id}={user.id}")
+                captchas.append(
+                    await self._send_captcha(bot, chat, user, options, *photo)
+                )
+            except Exception as e:
+                errors[user.id] = e
+
+        for captcha in captchas:
+            old_captcha = self.captchas.pop(captcha._captcha_id, None)
+            if old_captcha:
+                self._cancel_timeout(old_captcha)
+                await self.delete_captcha(bot, old_captcha)
+
+        for captcha in captchas:
+            self._schedule_timeout(captcha, captcha.options.timeout)
+            self.captchas[captcha._captcha_id] = captcha
+        await self._run(self._save_many, captchas)
+        return captchas, errors
+
+    async def send_random_captcha(self, bot, chat: types.Chat, user: types.User, **kwargs):
+        """
+        This function is deprecated! Use `send_new_captcha()` instead!
+        """
+        options = CaptchaOptions()
+        options.language = kwargs.get("language") or self.default_options.language
+        options.only_digits = kwargs.get("only_digits", False)
+        options.add_noise = kwargs.get("add_noise", True)
+        options.timeout = kwargs.get("timeout") or self.default_options.timeout
+        options.max_user_reloads = kwargs.get("max_user_reloads", 3)
+        options.code_length = kwargs.get("code_length", 8)
+        return await self.send_new_captcha(bot, chat, user, options)
+
+    async def restrict_chat_member(self, bot, chat_id: int, user_id: int) -> bool:
+        """
+        Set all permissions of a chat member to `False`.
+        """
+        return await super().restrict_chat_member(bot, chat_id, user_id)
+
+    async def unrestrict_chat_member(self, bot, chat_id: int, user_id: int) -> bool:
+        """
+        Set all permissions of a chat member to `True` which removes the restriction.
+        """
+        return await super().unrestrict_chat_member(bot, chat_id, user_id)
+
+    async def update_captcha(self, bot, callback: types.CallbackQuery) -> None:
+        """
+        updates the captcha if a user has pressed a button. if submit is pressed the captcha gets checked
+        :param bot: your AsyncTeleBot instance
+        :param callback: the CallbackQuery
+        """
+        parsed = self._parse_callback(callback)
+        if parsed is None:
+            return
+        await self.start()
+
+        captcha_id, captcha, btn = parsed
+        if captcha_id is None:
+            self._stale_callbacks.inc()
+            await bot.answer_callback_query(callback.id)
+            return
+
+        # other processes of the bot must not change the captcha in the meantime
+        async with _StorageLock(self, captcha_id):
+            if captcha is None:
+                captcha = await self._get_captcha_async(captcha_id)
+            if captcha is None:
+                # a button of a captcha that was deleted, answered to stop the spinner
+                self._stale_callbacks.inc()
+                await bot.answer_callback_query(callback.id)
+                return
+
+            language = languages[captcha.options.language]
+            if captcha.user.id != callback.from_user.id:
+                await bot.answer_callback_query(
+                    callback.id, text=language["wrong_user"]
+                )
+                return
+            if btn == "OK":
+                if len(captcha.users_code) < captcha.code_length:
+                    await bot.answer_callback_query(
+                        callback.id, text=language["too_short"], show_alert=True
+                    )
+                else:
+                    await self._check_captcha(captcha, bot)
+            elif btn == "RELOAD":
+                if captcha.user_reloads_left > 0:
+                    captcha.user_reloads_left -= 1
+                    await self.reset_captcha(bot, captcha)
+                else:
+                    await bot.answer_callback_query(
+                        callback.id, text=language["maxreloadlimit"]
+                    )
+                    return
+            else:
+                changed = captcha._input(btn)
+                if changed:
+                    await self._run(self._save, captcha, False)
+                await self._edit_caption(
+                    bot,
+                    captcha,
+                    captcha.reply_markup or callback.message.reply_markup,
+                    changed,
+                )
+
+            await bot.answer_callback_query(callback.id)
+
+    async def reset_captcha(self, bot, captcha: Captcha) -> None:
+        """
+        Resets a Captcha
+        Generates new image, new code and resets the timeout.
+        """
+        self._cancel_timeout(captcha)
+        self._cancel_edit(captcha)
+        await self._reset(bot, captcha)
+        self.captchas.unfinish(captcha)
+        self._schedule_timeout(captcha, captcha.options.timeout)
+
+    async def refresh_captcha(self, bot, captcha: Captcha, *args, **kwargs) -> None:
+        """
+        This function is deprecated! Use `reset_captcha(...)` instead!
+        """
+        await self.reset_captcha(bot, captcha)
+
+    async def delete_captcha(self, bot, captcha: Captcha) -> None:
+        self._cancel_edit(captcha)
+        await self._run(self._delete, captcha)
+        try:
+            await self._api_async(
+                bot, "delete_message", captcha.chat.id, captcha.message_id
+            )
+        except Exception:
+            pass
+
+    def on_captcha_correct(self, function: Callable) -> Callable:
+        """
+        Captcha correct decorator. The handler can be a coroutine function.
+        """
+        self._handlers["on_correct"] = function
+        return function
+
+    def on_captcha_not_correct(self, function: Callable) -> Callable:
+        """
+        Captcha not correct decorator. The handler can be a coroutine function.
+        """
+        self._handlers["on_not_correct"] = function
+        return function
+
+    def on_captcha_timeout(self, function: Callable) -> Callable:
+        """
+        Captcha timeout decorator. The handler can be a coroutine function.
+        """
+        self._handlers["on_timeout"] = function
+        return function
+
+    async def _send_captcha(
+        self,
+        bot,
+        chat: types.Chat,
+        user: types.User,
+        options: Optional[CaptchaOptions],
+        code: str,
+        photo: Any,
+        entry: Any,
+    ) -> Captcha:
+        captcha = self._new_captcha(chat, user, options, code)
+        m = await self._api_async(
+            bot,
+            "send_photo",
+            chat_id=chat.id,
+            photo=photo,
+            caption=captcha._caption(),
+            reply_markup=captcha.reply_markup,
+            parse_mode="HTML",
+        )
+        self._photo_sent(entry, m)
+        captcha.message_id = m.message_id
+        captcha.date = m.date
+        return captcha
+
+    async def _reset(self, bot, captcha: Captcha) -> None:
+        code, photo, entry = await self._run(
+            self._new_photo, captcha.options, captcha.correct_code
+        )
+        captcha._set_code(code, photo)
+        m = await self._api_async(
+            bot,
+            "edit_message_media",
+            types.InputMediaPhoto(captcha.image, captcha._caption(), "HTML"),
+            captcha.chat.id,
+            captcha.message_id,
+            reply_markup=captcha.reply_markup,
+        )
+        self._photo_sent(entry, m)
+        captcha.image = None
+        await self._run(self._save, captcha)
+
+    async def _edit_caption(
+        self,
+        bot,
+        captcha: Captcha,
+        reply_markup: types.JsonSerializable,
+        changed: bool = True,
+    ) -> None:
+        with self._edit_lock:
+            if not changed:
+                self._edit_counts["skipped"] += 1
+                return
+            if self.edit_interval > 0:
+                if captcha._edit_handle is not None:
+                    self._edit_counts["coalesced"] += 1
+                    return
+                loop = asyncio.get_running_loop()
+                delay = captcha._edited_at + self.edit_interval - time.monotonic()
+                if delay > 0:
+                    captcha._edit_handle = loop.call_later(
+                        delay,
+                        lambda: self._create_task(
+                            loop, self._flush_caption(bot, captcha, reply_markup)
+                        ),
+                    )
+                    return
+                captcha._edited_at = time.monotonic()
+        await self._send_caption(bot, captcha, reply_markup)
+
+    async def _flush_caption(
+        self, bot, captcha: Captcha, reply_markup: types.JsonSerializable
+    ) -> None:
+        with self._edit_lock:
+            if captcha._edit_handle is None:
+                return
+            captcha._edit_handle = None
+            if captcha.solved or self.captchas.is_finished(captcha):
+                # it finished in the meantime, the caption is not edited any more
+                return
+            captcha._edited_at = time.monotonic()
+        await self._send_caption(bot, captcha, reply_markup)
+
+    async def _send_caption(
+        self, bot, captcha: Captcha, reply_markup: types.JsonSerializable
+    ) -> None:
+        try:
+            await self._api_async(
+                bot,
+                "edit_message_caption",
+                caption=captcha._caption(show_code=True),
+                chat_id=captcha.chat.id,
+                message_id=captcha.message_id,
+                reply_markup=reply_markup,
+                parse_mode="HTML",
+            )
+        except Exception as e:
+            with self._edit_lock:
+                self._edit_counts["failed"] += 1
+            logger.debug(
+                "Could not edit the caption of captcha %s: %s", captcha._captcha_id, e
+            )
+            return
+        with self._edit_lock:
+            self._edit_counts["edits"] += 1
+
+    async def _check_captcha(self, captcha: Captcha, bot) -> None:
+        self._cancel_edit(captcha)
+        is_correct = captcha.users_code == captcha.correct_code
+        captcha.previous_tries += 1
+
+        if (
+            captcha.options.max_incorrect_to_auto_reload >= captcha.incorrect_chars
+            and not is_correct
+            and captcha.previous_tries < captcha.options.max_attempts
+        ):
+            await self._reset(bot, captcha)
+        else:
+            self._cancel_timeout(captcha)
+            self._results.inc("solved" if is_correct else "failed")
+            date = captcha.date
+            if is_correct:
+                await _maybe_await(self._handlers["on_correct"](captcha))
+            else:
+                await _maybe_await(self._handlers["on_not_correct"](captcha))
+            if not self._is_finished(captcha, date):
+                return
+            captcha.solved = True
+            self.captchas.finish(captcha)
+            if self.storage.shared:
+                await self._run(self._save_finished, captcha)
+
+    async def _get_captcha_async(self, captcha_id: str) -> Optional[Captcha]:
+        if self.storage.shared:
+            return await self._run(self._refresh_captcha, captcha_id)
+        if captcha_id in self.captchas or captcha_id not in self._unloaded:
+            return self.captchas.get(captcha_id)
+        return await self._run(self._get_captcha, captcha_id)
+
+    async def _recovered_timeout(self, captcha_id: str) -> None:
+        captcha = await self._get_captcha_async(captcha_id)
+        if captcha is None or captcha.solved:
+            return
+        remaining = captcha.deadline - _now()
+        if remaining > 1:
+            if self.storage.shared:
+                # reset after it was claimed, the save puts its new deadline back
+                await self._run(self._save, captcha)
+            else:
+                self._schedule_timeout(captcha, remaining)
+        elif not await self._run(self._purge_loaded, captcha):
+            captcha._timeout_handle = None
+            await self._timed_out_async(captcha)
+
+    def _claimed_timeout(self, captcha_id: str) -> None:
+        # claimed on a thread of the scheduler, the handler runs on the loop
+        self._loop.call_soon_threadsafe(
+            self._create_task, self._loop, self._claimed_timeout_async(captcha_id)
+        )
+
+    async def _claimed_timeout_async(self, captcha_id: str) -> None:
+        try:
+            async with _StorageLock(self, captcha_id):
+                await self._recovered_timeout(captcha_id)
+        except Exception:
+            logger.exception("Could not fire the timeout of captcha %s", captcha_id)
+
+    def _schedule_timeout(self, captcha: Captcha, delay: float) -> None:
+        self._cancel_timeout(captcha)
+        if self.storage.shared:
+            # the deadline is saved with the captcha, a process claims it when it is due
+            return
+        loop = asyncio.get_running_loop()
+        captcha._timeout_handle = self._call_later(
+            loop, loop.time() + delay, self._timed_out_async, captcha
+        )
+
+    async def _timed_out_async(self, captcha: Captcha) -> None:
+        self._results.inc("timeout")
+        date = captcha.date
+        await _call_handler(self._handlers["on_timeout"], captcha)
+        if self._is_finished(captcha, date):
+            self.captchas.finish(captcha)
+            if self.storage.shared:
+                # its deadline is kept while it is claimed
+                await self._run(self._save_finished, captcha)
+
+    def _unload(self, captcha: Captcha) -> None:
+        # the registry evicts in any thread, the timeouts live on the loop
+        if self.storage.shared:
+            # its timeout is claimed from the storage
+            return
+        unloaded = [captcha.deadline, None]
+        self._unloaded[captcha._captcha_id] = unloaded
+        if self._loop is not None and self._timeout_pending(captcha):
+            self._loop.call_soon_threadsafe(self._move_timeout, captcha, unloaded)
+
+    def _move_timeout(self, captcha: Captcha, unloaded: List) -> None:
+        self._cancel_timeout(captcha)
+        delay = max(unloaded[0] - _now(), 0)
+        if self._unloaded.get(captcha._captcha_id) is unloaded:
+            unloaded[1] = self._call_later(
+                self._loop,
+                self._loop.time() + delay,
+                self._recovered_timeout,
+                captcha._captcha_id,
+            )
+            return
+        # it was loaded again in the meantime, without a timeout
+        loaded = self.captchas.get(captcha._captcha_id)
+        if loaded is not None and loaded._timeout_handle is None:
+            self._schedule_timeout(loaded, delay)
+
+    async def _api_async(self, bot, method: str, *args, **kwargs) -> Any:
+        start = time.perf_counter()
+        try:
+            return await getattr(bot, method)(*args, **kwargs)
+        except Exception:
+            self._api_failures.inc(method)
+            raise
+        finally:
+            self._api_seconds.observe(time.perf_counter() - start, method)
+
+    def _timeout_pending(self, captcha: Captcha) -> bool:
+        return captcha._timeout_handle in self._timeouts
+
+    def _cancel_timeout(self, captcha: Captcha) -> None:
+        handle = captcha._timeout_handle
+        if handle:
+            self._cancel_handle(handle)
+            captcha._timeout_handle = None
+
+    def _cancel_handle(self, handle: asyncio.TimerHandle) -> None:
+        # close() and the sweep run in other threads, TimerHandles are not thread-safe
+        loop = self._loop
+        if loop is not None and loop.is_running() and _running_loop() is not loop:
+            try:
+                loop.call_soon_threadsafe(self._cancel_handle, handle)
+                return
+            except RuntimeError:
+                # the loop was closed in the meantime
+                pass
+        handle.cancel()
+        self._timeouts.discard(handle)
+
+    def _create_task(self, loop, coroutine) -> asyncio.Task:
+        task = loop.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _call_later(self, loop, when: float, coroutine_function, *args):
+        def fire():
+            self._timeouts.discard(handle)
+            self._create_task(loop, coroutine_function(*args))
+
+        handle = loop.call_at(when, fire)
+        self._timeouts.add(handle)
+        return handle
+
+    async def _run(self, function: Callable, *args) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(function, *args)
+        )
+
+
+class _StorageLock:
+    def __init__(self, manager: AsyncCaptchaManager, captcha_id: str) -> None:
+        """
+        Holds the lock of a captcha in a shared storage, `async with` it.
+        The lock is taken and released in the executor of the manager, not on the loop.
+        Does nothing for storages that are not shared.
+        """
+        self._manager = manager
+        self._lock = None
+        if manager.storage.shared:
+            self._lock = manager.storage.lock(captcha_id)
+
+    async def __aenter__(self) -> None:
+        if self._lock is not None:
+            await self._manager._run(self._lock.__enter__)
+
+    async def __aexit__(self, *exc_info) -> None:
+        if self._lock is not None:
+            await self._manager._run(self._lock.__exit__, None, None, None)
+
+
+async def _maybe_await(rv: Any) -> Any:
+    if inspect.isawaitable(rv):
+        return await rv
+    return rv
+
+
+async def _call_handler(handler: Callable, captcha: Captcha) -> None:
+    # runs as a task of its own, nobody would see the exception otherwise
+    try:
+        await _maybe_await(handler(captcha))
+    except Exception:
+        logger.exception("Exception in captcha timeout handler")
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def _now() -> float:
+    return datetime.now().timestamp()
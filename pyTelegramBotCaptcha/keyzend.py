@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import time
+from collections import deque
+from threading import Condition, Lock, Thread
+from typing import Dict, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+logger = logging.getLogger(__name__)
+
+KEYZEND_URL = "https://tyt.keyzend.pw/captcha.png"
+
+
+class KeyzendUnavailable(requests.RequestException):
+    """
+    keyzend did not answer in time, answered with an error or the circuit breaker is open.
+    """
+
+
+class KeyzendClient:
+    def __init__(
+        self,
+        url: str = KEYZEND_URL,
+        timeout: Union[float, Tuple[float, float]] = (3.05, 5),
+        prefetch: int = 0,
+        failure_threshold: int = 3,
+        reset_timeout: float = 30,
+        slow_threshold: Optional[float] = None,
+        fallback: bool = True,
+        pool_maxsize: int = 4,
+    ) -> None:
+        """
+        The client for the `keyzend` generator.
+        It keeps its connections open, gives up after `timeout` and can keep captchas ready in advance.
+        After `failure_threshold` failed requests in a row the circuit breaker opens:
+        no requests are sent for `reset_timeout` seconds, then a single request tests if keyzend is back.
+        While keyzend is unavailable the captchas are rendered locally if `fallback` is set.
+
+        :param url: the url of the keyzend captcha endpoint
+        :param timeout: seconds to wait for the connection and for the response, like in `requests`
+        :param prefetch: how many captchas a background thread keeps ready. 0 fetches on demand
+        :param failure_threshold: open the circuit breaker after this many failures in a row
+        :param reset_timeout: seconds the circuit breaker stays open before keyzend is tried again
+        :param slow_threshold: count responses slower than this many seconds as failures
+        :param fallback: render the captcha locally while keyzend is unavailable
+        :param pool_maxsize: how many connections to keyzend are kept open
+        """
+        if prefetch < 0:
+            raise ValueError("prefetch must not be negative")
+        if failure_threshold < 1:
+            raise ValueError("failure_threshold must be at least 1")
+        self.url = url
+        self.timeout = timeout
+        self.prefetch = prefetch
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.slow_threshold = slow_threshold
+        self.fallback = fallback
+        self.pool_maxsize = pool_maxsize
+
+        self._lock = Lock()
+        self._ready = Condition(self._lock)
+        self._closed = False
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial = False
+
+        self.fetched = 0
+        self.failed = 0
+        self.prefetch_hits = 0
+        self.rejected = 0
+        self._start()
+
+    @property
+    def state(self) -> str:
+        """
+        "closed" (keyzend is used), "open" (keyzend is skipped) or "half-open" (keyzend is tested).
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return "open"
+            return "half-open"
+
+    def get(self) -> Tuple[str, bytes]:
+        """
+        A (code, image) pair from keyzend, from the prefetch buffer if one is ready.
+        :raises KeyzendUnavailable: if keyzend failed or the circuit breaker is open
+        """
+        self._check_pid()
+        with self._lock:
+            if self._buffer:
+                self.prefetch_hits += 1
+                pair = self._buffer.popleft()
+                self._ready.notify()
+                return pair
+        return self._fetch()
+
+    def stats(self) -> Dict[str, Union[int, str]]:
+        with self._lock:
+            stats = {
+                "fetched": self.fetched,
+                "failed": self.failed,
+                "prefetch_hits": self.prefetch_hits,
+                "rejected": self.rejected,
+                "ready": len(self._buffer),
+            }
+        stats["state"] = self.state
+        return stats
+
+    def close(self) -> None:
+        """
+        Stops the prefetch thread and closes the connections.
+        """
+        with self._lock:
+            self._closed = True
+            self._ready.notify_all()
+        self._session.close()
+
+    def _start(self) -> None:
+        self._pid = os.getpid()
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._buffer = deque()
+        if self.prefetch:
+            Thread(target=self._prefetch, name="KeyzendPrefetch", daemon=True).start()
+
+    def _check_pid(self) -> None:
+        # a forked render process must not share the connections and has no prefetch thread
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._start()
+
+    def _fetch(self) -> Tuple[str, bytes]:
+        with self._lock:
+            if not self._allow():
+                self.rejected += 1
+                raise KeyzendUnavailable("The circuit breaker for keyzend is open")
+        start = time.monotonic()
+        try:
+            r = self._session.get(self.url, timeout=self.timeout)
+            if r.status_code != 200 or "answer" not in r.headers:
+                raise KeyzendUnavailable(
+                    f"Could not get the CAPTCHA from {self.url} ({r.status_code})"
+                )
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self.fetched += 1
+            if self.slow_threshold is not None and elapsed > self.slow_threshold:
+                # the captcha is still good, but keyzend is too slow to rely on
+                self._record(False)
+            else:
+                self._record(True)
+            return r.headers["answer"].upper(), r.content
+        except requests.RequestException as e:
+            self._record(False)
+            if isinstance(e, KeyzendUnavailable):
+                raise
+            raise KeyzendUnavailable(f"Could not get the CAPTCHA from {self.url}: {e}")
+
+    def _allow(self) -> bool:
+        # must be called with the lock held
+        if self._opened_at is None:
+            return True
+        if self._trial or time.monotonic() - self._opened_at < self.reset_timeout:
+            return False
+        # half-open: let a single request through
+        self._trial = True
+        return True
+
+    def _record(self, success: bool) -> None:
+        with self._lock:
+            self._trial = False
+            if success:
+                self._failures = 0
+                self._opened_at = None
+                return
+            self.failed += 1
+            self._failures += 1
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning("keyzend is unavailable, the circuit breaker is open")
+                self._opened_at = time.monotonic()
+
+    def _prefetch(self) -> None:
+        while True:
+            with self._lock:
+                while not self._closed and len(self._buffer) >= self.prefetch:
+                    self._ready.wait()
+                if self._closed:
+                    return
+                opened_at = self._opened_at
+            if opened_at is not None:
+                # wait for the circuit breaker before testing keyzend again
+                time.sleep(max(opened_at + self.reset_timeout - time.monotonic(), 0.1))
+            try:
+                pair = self._fetch()
+            except KeyzendUnavailable:
+                time.sleep(min(self.reset_timeout, 1))
+                continue
+            with self._lock:
+                self._buffer.append(pair)
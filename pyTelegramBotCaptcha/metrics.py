@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+import math
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+# the default buckets of the Prometheus client libraries, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        """
+        A value that only goes up, e.g. the number of failed requests. One value per set of labels.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = Lock()
+
+    def inc(self, *labelvalues: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def value(self, *labelvalues: str) -> float:
+        return self._values.get(labelvalues, 0.0)
+
+    def _exposition(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+            for key, value in values
+        ]
+
+
+class Gauge:
+    def __init__(self, name: str, documentation: str, function: Callable[[], float]):
+        """
+        A value that goes up and down, read from `function` when the metrics are exported.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = ()
+        self._function = function
+
+    def value(self) -> float:
+        return self._function()
+
+    def _exposition(self) -> List[str]:
+        return [f"{self.name} {_number(self.value())}"]
+
+
+class _Series:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, buckets: int) -> None:
+        self.counts = [0] * buckets
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        """
+        Counts observed values (e.g. latencies in seconds) into buckets. One histogram per set of labels.
+        :param buckets: the upper bounds of the buckets, +Inf is added
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], _Series] = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        # the first bucket the value fits in, len(buckets) is +Inf
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = _Series(len(self.buckets) + 1)
+            series.counts[index] += 1
+            series.sum += value
+            series.count += 1
+
+    @contextmanager
+    def time(self, *labelvalues: str) -> Iterator[None]:
+        """
+        Observes the seconds the `with` block took, also if it raised.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labelvalues)
+
+    def count(self, *labelvalues: str) -> int:
+        series = self._series.get(labelvalues)
+        return series.count if series else 0
+
+    def sum(self, *labelvalues: str) -> float:
+        series = self._series.get(labelvalues)
+        return series.sum if series else 0.0
+
+    def quantile(self, q: float, *labelvalues: str) -> float:
+        """
+        Estimates the `q` quantile (0..1) from the buckets, like `histogram_quantile()` in Prometheus.
+        Returns NaN if nothing was observed.
+        """
+        with self._lock:
+            series = self._series.get(labelvalues)
+            counts = list(series.counts) if series else []
+        total = sum(counts)
+        if not total:
+            return math.nan
+        rank = q * total
+        cumulative = 0
+        for i, count in enumerate(counts):
+            if cumulative + count >= rank and count:
+                if i == len(self.buckets):
+                    # +Inf: the best estimate is the highest finite bound
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def _exposition(self) -> List[str]:
+        with self._lock:
+            series = sorted(
+                (key, list(s.counts), s.sum, s.count) for key, s in self._series.items()
+            )
+        lines = []
+        bounds = [_number(bound) for bound in self.buckets] + ["+Inf"]
+        for key, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                labels = _labels(self.labelnames + ("le",), key + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_number(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Metrics:
+    def __init__(self) -> None:
+        """
+        A registry of counters, gauges and histograms that exports them in the
+        Prometheus text format. Serve `to_prometheus()` on your `/metrics` endpoint.
+        """
+        self._metrics: Dict[str, object] = {}
+
+    def add(self, metric):
+        """
+        Registers a metric and returns it. A metric can be registered in several registries.
+        """
+        if metric.name in self._metrics:
+            raise ValueError(f"A metric named {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def __getitem__(self, name: str):
+        return self._metrics[name]
+
+    def __iter__(self) -> Iterator:
+        return iter(self._metrics.values())
+
+    def to_prometheus(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format (version 0.0.4).
+        """
+        lines = []
+        for metric in self._metrics.values():
+            kind = type(metric).__name__.lower()
+            lines.append(f"# HELP {metric.name} {_escape_help(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {kind}")
+            lines.extend(metric._exposition())
+        return "\n".join(lines) + "\n"
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape_label(str(value))}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if value != value:
+        return "NaN"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
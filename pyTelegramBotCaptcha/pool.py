@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+import copy
+import logging
+import random
+import time
+from collections import deque
+from queue import Queue
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+def profile_key(options) -> Tuple:
+    """
+    The part of a `CaptchaOptions` profile that changes the rendered and encoded (code, image) pair.
+    Captchas with the same key can share pre-rendered images.
+    """
+    return (
+        options.generator,
+        # the code length of math captchas depends on the result of the equation
+        None if options.generator == "math" else options.code_length,
+        options.only_digits,
+        options.add_noise,
+        options.image_format,
+        options.image_quality,
+    )
+
+
+class _Profile:
+    def __init__(self, options) -> None:
+        self.options = copy.copy(options)
+        self.ready = deque()
+        self.in_flight = 0
+
+
+class CaptchaPool:
+    def __init__(
+        self,
+        render: Callable[[Any], Tuple[str, Any]],
+        size: int = 16,
+        low_water: int = None,
+        workers: int = 1,
+    ) -> None:
+        """
+        A bounded pool of pre-rendered (code, image) pairs per options profile.
+        Background workers refill a profile as soon as it drops to `low_water`.
+
+        :param render: the function that renders a (code, image) pair for an options profile
+        :param size: how many pairs are kept ready per profile
+        :param low_water: refill a profile if it has this many pairs or less left (default: size // 2)
+        :param workers: how many background threads render new pairs
+        """
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self._render = render
+        self.size = size
+        self.low_water = size // 2 if low_water is None else min(low_water, size - 1)
+        self._profiles: Dict[Hashable, _Profile] = {}
+        self._lock = Lock()
+        self._jobs: Queue = Queue()
+        self._closed = False
+
+        self.hits = 0
+        self.misses = 0
+        self.rendered = 0
+        self.failed = 0
+        self.refill_time = 0.0
+        self.refill_time_max = 0.0
+
+        self._workers = [
+            Thread(target=self._work, name=f"CaptchaPool-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def get(self, options) -> Tuple[str, Any]:
+        """
+        Pops a ready (code, image) pair for the profile of `options`.
+        Renders it in the calling thread if the pool for this profile is empty.
+        """
+        with self._lock:
+            profile = self._profile(options)
+            pair = profile.ready.popleft() if profile.ready else None
+            if pair is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self._schedule_refill(profile)
+
+        if pair is None:
+            pair = self._render(copy.copy(profile.options))
+        return pair
+
+    def warm_up(self, *options, wait: bool = True, timeout: float = None) -> None:
+        """
+        Fills the pool for the given options profiles.
+        :param wait: block until every profile is filled
+        :param timeout: give up waiting after this many seconds
+        """
+        with self._lock:
+            profiles = [self._profile(opt) for opt in options]
+            for profile in profiles:
+                self._schedule_refill(profile, self.size)
+        if not wait:
+            return
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while any(p.in_flight for p in profiles):
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            time.sleep(0.01)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Hits, misses and refill latency of the pool.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "rendered": self.rendered,
+                "failed": self.failed,
+                "refill_time_avg": self.refill_time / self.rendered
+                if self.rendered
+                else 0.0,
+                "refill_time_max": self.refill_time_max,
+                "ready": {key: len(p.ready) for key, p in self._profiles.items()},
+            }
+
+    def close(self) -> None:
+        """
+        Stops the background workers. Pairs that are ready are dropped.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._profiles.clear()
+        for _ in self._workers:
+            self._jobs.put(None)
+
+    def _profile(self, options) -> _Profile:
+        key = profile_key(options)
+        profile = self._profiles.get(key)
+        if profile is None:
+            profile = self._profiles[key] = _Profile(options)
+        return profile
+
+    def _schedule_refill(self, profile: _Profile, level: int = None) -> None:
+        # must be called with the lock held
+        if self._closed:
+            return
+        available = len(profile.ready) + profile.in_flight
+        if level is None and available > self.low_water:
+            return
+        for _ in range(self.size - available):
+            profile.in_flight += 1
+            self._jobs.put(profile)
+
+    def _work(self) -> None:
+        while True:
+            profile = self._jobs.get()
+            if profile is None:
+                return
+            if self._closed:
+                # drop the refills that were queued before `close()`
+                continue
+            start = time.perf_counter()
+            try:
+                pair = self._render(copy.copy(profile.options))
+            except Exception:
+                logger.exception("Could not render a captcha for the pool")
+                with self._lock:
+                    profile.in_flight -= 1
+                    self.failed += 1
+                # do not spin on a generator that keeps failing (e.g. keyzend is down)
+                time.sleep(1)
+                continue
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                profile.in_flight -= 1
+                profile.ready.append(pair)
+                self.rendered += 1
+                self.refill_time += elapsed
+                self.refill_time_max = max(self.refill_time_max, elapsed)
+
+
+class _LibraryEntry:
+    __slots__ = ("code", "image", "file_id", "uses", "created")
+
+    def __init__(self, code: str, image: Any) -> None:
+        self.code = code
+        self.image = image
+        self.file_id: Optional[str] = None
+        self.uses = 0
+        self.created = time.monotonic()
+
+
+class CaptchaLibrary:
+    def __init__(
+        self,
+        render: Callable[[Any], Tuple[str, Any]],
+        size: int = 32,
+        max_uses: int = 10,
+        ttl: float = 3600,
+    ) -> None:
+        """
+        A bounded library of rendered captchas per options profile that are uploaded to Telegram once.
+        After the first upload a captcha is sent by its `file_id`, without uploading the image again.
+        Captchas are replaced after `max_uses` sends or `ttl` seconds, so their answers do not leak.
+
+        NOTE: a `file_id` is only valid for the bot that uploaded the image.
+
+        :param render: the function that renders a (code, image) pair for an options profile
+        :param size: how many captchas are in the library per profile
+        :param max_uses: replace a captcha after it was sent this many times
+        :param ttl: replace a captcha after this many seconds
+        """
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        if max_uses < 1:
+            raise ValueError("max_uses must be at least 1")
+        self._render = render
+        self.size = size
+        self.max_uses = max_uses
+        self.ttl = ttl
+        self._profiles: Dict[Hashable, List[_LibraryEntry]] = {}
+        self._lock = Lock()
+
+        self.uploads = 0
+        self.reuses = 0
+        self.rotated = 0
+
+    def get(self, options, exclude: Optional[str] = None) -> _LibraryEntry:
+        """
+        Picks a random captcha of the profile of `options`.
+        Send `entry.file_id` if it is set, otherwise upload `entry.image` and call `uploaded()`.
+        :param exclude: the code of a captcha that is reloaded, it is not picked again
+        """
+        key = profile_key(options)
+        with self._lock:
+            entries = self._profiles.setdefault(key, [])
+            index = random.randrange(self.size)
+            if (
+                exclude is not None
+                and self.size > 1
+                and index < len(entries)
+                and entries[index].code == exclude
+            ):
+                index = (index + random.randrange(1, self.size)) % self.size
+            entry = entries[index] if index < len(entries) else None
+            if entry is not None and (self._expired(entry) or entry.code == exclude):
+                entry = None
+                self.rotated += 1
+        if entry is None:
+            entry = _LibraryEntry(*self._render(options))
+            with self._lock:
+                # other threads added entries while this one rendered, checked again
+                # under the lock so the profile never holds more than `size`
+                if index < len(entries):
+                    entries[index] = entry
+                elif len(entries) < self.size:
+                    entries.append(entry)
+        with self._lock:
+            entry.uses += 1
+            if entry.file_id:
+                self.reuses += 1
+            else:
+                self.uploads += 1
+        return entry
+
+    def uploaded(self, entry: _LibraryEntry, file_id: Optional[str]) -> None:
+        """
+        Records the `file_id` Telegram returned for the uploaded image of `entry`.
+        The image itself is not needed anymore.
+        """
+        if file_id and not entry.file_id:
+            entry.file_id = file_id
+            entry.image = None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "uploads": self.uploads,
+                "reuses": self.reuses,
+                "rotated": self.rotated,
+                "entries": sum(len(e) for e in self._profiles.values()),
+            }
+
+    def _expired(self, entry: _LibraryEntry) -> bool:
+        return (
+            entry.uses >= self.max_uses
+            or time.monotonic() - entry.created >= self.ttl
+        )
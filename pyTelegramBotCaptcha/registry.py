@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+import time
+from collections.abc import MutableMapping
+from threading import Lock
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    ItemsView,
+    Iterator,
+    KeysView,
+    List,
+    Optional,
+    Tuple,
+    ValuesView,
+)
+
+
+class CaptchaRegistry(MutableMapping):
+    def __init__(
+        self,
+        max_size: int = 0,
+        ttl: float = 300,
+        on_evict: Optional[Callable[[Any, str], None]] = None,
+        is_live: Optional[Callable[[Any], bool]] = None,
+    ) -> None:
+        """
+        The captchas of a manager in memory, by `captcha_id` like a dict.
+        Also finds a captcha by its chat and the handle in the callback data of its
+        buttons, so a button press needs a single dict lookup.
+
+        Captchas that are solved or timed out but were not deleted are evicted
+        `ttl` seconds later by `sweep()`. If there are more than `max_size` captchas,
+        the ones that finished first are evicted, then the ones that were added first.
+        `on_evict(captcha, reason)` is called for every evicted captcha.
+        The reason is `"ttl"`, `"finished"` or `"pending"` (evicted to make room).
+        A finished captcha for which `is_live(captcha)` is true, e.g. because it was
+        reset and has a pending timeout again, is not evicted as finished.
+
+        :param max_size: the most captchas to keep, 0: no limit
+        :param ttl: how many seconds a finished captcha is kept
+        :param on_evict: called with every evicted captcha and the reason
+        :param is_live: tells if a finished captcha is in use again
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.is_live = is_live
+        self._captchas: Dict[str, Any] = {}
+        self._handles: Dict[Tuple[int, str], Any] = {}
+        # captcha_id -> monotonic time it finished, in the order they finished
+        self._finished: Dict[str, float] = {}
+        self._lock = Lock()
+
+    def by_handle(self, chat_id: int, handle: str) -> Optional[Any]:
+        return self._handles.get((chat_id, handle))
+
+    def get(self, captcha_id: str, default=None) -> Optional[Any]:
+        return self._captchas.get(captcha_id, default)
+
+    def finish(self, captcha: Any) -> None:
+        """
+        Marks a solved or timed out captcha, it is evicted `ttl` seconds later.
+        """
+        captcha_id = captcha._captcha_id
+        with self._lock:
+            if self._captchas.get(captcha_id) is captcha:
+                self._finished.setdefault(captcha_id, time.monotonic())
+
+    def unfinish(self, captcha: Any) -> None:
+        """
+        Unmarks a captcha that was reset after it finished.
+        """
+        with self._lock:
+            if self._captchas.get(captcha._captcha_id) is captcha:
+                self._finished.pop(captcha._captcha_id, None)
+
+    def is_finished(self, captcha: Any) -> bool:
+        """
+        Tells if the captcha was solved or timed out and not reset since.
+        """
+        captcha_id = captcha._captcha_id
+        return captcha_id in self._finished and self._captchas.get(captcha_id) is captcha
+
+    @property
+    def finished(self) -> int:
+        """
+        The number of finished captchas that were not evicted yet.
+        """
+        return len(self._finished)
+
+    def sweep(self) -> int:
+        """
+        Evicts the finished captchas that are older than `ttl`.
+        :return: the number of evicted captchas
+        """
+        before = time.monotonic() - self.ttl
+        with self._lock:
+            expired = []
+            for captcha_id, finished_at in self._finished.items():
+                if finished_at > before:
+                    break
+                expired.append(captcha_id)
+            evicted = []
+            for captcha_id in expired:
+                if self._live(captcha_id):
+                    del self._finished[captcha_id]
+                else:
+                    evicted.append((self._remove(captcha_id), "ttl"))
+        self._evicted(evicted)
+        return len(evicted)
+
+    def __getitem__(self, captcha_id: str) -> Any:
+        return self._captchas[captcha_id]
+
+    def __setitem__(self, captcha_id: str, captcha: Any) -> None:
+        # the chat and the handle (the user) are part of the captcha_id
+        with self._lock:
+            if captcha_id in self._captchas:
+                # a new captcha of the user goes to the end
+                self._remove(captcha_id)
+            self._captchas[captcha_id] = captcha
+            self._handles[captcha.chat.id, captcha.handle] = captcha
+            evicted = self._overflow() if self.max_size else []
+        self._evicted(evicted)
+
+    def __delitem__(self, captcha_id: str) -> None:
+        self.pop(captcha_id)
+
+    def pop(self, captcha_id: str, *default) -> Any:
+        with self._lock:
+            if captcha_id not in self._captchas:
+                if default:
+                    return default[0]
+                raise KeyError(captcha_id)
+            return self._remove(captcha_id)
+
+    def _remove(self, captcha_id: str) -> Any:
+        # the lock must be held
+        captcha = self._captchas.pop(captcha_id)
+        self._finished.pop(captcha_id, None)
+        key = (captcha.chat.id, captcha.handle)
+        if self._handles.get(key) is captcha:
+            del self._handles[key]
+        return captcha
+
+    def _overflow(self) -> List[Tuple[Any, str]]:
+        # the lock must be held
+        evicted = []
+        while len(self._captchas) > self.max_size:
+            if self._finished:
+                captcha_id, reason = next(iter(self._finished)), "finished"
+                if self._live(captcha_id):
+                    del self._finished[captcha_id]
+                    continue
+            else:
+                captcha_id, reason = next(iter(self._captchas)), "pending"
+            evicted.append((self._remove(captcha_id), reason))
+        return evicted
+
+    def _live(self, captcha_id: str) -> bool:
+        # the lock must be held
+        return self.is_live is not None and self.is_live(self._captchas[captcha_id])
+
+    def _evicted(self, evicted: List[Tuple[Any, str]]) -> None:
+        if self.on_evict is None:
+            return
+        for captcha, reason in evicted:
+            self.on_evict(captcha, reason)
+
+    # views of the dict, `list(registry.values())` is safe while other threads change it
+    def keys(self) -> KeysView:
+        return self._captchas.keys()
+
+    def values(self) -> ValuesView:
+        return self._captchas.values()
+
+    def items(self) -> ItemsView:
+        return self._captchas.items()
+
+    def __contains__(self, captcha_id: object) -> bool:
+        return captcha_id in self._captchas
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._captchas)
+
+    def __len__(self) -> int:
+        return len(self._captchas)
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+import socket
+from threading import Lock
+from typing import Any, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+
+class RedisError(Exception):
+    """
+    The server answered a command with an error.
+    """
+
+
+class _Connection:
+    def __init__(self, host: str, port: int, timeout: Optional[float]) -> None:
+        self._sock = socket.create_connection((host, port), timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._sock.makefile("rb")
+
+    def send(self, *commands: Tuple) -> None:
+        self._sock.sendall(b"".join(_encode(command) for command in commands))
+
+    def read(self) -> Any:
+        line = self._reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("The connection to the server was closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            return RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            if len(data) != length + 2:
+                raise ConnectionError("The connection to the server was closed")
+            return data[:-2]
+        if kind == b"*":
+            length = int(rest)
+            if length < 0:
+                return None
+            return [self.read() for _ in range(length)]
+        raise ConnectionError(f"Unexpected reply from the server: {line!r}")
+
+    def close(self) -> None:
+        try:
+            self._reader.close()
+            self._sock.close()
+        except OSError:
+            pass
+
+
+class RedisClient:
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 6379,
+        db: int = 0,
+        password: Optional[str] = None,
+        username: Optional[str] = None,
+        timeout: Optional[float] = 5.0,
+        max_connections: int = 8,
+    ) -> None:
+        """
+        A minimal client for the Redis protocol (RESP2), enough for `RedisStorage`.
+        It works with Redis, Valkey, KeyDB and every other server that speaks the protocol.
+        Connections are opened on demand and reused, a thread has a connection for itself while
+        it sends a command.
+
+        :param host: the host of the server
+        :param port: the port of the server
+        :param db: the database to select
+        :param password: the password, if the server requires one
+        :param username: the ACL user (Redis 6+), if the server requires one
+        :param timeout: seconds to wait for the connection and for every reply
+        :param max_connections: how many idle connections are kept open
+        """
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.username = username
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._idle: List[_Connection] = []
+        self._lock = Lock()
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "RedisClient":
+        """
+        Creates a client from a `redis://[[username]:password@]host[:port][/db]` url.
+        """
+        parsed = urlparse(url)
+        if parsed.scheme != "redis":
+            raise ValueError(f"Unsupported url scheme: {parsed.scheme}")
+        path = parsed.path.strip("/")
+        return cls(
+            host=parsed.hostname or "localhost",
+            port=parsed.port or 6379,
+            db=int(path) if path else 0,
+            password=unquote(parsed.password) if parsed.password else None,
+            username=unquote(parsed.username) if parsed.username else None,
+            **kwargs,
+        )
+
+    def execute(self, *args) -> Any:
+        """
+        Sends a single command and returns its reply.
+        Bulk strings are returned as bytes.
+        :raises RedisError: if the server answered with an error
+        """
+        return self.pipeline(args)[0]
+
+    def pipeline(self, *commands: Tuple) -> List:
+        """
+        Sends several commands at once and returns their replies.
+        Other clients can run commands in between, use `transaction` if they must not.
+        """
+        replies = self._roundtrip(commands)
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    def transaction(self, *commands: Tuple) -> List:
+        """
+        Runs several commands atomically (MULTI/EXEC) and returns their replies.
+        """
+        replies = self._roundtrip((("MULTI",),) + commands + (("EXEC",),))
+        for reply in replies[:-1]:
+            if isinstance(reply, RedisError):
+                raise reply
+        results = replies[-1]
+        if isinstance(results, RedisError):
+            raise results
+        if results is None:
+            raise RedisError("The transaction was aborted")
+        for result in results:
+            if isinstance(result, RedisError):
+                raise result
+        return results
+
+    def close(self) -> None:
+        """
+        Closes the idle connections.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+    def _roundtrip(self, commands: Tuple) -> List:
+        connection = self._acquire()
+        try:
+            connection.send(*commands)
+            replies = [connection.read() for _ in commands]
+        except (OSError, ValueError):
+            # the state of the connection is unknown, it must not be reused
+            connection.close()
+            raise
+        self._release(connection)
+        return replies
+
+    def _acquire(self) -> _Connection:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        connection = _Connection(self.host, self.port, self.timeout)
+        setup = []
+        if self.password is not None:
+            if self.username:
+                setup.append(("AUTH", self.username, self.password))
+            else:
+                setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            connection.send(*setup)
+            for _ in setup:
+                reply = connection.read()
+                if isinstance(reply, RedisError):
+                    connection.close()
+                    raise reply
+        return connection
+
+    def _release(self, connection: _Connection) -> None:
+        with self._lock:
+            if len(self._idle) < self.max_connections:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+
+def _encode(command: Tuple) -> bytes:
+    parts = [b"*%d\r\n" % len(command)]
+    for arg in command:
+        if isinstance(arg, bytes):
+            data = arg
+        elif isinstance(arg, str):
+            data = arg.encode()
+        else:
+            data = repr(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(parts)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import heapq
+import itertools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Thread
+from typing import Callable, Iterable, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+class TimeoutHandle:
+    __slots__ = ("deadline", "function", "args", "cancelled", "_scheduler")
+
+    def __init__(self, scheduler, deadline: float, function: Callable, args) -> None:
+        self._scheduler = scheduler
+        self.deadline = deadline
+        self.function = function
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        """
+        Cancels the timeout. Does nothing if it has already fired or was cancelled.
+        """
+        self._scheduler._cancel(self)
+
+    @property
+    def pending(self) -> bool:
+        """
+        The timeout has neither fired nor been cancelled yet.
+        """
+        return not self.cancelled and self.function is not None
+
+
+class TimeoutScheduler:
+    def __init__(self, max_workers: int = 4) -> None:
+        """
+        Runs the timeouts of all captchas from a single thread.
+        Pending timeouts are kept in a heap (O(log n) to schedule, O(1) to cancel).
+        Due timeouts are handed to a thread pool of `max_workers` threads,
+        so a slow `on_timeout` handler does not delay the others.
+
+        :param max_workers: how many timeout handlers can run at the same time
+        """
+        self._heap: List = []
+        self._counter = itertools.count()
+        self._cancelled = 0
+        self._condition = Condition()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="CaptchaTimeout"
+        )
+        self._thread: Optional[Thread] = None
+        self._closed = False
+
+    @property
+    def pending(self) -> int:
+        """
+        The number of timeouts that are scheduled and not cancelled yet.
+        """
+        return len(self._heap) - self._cancelled
+
+    def schedule(self, delay: float, function: Callable, *args) -> TimeoutHandle:
+        """
+        Calls `function(*args)` after `delay` seconds.
+        :return: a handle to cancel the timeout
+        """
+        return self.schedule_many([(delay, function, args)])[0]
+
+    def schedule_many(
+        self, timeouts: Iterable[Tuple[float, Callable, tuple]]
+    ) -> List[TimeoutHandle]:
+        """
+        Schedules many (delay, function, args) timeouts at once, with a single lock acquisition.
+        :return: a handle per timeout, in the same order
+        """
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("The scheduler is closed")
+            now = time.monotonic()
+            earliest = self._heap[0][2] if self._heap else None
+            handles = []
+            for delay, function, args in timeouts:
+                handle = TimeoutHandle(self, now + delay, function, args)
+                heapq.heappush(
+                    self._heap, (handle.deadline, next(self._counter), handle)
+                )
+                handles.append(handle)
+            if self._thread is None:
+                self._thread = Thread(
+                    target=self._run, name="CaptchaScheduler", daemon=True
+                )
+                self._thread.start()
+            # wake the scheduler thread if there is a new earliest timeout
+            if self._heap and self._heap[0][2] is not earliest:
+                self._condition.notify()
+        return handles
+
+    def close(self, wait: bool = False) -> None:
+        """
+        Stops the scheduler. Pending timeouts are dropped.
+        """
+        with self._condition:
+            self._closed = True
+            self._heap.clear()
+            self._cancelled = 0
+            self._condition.notify()
+        self._executor.shutdown(wait=wait)
+
+    def _cancel(self, handle: TimeoutHandle) -> None:
+        with self._condition:
+            if handle.cancelled or handle.function is None:
+                return
+            handle.cancelled = True
+            self._cancelled += 1
+            # cancelled handles stay in the heap until they are due,
+            # rebuild it if they take more than half of the space
+            if self._cancelled > 64 and self._cancelled * 2 > len(self._heap):
+                self._heap = [e for e in self._heap if not e[2].cancelled]
+                heapq.heapify(self._heap)
+                self._cancelled = 0
+
+    def _run(self) -> None:
+        with self._condition:
+            while not self._closed:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                deadline, _, handle = self._heap[0]
+                if handle.cancelled:
+                    heapq.heappop(self._heap)
+                    self._cancelled -= 1
+                    continue
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                function, args = handle.function, handle.args
+                # a fired handle can not be cancelled anymore
+                handle.function, handle.args = None, ()
+                try:
+                    self._executor.submit(self._call, function, args)
+                except RuntimeError:
+                    # the executor was shut down
+                    return
+
+    @staticmethod
+    def _call(function: Callable, args) -> None:
+        try:
+            function(*args)
+        except Exception:
+            logger.exception("Exception in captcha timeout handler")
@@ -0,0 +1,622 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Condition, Lock, Thread
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from .resp import RedisClient
+
+
+logger = logging.getLogger(__name__)
+
+# deletes a lock only if it still holds the token of its owner
+_UNLOCK_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+# moves the due deadlines to the end of the lease of the claiming process
+_CLAIM_SCRIPT = """
+local due = redis.call("ZRANGEBYSCORE", KEYS[1], "-inf", ARGV[1], "LIMIT", 0, ARGV[2])
+for _, member in ipairs(due) do
+    redis.call("ZADD", KEYS[1], ARGV[3], member)
+end
+return due
+"""
+
+
+def _split_captcha_id(captcha_id: str) -> Tuple[int, int, int]:
+    bot_id, chat_id, user_id = captcha_id.split("=")
+    return int(bot_id), int(chat_id), int(user_id)
+
+
+def _is_legacy_file(path: str) -> bool:
+    # `to_json()` of older versions saved an object, records are arrays
+    with open(path, "r", encoding="utf8") as f:
+        return f.read(1) == "{"
+
+
+class CaptchaStorage:
+    """
+    Base class of the storage backends that persist the state of pending captchas.
+    A captcha is stored as its `to_record()` string under its `captcha_id` (`{bot_id}={chat_id}={user_id}`),
+    together with its deadline (the timestamp when it times out).
+
+    Subclass it and override `save`, `delete`, `load`, `load_all` and `index` to add your own backend.
+    A backend that several processes use at the same time sets `shared` and also overrides
+    `lock` and `claim_expired`.
+    """
+
+    # several processes (e.g. webhook workers) use the same captchas
+    shared = False
+
+    def save(self, captcha_id: str, data: str, deadline: Optional[float] = None) -> None:
+        raise NotImplementedError
+
+    def delete(self, captcha_id: str) -> None:
+        raise NotImplementedError
+
+    def load(self, captcha_id: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def load_all(self, bot_id: int) -> Iterator[str]:
+        """
+        Yields all saved captchas of the bot with the given `bot_id`.
+        """
+        raise NotImplementedError
+
+    def index(self, bot_id: int) -> Iterator[Tuple[str, Optional[float]]]:
+        """
+        Yields (captcha_id, deadline) of all saved captchas of the bot without loading them.
+        The deadline is `None` if it is unknown.
+        """
+        raise NotImplementedError
+
+    def save_many(self, items: Iterable[Tuple[str, str, Optional[float]]]) -> None:
+        """
+        Saves many (captcha_id, data, deadline) tuples at once.
+        Backends that support transactions write them in a single one.
+        """
+        for captcha_id, data, deadline in items:
+            self.save(captcha_id, data, deadline)
+
+    def delete_many(self, captcha_ids: Iterable[str]) -> None:
+        for captcha_id in captcha_ids:
+            self.delete(captcha_id)
+
+    def purge(self, bot_id: int, before: float) -> int:
+        """
+        Deletes all captchas of the bot whose deadline is older than `before`.
+        :return: the number of deleted captchas
+        """
+        expired = [
+            captcha_id
+            for captcha_id, deadline in self.index(bot_id)
+            if deadline is not None and deadline < before
+        ]
+        self.delete_many(expired)
+        return len(expired)
+
+    @contextmanager
+    def lock(self, captcha_id: str) -> Iterator[None]:
+        """
+        Keeps the other processes from changing the captcha while the context is held.
+        Only needed by shared backends, the default does nothing.
+        """
+        yield
+
+    def claim_expired(self, bot_id: int, before: float, limit: int = 100) -> List[str]:
+        """
+        Claims up to `limit` captchas of the bot whose deadline is older than `before`.
+        A captcha is only returned to one of the processes that claim it at the same time.
+        Its deadline is kept until its timeout was handled (the captcha is deleted or saved
+        again), so it is claimed again if the process dies in between.
+        Only needed by shared backends.
+        :return: the captcha_ids this process must fire the timeout of
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class DirectoryStorage(CaptchaStorage):
+    def __init__(self, path: Union[str, Path] = ".captcha-saves") -> None:
+        """
+        Saves every captcha as `{captcha_id}.json` into a directory.
+        The modification time of a file is set to the deadline of its captcha,
+        so the index can be read from the directory listing alone.
+        :param path: the directory to use. It is created on the first save.
+        """
+        self.path = Path(path)
+
+    def _filepath(self, captcha_id: str) -> Path:
+        return self.path / (captcha_id + ".json")
+
+    def save(self, captcha_id: str, data: str, deadline: Optional[float] = None) -> None:
+        if not self.path.exists():
+            os.makedirs(str(self.path), exist_ok=True)
+        filepath = self._filepath(captcha_id)
+        with open(filepath, "w+", encoding="utf8") as f:
+            f.write(data)
+        if deadline is not None:
+            os.utime(filepath, (deadline, deadline))
+
+    def delete(self, captcha_id: str) -> None:
+        filepath = self._filepath(captcha_id)
+        if filepath.exists():
+            filepath.unlink()
+
+    def load(self, captcha_id: str) -> Optional[str]:
+        filepath = self._filepath(captcha_id)
+        if not filepath.exists():
+            return None
+        with filepath.open("r", encoding="utf8") as f:
+            return f.read()
+
+    def load_all(self, bot_id: int) -> Iterator[str]:
+        if not self.path.exists():
+            return
+        for f in os.listdir(self.path):
+            if f.startswith(f"{bot_id}=") and f.endswith(".json"):
+                with (self.path / f).open("r", encoding="utf8") as f:
+                    yield f.read()
+
+    def index(self, bot_id: int) -> Iterator[Tuple[str, Optional[float]]]:
+        if not self.path.exists():
+            return
+        prefix = f"{bot_id}="
+        now = time.time()
+        with os.scandir(str(self.path)) as entries:
+            for entry in entries:
+                if not (entry.name.startswith(prefix) and entry.name.endswith(".json")):
+                    continue
+                try:
+                    deadline = entry.stat().st_mtime
+                    # the modification time of files saved by older versions is the time
+                    # of the last save, which is in the past. Only those are read.
+                    if deadline <= now and _is_legacy_file(entry.path):
+                        deadline = None
+                except FileNotFoundError:
+                    # deleted in the meantime
+                    continue
+                yield entry.name[: -len(".json")], deadline
+
+
+class MemoryStorage(CaptchaStorage):
+    """
+    Keeps the captchas in memory only. Pending captchas are lost when the process exits.
+    """
+
+    def __init__(self) -> None:
+        self._data: Dict[str, Tuple[str, Optional[float]]] = {}
+
+    def save(self, captcha_id: str, data: str, deadline: Optional[float] = None) -> None:
+        self._data[captcha_id] = (data, deadline)
+
+    def delete(self, captcha_id: str) -> None:
+        self._data.pop(captcha_id, None)
+
+    def load(self, captcha_id: str) -> Optional[str]:
+        record = self._data.get(captcha_id)
+        return record[0] if record else None
+
+    def load_all(self, bot_id: int) -> Iterator[str]:
+        prefix = f"{bot_id}="
+        for captcha_id, (data, _) in list(self._data.items()):
+            if captcha_id.startswith(prefix):
+                yield data
+
+    def index(self, bot_id: int) -> Iterator[Tuple[str, Optional[float]]]:
+        prefix = f"{bot_id}="
+        for captcha_id, (_, deadline) in list(self._data.items()):
+            if captcha_id.startswith(prefix):
+                yield captcha_id, deadline
+
+
+class SQLiteStorage(CaptchaStorage):
+    def __init__(
+        self, path: Union[str, Path] = ".captcha-saves.sqlite3", compact_every: int = 1000
+    ) -> None:
+        """
+        Saves all captchas into a single SQLite database.
+        Captchas are indexed by (bot_id, chat_id, user_id), `save_many` and `delete_many`
+        write in a single transaction.
+
+        :param path: the database file. Use ":memory:" for a database without a file.
+        :param compact_every: give the space of deleted captchas back to the file system
+            after this many deletes. 0 disables it.
+        """
+        self.path = str(path)
+        self.compact_every = compact_every
+        self._deletes = 0
+        self._lock = Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._db:
+            # must be set before the first table is created
+            self._db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            if self.path != ":memory:":
+                self._db.execute("PRAGMA journal_mode = WAL")
+                self._db.execute("PRAGMA synchronous = NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS captchas ("
+                "bot_id INTEGER NOT NULL, chat_id INTEGER NOT NULL, user_id INTEGER NOT NULL, "
+                "data TEXT NOT NULL, deadline REAL, PRIMARY KEY (bot_id, chat_id, user_id)"
+                ") WITHOUT ROWID"
+            )
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(captchas)")]
+            if "deadline" not in columns:
+                self._db.execute("ALTER TABLE captchas ADD COLUMN deadline REAL")
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS captchas_deadline ON captchas (bot_id, deadline)"
+            )
+
+    def save(self, captcha_id: str, data: str, deadline: Optional[float] = None) -> None:
+        self.save_many([(captcha_id, data, deadline)])
+
+    def save_many(self, items: Iterable[Tuple[str, str, Optional[float]]]) -> None:
+        rows = [
+            _split_captcha_id(captcha_id) + (data, deadline)
+            for captcha_id, data, deadline in items
+        ]
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO captchas (bot_id, chat_id, user_id, data, deadline) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def delete(self, captcha_id: str) -> None:
+        self.delete_many([captcha_id])
+
+    def delete_many(self, captcha_ids: Iterable[str]) -> None:
+        keys = [_split_captcha_id(captcha_id) for captcha_id in captcha_ids]
+        with self._lock:
+            with self._db:
+                self._db.executemany(
+                    "DELETE FROM captchas WHERE bot_id = ? AND chat_id = ? AND user_id = ?",
+                    keys,
+                )
+            self._deletes += len(keys)
+            if self.compact_every and self._deletes >= self.compact_every:
+                self._compact()
+
+    def load(self, captcha_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT data FROM captchas WHERE bot_id = ? AND chat_id = ? AND user_id = ?",
+                _split_captcha_id(captcha_id),
+            ).fetchone()
+        return row[0] if row else None
+
+    def load_all(self, bot_id: int) -> Iterator[str]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT data FROM captchas WHERE bot_id = ?", (bot_id,)
+            ).fetchall()
+        for (data,) in rows:
+            yield data
+
+    def index(self, bot_id: int) -> Iterator[Tuple[str, Optional[float]]]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT chat_id, user_id, deadline FROM captchas WHERE bot_id = ?",
+                (bot_id,),
+            ).fetchall()
+        for chat_id, user_id, deadline in rows:
+            yield f"{bot_id}={chat_id}={user_id}", deadline
+
+    def purge(self, bot_id: int, before: float) -> int:
+        with self._lock:
+            with self._db:
+                deleted = self._db.execute(
+                    "DELETE FROM captchas WHERE bot_id = ? AND deadline < ?",
+                    (bot_id, before),
+                ).rowcount
+            self._deletes += deleted
+            if self.compact_every and self._deletes >= self.compact_every:
+                self._compact()
+        return deleted
+
+    def compact(self) -> None:
+        """
+        Gives the space of deleted captchas back to the file system.
+        """
+        with self._lock:
+            self._compact()
+
+    def _compact(self) -> None:
+        # must be called with the lock held
+        self._deletes = 0
+        # the pragma frees one page per step and returns no rows, `execute` would only
+        # run the first step while `executescript` runs it to the end
+        self._db.executescript("PRAGMA incremental_vacuum;")
+        if self.path != ":memory:":
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class RedisStorage(CaptchaStorage):
+    shared = True
+
+    def __init__(
+        self,
+        url: str = "redis://localhost:6379/0",
+        prefix: str = "captcha:",
+        lock_ttl: float = 10.0,
+        client: Optional[RedisClient] = None,
+        claim_ttl: float = 60.0,
+    ) -> None:
+        """
+        Saves all captchas into Redis (or any server that speaks the Redis protocol),
+        so several processes of a bot, e.g. webhook workers behind a load balancer, share them.
+        Any process can handle the callbacks of any captcha, the captcha is locked while it is changed.
+        The deadlines are kept in a sorted set per bot. A process claims a due captcha by moving
+        its deadline `claim_ttl` seconds ahead and fires its `on_timeout`. The handled captcha is
+        deleted or saved without a deadline, if the process dies first another one claims it again.
+
+        :param url: `redis://[[username]:password@]host[:port][/db]`
+        :param prefix: the prefix of all keys, to share the database with other applications
+        :param lock_ttl: seconds until the lock of a captcha is released if its process died.
+            Also how long a process waits for a lock.
+        :param client: the `RedisClient` to use instead of connecting to `url`
+        :param claim_ttl: seconds a process has to handle a timeout it claimed
+        """
+        self.prefix = prefix
+        self.lock_ttl = lock_ttl
+        self.claim_ttl = claim_ttl
+        self._own_client = client is None
+        self.client = client or RedisClient.from_url(url)
+
+    def _data_key(self, captcha_id: str) -> str:
+        return f"{self.prefix}{captcha_id}"
+
+    def _ids_key(self, bot_id: int) -> str:
+        return f"{self.prefix}ids:{bot_id}"
+
+    def _deadlines_key(self, bot_id: int) -> str:
+        return f"{self.prefix}deadlines:{bot_id}"
+
+    def save(self, captcha_id: str, data: str, deadline: Optional[float] = None) -> None:
+        self.save_many([(captcha_id, data, deadline)])
+
+    def save_many(self, items: Iterable[Tuple[str, str, Optional[float]]]) -> None:
+        commands = []
+        for captcha_id, data, deadline in items:
+            bot_id = _split_captcha_id(captcha_id)[0]
+            commands.append(("SET", self._data_key(captcha_id), data))
+            commands.append(("SADD", self._ids_key(bot_id), captcha_id))
+            if deadline is None:
+                commands.append(("ZREM", self._deadlines_key(bot_id), captcha_id))
+            else:
+                commands.append(
+                    ("ZADD", self._deadlines_key(bot_id), float(deadline), captcha_id)
+                )
+        if commands:
+            self.client.transaction(*commands)
+
+    def delete(self, captcha_id: str) -> None:
+        self.delete_many([captcha_id])
+
+    def delete_many(self, captcha_ids: Iterable[str]) -> None:
+        commands = []
+        for captcha_id in captcha_ids:
+            bot_id = _split_captcha_id(captcha_id)[0]
+            commands.append(("DEL", self._data_key(captcha_id)))
+            commands.append(("SREM", self._ids_key(bot_id), captcha_id))
+            commands.append(("ZREM", self._deadlines_key(bot_id), captcha_id))
+        if commands:
+            self.client.transaction(*commands)
+
+    def load(self, captcha_id: str) -> Optional[str]:
+        data = self.client.execute("GET", self._data_key(captcha_id))
+        return data.decode() if data is not None else None
+
+    def load_all(self, bot_id: int) -> Iterator[str]:
+        captcha_ids = [
+            captcha_id.decode()
+            for captcha_id in self.client.execute("SMEMBERS", self._ids_key(bot_id))
+        ]
+        for i in range(0, len(captcha_ids), 500):
+            keys = [
+                self._data_key(captcha_id) for captcha_id in captcha_ids[i : i + 500]
+            ]
+            for data in self.client.execute("MGET", *keys):
+                if data is not None:
+                    yield data.decode()
+
+    def index(self, bot_id: int) -> Iterator[Tuple[str, Optional[float]]]:
+        captcha_ids, scores = self.client.pipeline(
+            ("SMEMBERS", self._ids_key(bot_id)),
+            ("ZRANGE", self._deadlines_key(bot_id), 0, -1, "WITHSCORES"),
+        )
+        deadlines = {
+            scores[i].decode(): float(scores[i + 1]) for i in range(0, len(scores), 2)
+        }
+        for captcha_id in captcha_ids:
+            captcha_id = captcha_id.decode()
+            yield captcha_id, deadlines.get(captcha_id)
+
+    def purge(self, bot_id: int, before: float) -> int:
+        expired = [
+            captcha_id.decode()
+            for captcha_id in self.client.execute(
+                "ZRANGEBYSCORE", self._deadlines_key(bot_id), "-inf", f"({before!r}"
+            )
+        ]
+        self.delete_many(expired)
+        return len(expired)
+
+    def claim_expired(self, bot_id: int, before: float, limit: int = 100) -> List[str]:
+        # the script is atomic, a claimed captcha is not due for the other processes
+        lease = max(time.time(), float(before)) + self.claim_ttl
+        due = self.client.execute(
+            "EVAL",
+            _CLAIM_SCRIPT,
+            1,
+            self._deadlines_key(bot_id),
+            float(before),
+            limit,
+            lease,
+        )
+        return [member.decode() for member in due]
+
+    @contextmanager
+    def lock(self, captcha_id: str) -> Iterator[None]:
+        key = self._data_key("lock:" + captcha_id)
+        token = os.urandom(16).hex()
+        deadline = time.monotonic() + self.lock_ttl
+        ttl_ms = int(self.lock_ttl * 1000)
+        while self.client.execute("SET", key, token, "NX", "PX", ttl_ms) is None:
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Could not lock captcha {captcha_id}")
+            time.sleep(0.005)
+        try:
+            yield
+        finally:
+            # a lock that expired and was taken by another process is not deleted
+            self.client.execute("EVAL", _UNLOCK_SCRIPT, 1, key, token)
+
+    def close(self) -> None:
+        if self._own_client:
+            self.client.close()
+
+
+class WriteBehind:
+    def __init__(
+        self,
+        storage: CaptchaStorage,
+        interval: float = 1.0,
+        batch_size: int = 100,
+        on_flush: Optional[Callable[[float], None]] = None,
+    ) -> None:
+        """
+        Buffers captcha writes and flushes them to `storage` in batches.
+        Captchas are only marked as dirty and serialized when they are flushed,
+        so repeated updates of the same captcha cost a single write.
+
+        A batch is flushed every `interval` seconds, as soon as `batch_size` captchas are dirty,
+        on `flush()` and on `close()`.
+
+        :param storage: the storage to write to
+        :param interval: seconds between two flushes
+        :param batch_size: flush as soon as this many captchas are dirty
+        :param on_flush: called with the seconds every successful flush took
+        """
+        self.storage = storage
+        self.interval = interval
+        self.batch_size = batch_size
+        self.on_flush = on_flush
+        # captcha_id -> captcha to save or None to delete
+        self._dirty: Dict[str, Any] = {}
+        self._condition = Condition()
+        self._flush_lock = Lock()
+        self._closed = False
+        self._thread = Thread(target=self._run, name="CaptchaWriteBehind", daemon=True)
+        self._thread.start()
+
+    @property
+    def dirty(self) -> int:
+        return len(self._dirty)
+
+    def save(self, captcha_id: str, captcha, force: bool = False) -> None:
+        """
+        Marks a captcha as dirty. `captcha.to_record()` and `captcha.deadline` are read when it is flushed.
+        :param force: flush now (together with all other dirty captchas)
+        """
+        self._mark(captcha_id, captcha, force)
+
+    def delete(self, captcha_id: str, force: bool = False) -> None:
+        self._mark(captcha_id, None, force)
+
+    def load(self, captcha_id: str) -> Optional[str]:
+        """
+        Loads a captcha, including writes that are not flushed yet.
+        """
+        with self._condition:
+            if captcha_id in self._dirty:
+                captcha = self._dirty[captcha_id]
+                return captcha.to_record() if captcha is not None else None
+        return self.storage.load(captcha_id)
+
+    def flush(self) -> None:
+        """
+        Writes all dirty captchas to the storage.
+        """
+        with self._flush_lock:
+            with self._condition:
+                dirty, self._dirty = self._dirty, {}
+            if not dirty:
+                return
+            saves = [
+                (captcha_id, captcha.to_record(), captcha.deadline)
+                for captcha_id, captcha in dirty.items()
+                if captcha is not None
+            ]
+            deletes = [
+                captcha_id for captcha_id, captcha in dirty.items() if captcha is None
+            ]
+            start = time.perf_counter()
+            try:
+                if saves:
+                    self.storage.save_many(saves)
+                if deletes:
+                    self.storage.delete_many(deletes)
+            except Exception:
+                logger.exception("Could not flush %d captchas", len(dirty))
+                with self._condition:
+                    # retry with the next flush, unless the captcha changed since
+                    for captcha_id, captcha in dirty.items():
+                        self._dirty.setdefault(captcha_id, captcha)
+            else:
+                if self.on_flush:
+                    self.on_flush(time.perf_counter() - start)
+
+    def close(self) -> None:
+        """
+        Stops the background thread and flushes the remaining dirty captchas.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self.flush()
+
+    def _mark(self, captcha_id: str, captcha, force: bool) -> None:
+        with self._condition:
+            if self._closed:
+                force = True
+            self._dirty[captcha_id] = captcha
+            full = len(self._dirty) >= self.batch_size
+            if full and not force:
+                self._condition.notify()
+        if force:
+            self.flush()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                if not self._closed and len(self._dirty) < self.batch_size:
+                    self._condition.wait(self.interval)
+                if self._closed:
+                    return
+            self.flush()
@@ -1,12 +1,17 @@
 # -*- coding: utf-8 -*-
+import atexit
+import inspect
+import logging
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
 import random
 from pathlib import Path
 from datetime import datetime
 from typing import Any, Dict, Tuple, List, Optional, Union
 from enum import Enum
-from threading import Timer
-import requests
+from threading import Lock
 from multicolorcaptcha import CaptchaGenerator
 
 try:
@@ -14,20 +19,41 @@ try:
 except:
     import json
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from captcha.image import ImageCaptcha
-from PIL import Image
+from PIL import Image, ImageChops
 from telebot import TeleBot, types
 
+from .keyzend import KeyzendClient, KeyzendUnavailable
+from .metrics import Counter, Gauge, Histogram, Metrics
+from .pool import CaptchaLibrary, CaptchaPool
+from .registry import CaptchaRegistry
+from .scheduler import TimeoutHandle, TimeoutScheduler
+from .storage import CaptchaStorage, DirectoryStorage, WriteBehind
+
+
+logger = logging.getLogger(__name__)
 
 _base_path = Path(__file__).parent.absolute()
 _fonts_path = _base_path / "data" / "fonts"
 _captcha_saves = (Path(".") / ".captcha-saves").parent.absolute()
+# the fonts of the package, listed on first use
 _fonts = []
+# the keyzend client of renders without a manager, created on first use
+_keyzend: Optional[KeyzendClient] = None
 
 MIN_TIMEOUT = 30
 MAX_TIMEOUT = 600
 MIN_CODE_LENGTH = 4
 MAX_CODE_LENGTH = 12
+IMAGE_FORMATS = ("JPEG", "PNG", "WEBP")
+
+IMAGE_SIZE = (300, 128)
+FONT_SIZES = (48, 42, 54)
 
 
 digits = "1234567890"
@@ -35,6 +61,40 @@ hexdigits = digits + "ABCDEF"
 
 captcha_generator = CaptchaGenerator(captcha_size_num=1)  # 1 = (426, 240)
 
+# `ImageCaptcha` renderers with their parsed fonts are shared by all captchas of the
+# process, one per fonts, font sizes and image size.
+_renderer_cache: Dict[Tuple, ImageCaptcha] = {}
+_render_cache_lock = Lock()
+# captions split where the user link goes, by (text, try_again, your_code)
+_caption_templates: Dict[Tuple[str, str, str], Tuple] = {}
+# serialized inline keyboards, split where the user id goes
+_keyboard_templates: Dict[Tuple, Tuple[str, ...]] = {}
+_HANDLE = "#HANDLE#"
+# callback data of the buttons: prefix, one char for the button, handle of the captcha
+_CALLBACK_PREFIX = "?c:"
+_BUTTON_CODES = {"BACK": "<", "OK": "!", "RELOAD": "*"}
+_BUTTON_NAMES = {code: name for name, code in _BUTTON_CODES.items()}
+# the saved fields a process copies from a shared storage into its cached captcha
+_SAVED_STATE = (
+    "solved",
+    "options",
+    "_custom_options",
+    "previous_tries",
+    "correct_code",
+    "users_code",
+    "message_id",
+    "date",
+    "user_reloads_left",
+)
+# the saved fields the captcha keyboard depends on
+_KEYBOARD_STATE = ("correct_code", "previous_tries", "user_reloads_left")
+# the version of the records `Captcha.to_record()` writes
+RECORD_VERSION = 2
+# how many timed out captchas of a shared storage are claimed at once
+_CLAIM_BATCH = 100
+# storage writes take milliseconds, not the seconds of the default buckets
+_STORAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
 languages: Dict = None
 with (_base_path / "data" / "languages.json").open("r", encoding="utf-8") as f:
     languages = json.loads(f.read())
@@ -65,6 +125,7 @@ class CustomLanguage:
         your_code: Optional[str] = None,
         wrong_user: Optional[str] = None,
         too_short: Optional[str] = None,
+        max_reload_limit: Optional[str] = None,
     ) -> None:
         """
         Use this class to customize the texts of a captcha
@@ -82,6 +143,8 @@ class CustomLanguage:
             This text is only displayed to the user who has pressed a button
         :param too_short: The text that is displayed if the user submits but the answer code is shorter than the correct code
             Example: '❌ : The code you entered is too short!'
+        :param max_reload_limit: The text that is displayed if the user presses reload but has no reloads left
+            Example: '❌ : You can not reload the CAPTCHA anymore!'
         """
         if not base_language in languages.keys():
             raise NotImplementedError
@@ -90,6 +153,9 @@ class CustomLanguage:
         self._your_code = your_code or languages[base_language]["your_code"]
         self._wrong_user = wrong_user or languages[base_language]["wrong_user"]
         self._too_short = too_short or languages[base_language]["too_short"]
+        self._max_reload_limit = (
+            max_reload_limit or languages[base_language]["maxreloadlimit"]
+        )
 
     def to_dict(self):
         return {
@@ -98,6 +164,7 @@ class CustomLanguage:
             "your_code": self.your_code,
             "wrong_user": self.wrong_user,
             "too_short": self.too_short,
+            "maxreloadlimit": self.max_reload_limit,
         }
 
     @property
@@ -120,6 +187,10 @@ class CustomLanguage:
     def too_short(self) -> str:
         return self._too_short
 
+    @property
+    def max_reload_limit(self) -> str:
+        return self._max_reload_limit
+
     @text.setter
     def text(self, your_text: str):
         """
@@ -183,6 +254,18 @@ class CustomLanguage:
             raise ValueError("This Text cannot be empty!")
         self._too_short = your_text
 
+    @max_reload_limit.setter
+    def max_reload_limit(self, your_text: str):
+        """
+        The text that is displayed if the user presses reload but has no reloads left
+        Example: '❌ : You can not reload the CAPTCHA anymore!'
+        """
+        if not isinstance(your_text, str):
+            raise TypeError("Must be str")
+        elif your_text == "":
+            raise ValueError("This Text cannot be empty!")
+        self._max_reload_limit = your_text
+
 
 class CaptchaOptions:
     def __init__(
@@ -197,6 +280,8 @@ class CaptchaOptions:
         add_noise: bool = True,
         only_digits: bool = False,
         custom_language: Optional[CustomLanguage] = None,
+        image_format: str = "JPEG",
+        image_quality: int = 85,
     ) -> None:
         """
         Use this class to create a captcha options profile.
@@ -212,6 +297,8 @@ class CaptchaOptions:
         :param add_noise: Add noise to the image
         :param only_digits: Use only digits instead of hexdigits.
         :param custom_language: A custom language to use (overrides `language`)
+        :param image_format: The format the image is encoded to: `"JPEG"`, `"PNG"` or `"WEBP"`
+        :param image_quality: The quality of JPEG and WEBP images (min: 1, max: 95)
 
         NOTE: If `generator` is not set to `"default"`, some options will be ignored/overwritten
         """
@@ -223,6 +310,10 @@ class CaptchaOptions:
             raise ValueError("code_lenght must be between 4 and 12")
         if max_attempts < 1:
             raise ValueError("max_attempts must be at least 1")
+        if not image_format.upper() in IMAGE_FORMATS:
+            raise ValueError("image_format must be JPEG, PNG or WEBP")
+        if not 1 <= image_quality <= 95:
+            raise ValueError("image_quality must be between 1 and 95")
 
         # no need to validate generator because EnumMeta will raise "ValueError: unknown is not a valid Generator"
         self._generator: str = Generator(generator.lower()).name
@@ -234,8 +325,37 @@ class CaptchaOptions:
         self._max_incorrect_to_auto_reload: int = max_incorrect_to_auto_reload
         self._add_noise: bool = add_noise
         self._only_digits: bool = only_digits
+        self._image_format: str = image_format.upper()
+        self._image_quality: int = image_quality
         self.custom_language: CustomLanguage = custom_language
 
+    # the fields saved with a captcha, in the order of its record
+    _RECORD_FIELDS = (
+        "_generator",
+        "_language",
+        "_timeout",
+        "_code_length",
+        "_max_user_reloads",
+        "_max_attempts",
+        "_max_incorrect_to_auto_reload",
+        "_add_noise",
+        "_only_digits",
+        "_image_format",
+        "_image_quality",
+    )
+
+    def _to_record(self) -> List:
+        return [getattr(self, name) for name in self._RECORD_FIELDS]
+
+    @classmethod
+    def _from_record(cls, values: List) -> "CaptchaOptions":
+        # the values were validated when the options were created
+        options = cls.__new__(cls)
+        for name, value in zip(cls._RECORD_FIELDS, values):
+            setattr(options, name, value)
+        options._custom_language = None
+        return options
+
     @property
     def generator(self) -> str:
         return self._generator
@@ -284,6 +404,14 @@ class CaptchaOptions:
             return True
         return self._only_digits
 
+    @property
+    def image_format(self) -> str:
+        return self._image_format
+
+    @property
+    def image_quality(self) -> int:
+        return self._image_quality
+
     @generator.setter
     def generator(self, value: str):
         """
@@ -376,6 +504,31 @@ class CaptchaOptions:
         """
         self._only_digits = bool(value)
 
+    @image_format.setter
+    def image_format(self, value: str):
+        """
+        The format the captcha image is encoded to: "JPEG", "PNG" or "WEBP"
+        Default: "JPEG"
+        NOTE: keyzend images are sent as they are downloaded
+        """
+        if not isinstance(value, str):
+            raise TypeError("Must be str")
+        elif not value.upper() in IMAGE_FORMATS:
+            raise ValueError("Must be JPEG, PNG or WEBP")
+        self._image_format = value.upper()
+
+    @image_quality.setter
+    def image_quality(self, value: int):
+        """
+        The quality of JPEG and WEBP images (min: 1, max: 95)
+        Default: 85
+        """
+        if not isinstance(value, int):
+            raise TypeError("Must be int")
+        elif not 1 <= value <= 95:
+            raise ValueError("Must be between 1 and 95")
+        self._image_quality = value
+
     @custom_language.setter
     def custom_language(self, value: CustomLanguage):
         """
@@ -391,16 +544,138 @@ class CaptchaOptions:
             languages["custom"] = value.to_dict()
 
 
+# the fields of a `types.Chat`, the ones a `_ChatRef` does not keep are None
+_CHAT_FIELDS = frozenset(
+    name
+    for name, parameter in inspect.signature(types.Chat.__init__).parameters.items()
+    if name != "self" and parameter.kind is not parameter.VAR_KEYWORD
+)
+
+
+class _ChatRef:
+    __slots__ = ("id", "type", "title", "username")
+
+    def __init__(
+        self,
+        id: int,
+        type: str,
+        title: Optional[str] = None,
+        username: Optional[str] = None,
+    ) -> None:
+        """
+        The fields of a `types.Chat` that a captcha keeps and saves.
+        Its other fields are None, like in a chat that does not have them.
+        """
+        self.id = id
+        self.type = type
+        self.title = title
+        self.username = username
+
+    def __getattr__(self, name: str) -> Any:
+        # only called for the attributes that are not kept
+        if name in _CHAT_FIELDS:
+            return None
+        raise AttributeError(
+            f"'{type(self).__name__}' object has no attribute '{name}'"
+        )
+
+
 class Captcha(types.JsonDeserializable, types.JsonSerializable):
+    # a captcha is kept until it is solved or timed out, possibly thousands of them.
+    # The bases have no slots, so attributes that your handlers set still go into a
+    # `__dict__`, which is only created when they do.
+    __slots__ = (
+        "_manager",
+        "solved",
+        "chat",
+        "user",
+        "_user_link",
+        "_custom_options",
+        "options",
+        "_timeout_handle",
+        "_edit_handle",
+        "_edited_at",
+        "_captcha_id",
+        "previous_tries",
+        "correct_code",
+        "users_code",
+        "message_id",
+        "date",
+        "user_reloads_left",
+        "image",
+        "reply_markup",
+        "_record_head",
+        "_handle",
+    )
+
     @classmethod
-    def de_json(cls, json_str):
+    def from_record(cls, data: str, manager: "CaptchaManager" = None):
+        """
+        Loads a captcha saved by `to_record()` (or `to_json()` of older versions).
+        The state is set directly, the options and the captcha are not validated again.
+        """
+        if not data:
+            return None
+        if data[0] == "{":
+            return cls.de_json(data, manager)
+        record = _loads(data)
+        if record[0] != RECORD_VERSION:
+            raise ValueError(f"Unknown captcha record version {record[0]}")
+        (
+            _,
+            captcha_id,
+            chat,
+            user,
+            users_code,
+            correct_code,
+            message_id,
+            date,
+            previous_tries,
+            user_reloads_left,
+            solved,
+            options,
+        ) = record
+        manager = manager or CaptchaManager._instance
+        captcha = cls.__new__(cls)
+        captcha._manager = manager
+        captcha.solved = solved
+        captcha.chat = _ChatRef(*chat)
+        captcha.user = types.User(**user)
+        captcha._user_link = None
+        captcha._custom_options = options is not None
+        if options is None:
+            captcha.options = manager.default_options
+        elif isinstance(options, str):
+            captcha.options = manager._options_profile(options)
+        else:
+            captcha.options = CaptchaOptions._from_record(options)
+        captcha._timeout_handle = None
+        captcha._edit_handle = None
+        captcha._edited_at = 0.0
+        captcha._captcha_id = captcha_id
+        captcha.previous_tries = previous_tries
+        captcha.correct_code = correct_code
+        captcha.users_code = users_code
+        captcha.message_id = message_id
+        captcha.date = date
+        captcha.user_reloads_left = user_reloads_left
+        captcha.image = None
+        captcha.reply_markup = None
+        captcha._record_head = None
+        captcha._handle = None
+        return captcha
+
+    @classmethod
+    def de_json(cls, json_str, manager: "CaptchaManager" = None):
         if not json_str:
             return None
+        if json_str[0] == "[":
+            return cls.from_record(json_str, manager)
         obj = json.loads(json_str)
         if not "options" in obj.keys():
             pass  # TODO: Expire
         if not obj["options"]:
-            obj["options"] = CaptchaManager._instance.default_options
+            obj["options"] = (manager or CaptchaManager._instance).default_options
         else:
             opt = CaptchaOptions()
             opt._generator = obj["options"]["generator"]
@@ -414,10 +689,12 @@ class Captcha(types.JsonDeserializable, types.JsonSerializable):
             ]
             opt._add_noise = obj["options"]["add_noise"]
             opt._only_digits = obj["options"]["only_digits"]
+            opt._image_format = obj["options"].get("image_format", "JPEG")
+            opt._image_quality = obj["options"].get("image_quality", 85)
             obj["options"] = opt
-        obj["chat"] = types.Chat(**obj["chat"])
+        obj["chat"] = _ChatRef(**obj["chat"])
         obj["user"] = types.User(**obj["user"])
-        return cls(bot=None, **obj)
+        return cls(bot=None, manager=manager, **obj)
 
     def __init__(
         self,
@@ -425,15 +702,35 @@ class Captcha(types.JsonDeserializable, types.JsonSerializable):
         chat: types.Chat,
         user: types.User,
         options: CaptchaOptions,
+        manager: "CaptchaManager" = None,
         **kwargs,
     ) -> None:
+        # captchas created without a manager belong to the manager created last
+        self._manager = manager or CaptchaManager._instance
         self.solved = False
-        self.chat = chat
+        self.chat = (
+            chat
+            if isinstance(chat, _ChatRef)
+            else _ChatRef(
+                chat.id,
+                chat.type,
+                getattr(chat, "title", None),
+                getattr(chat, "username", None),
+            )
+        )
         self.user = user
+        # the escaped link to the user in the caption, built on first use
+        self._user_link: Optional[str] = None
         self._custom_options = options is not None
-        self.options = options or CaptchaManager._instance.default_options
+        self.options = options or self._manager.default_options
 
-        self._timeout_thread = None
+        self._timeout_handle: Optional[TimeoutHandle] = None
+        # pending trailing caption edit and when the caption was edited last (time.monotonic)
+        self._edit_handle: Optional[TimeoutHandle] = None
+        self._edited_at = 0.0
+        # the serialized fields of the record that do not change, built on the first save
+        self._record_head: Optional[str] = None
+        self._handle: Optional[str] = None
 
         if not bot:
             # Loaded from file
@@ -445,38 +742,64 @@ class Captcha(types.JsonDeserializable, types.JsonSerializable):
             self.message_id = kwargs["message_id"]
             self.date = kwargs["date"]
             self.user_reloads_left = kwargs["user_reloads_left"]
+            self.solved = kwargs.get("solved", False)
 
             self.image = None
             self.reply_markup = None
 
         else:
-            self._captcha_id = f"{CaptchaManager._bot_id}={chat.id}={user.id}"
+            self._captcha_id = f"{self._manager._bot_id}={chat.id}={user.id}"
 
             self.previous_tries = 0
             self.users_code = ""
             self.user_reloads_left = self.options.max_user_reloads
 
-            self.correct_code, self.image = _random_codeimage(self.options)
-
-            text = (
-                languages[self.options.language]["text"].replace(
-                    "#USER", _user_link(self.user)
-                )
-                + "\n"
-            )
-            text += languages[self.options.language]["your_code"]
+            manager = self._manager
+            self.correct_code, self.image, entry = manager._new_photo(self.options)
 
-            m = self.message_id = bot.send_photo(
+            self.reply_markup = _code_input_markup(self)
+            m = manager._api(
+                bot,
+                "send_photo",
                 chat_id=self.chat.id,
                 photo=self.image,
-                caption=text,
-                reply_markup=_code_input_markup(self),
+                caption=self._caption(),
+                reply_markup=self.reply_markup,
                 parse_mode="HTML",
             )
+            manager._photo_sent(entry, m)
+            # Telegram has the image now
+            self.image = None
             self.message_id = m.message_id
             self.date = m.date
             self._save_file()
 
+    @property
+    def deadline(self) -> float:
+        """
+        The timestamp when the captcha times out.
+        """
+        return self.date + self.options.timeout
+
+    @property
+    def code_length(self) -> int:
+        """
+        How many chars the user has to enter.
+        """
+        if self.options.generator == "math":
+            # the length of the result differs between equations
+            return len(self.correct_code)
+        return self.options.code_length
+
+    @property
+    def handle(self) -> str:
+        """
+        The short id of the captcha in its chat, used in the callback data of its buttons.
+        """
+        if self._handle is None:
+            self._handle = _base36(self.user.id)
+        return self._handle
+
     @property
     def incorrect_digits(self) -> int:
         """
@@ -489,7 +812,7 @@ class Captcha(types.JsonDeserializable, types.JsonSerializable):
         """
         How many chars do not match?
         """
-        users_code = self.users_code.ljust(self.options.code_length, " ")
+        users_code = self.users_code.ljust(self.code_length, " ")
         count = 0
         for i, d in enumerate(users_code):
             if self.correct_code[i] != d:
@@ -517,6 +840,8 @@ class Captcha(types.JsonDeserializable, types.JsonSerializable):
                 "max_incorrect_to_auto_reload": self.options.max_incorrect_to_auto_reload,
                 "add_noise": self.options.add_noise,
                 "only_digits": self.options.only_digits,
+                "image_format": self.options.image_format,
+                "image_quality": self.options.image_quality,
             }
         )
 
@@ -531,101 +856,112 @@ class Captcha(types.JsonDeserializable, types.JsonSerializable):
             "previous_tries": self.previous_tries,
             "user_reloads_left": self.user_reloads_left,
             "options": opt,
+            "solved": self.solved,
         }
         return json.dumps(json_dict)
 
+    def to_record(self) -> str:
+        """
+        The compact record the manager saves: a versioned JSON array of the state.
+        Options profiles of the manager are saved by their name, not by their values.
+        """
+        if self._record_head is None:
+            chat = [self.chat.id, self.chat.type, self.chat.title, self.chat.username]
+            user = {k: v for k, v in self.user.to_dict().items() if v is not None}
+            head = [RECORD_VERSION, self._captcha_id, chat, user]
+            self._record_head = _dumps(head)[:-1]
+        options = None
+        if self._custom_options:
+            options = self._manager._options_reference(self.options)
+        state = [
+            self.users_code,
+            self.correct_code,
+            self.message_id,
+            self.date,
+            self.previous_tries,
+            self.user_reloads_left,
+            self.solved,
+            options,
+        ]
+        return self._record_head + "," + _dumps(state)[1:]
+
     def _continue_timeout(self):
         now = datetime.now().timestamp()
         exec_at = self.date + self.options.timeout
-        if now >= exec_at:
-            self._timeout_thread = Timer(
-                interval=1, function=CaptchaManager._handlers["on_timeout"], args=[self]
-            )
-        else:
-            self._timeout_thread = Timer(
-                interval=exec_at - now,
-                function=CaptchaManager._handlers["on_timeout"],
-                args=[self],
-            )
-        self._timeout_thread.start()
+        self._manager._schedule_timeout(self, max(exec_at - now, 1))
 
     def _reset(self, bot: TeleBot) -> None:
-        new_code, new_image = _random_codeimage(self.options)
-        self.date = datetime.now().timestamp()
-        self.image = new_image
-        self.correct_code = new_code
-        self.users_code = ""
-        text = (
-            languages[self.options.language]["text"].replace(
-                "#USER", _user_link(self.user)
-            )
-            + "\n"
-        )
-        if self.previous_tries > 0:
-            text += languages[self.options.language]["try_again"] + "\n"
-        text += languages[self.options.language]["your_code"]
-
-        self.reply_markup = _code_input_markup(self)
-
-        bot.edit_message_media(
-            types.InputMediaPhoto(self.image, text, "HTML"),
+        manager = self._manager
+        code, photo, entry = manager._new_photo(self.options, self.correct_code)
+        self._set_code(code, photo)
+
+        m = manager._api(
+            bot,
+            "edit_message_media",
+            types.InputMediaPhoto(self.image, self._caption(), "HTML"),
             self.chat.id,
             self.message_id,
             reply_markup=self.reply_markup,
         )
+        manager._photo_sent(entry, m)
+        self.image = None
 
         self._save_file()
 
-    def _save_file(self):
-        if not os.path.exists(str(_captcha_saves)):
-            os.mkdir(_captcha_saves)
-        filename = self._captcha_id + ".json"
-        filepath = _captcha_saves / filename
-        with open(filepath, "w+", encoding="utf8") as f:
-            f.write(self.to_json())
+    def _set_code(self, code: str, image: Any) -> None:
+        # a reset captcha can be solved again
+        self.solved = False
+        self.date = datetime.now().timestamp()
+        self.image = image
+        self.correct_code = code
+        self.users_code = ""
+        self.reply_markup = _code_input_markup(self)
 
-    def _delete_file(self):
-        filename = self._captcha_id + ".json"
-        filepath = _captcha_saves / filename
-        if filepath.exists():
-            filepath.unlink()
+    def _caption(self, show_code: bool = False) -> str:
+        text, first_try, next_tries = _caption_template(
+            languages[self.options.language]
+        )
+        if self._user_link is None:
+            self._user_link = _user_link(self.user)
+        caption = self._user_link.join(text) + (
+            next_tries if self.previous_tries > 0 else first_try
+        )
+        if show_code:
+            return f"{caption}<pre>{self.users_code}</pre>"
+        return caption
 
-    def _update(self, bot: TeleBot, callback: types.CallbackQuery):
-        btn = callback.data.split("=")[2]
-        if btn == "BACK":
-            self.users_code = self.users_code[:-1]
-        else:
-            self.users_code = (self.users_code + btn)[: self.options.code_length]
+    def _save_file(self, force: bool = True):
+        self._manager._save(self, force)
 
-        text = (
-            languages[self.options.language]["text"].replace(
-                "#USER", _user_link(self.user)
-            )
-            + "\n"
-        )
-        if self.previous_tries > 0:
-            text += languages[self.options.language]["try_again"] + "\n"
-        text += (
-            languages[self.options.language]["your_code"]
-            + f"<pre>{self.users_code}</pre>"
+    def _delete_file(self):
+        self._manager._delete(self)
+
+    def _update(self, bot: TeleBot, callback: types.CallbackQuery, btn: str):
+        changed = self._input(btn)
+        if changed:
+            # keystrokes are coalesced if write-behind is enabled
+            self._save_file(force=False)
+        # captchas loaded from a save do not know their keyboard, the message does
+        self._manager._edit_caption(
+            bot, self, self.reply_markup or callback.message.reply_markup, changed
         )
 
-        try:
-            bot.edit_message_caption(
-                caption=text,
-                chat_id=callback.message.chat.id,
-                message_id=callback.message.message_id,
-                reply_markup=callback.message.reply_markup,
-                parse_mode="HTML",
-            )
-            self._save_file()
-        except:
-            pass
+    def _input(self, btn: str) -> bool:
+        """
+        Applies a button press to `users_code`. Returns False if the code did not change.
+        """
+        if btn == "BACK":
+            users_code = self.users_code[:-1]
+        else:
+            users_code = (self.users_code + btn)[: self.code_length]
+        if users_code == self.users_code:
+            return False
+        self.users_code = users_code
+        return True
 
 
 class CaptchaManager:
-    _handlers = {"on_correct": None, "on_not_correct": None, "on_timeout": None}
-    _bot_id = None
+    # the manager created last, for captchas that are created without one
     _instance = None
 
     def __init__(
@@ -636,6 +972,26 @@ class CaptchaManager:
         fonts: List = None,
         code_length: int = 8,
         default_options: CaptchaOptions = None,
+        pool_size: int = 0,
+        pool_low_water: int = None,
+        pool_workers: int = 1,
+        render_processes: int = 0,
+        timeout_workers: int = 4,
+        storage: CaptchaStorage = None,
+        write_behind_interval: float = 0,
+        write_behind_batch: int = 100,
+        recovery_grace: float = MAX_TIMEOUT,
+        library_size: int = 0,
+        library_max_uses: int = 10,
+        library_ttl: float = 3600,
+        edit_interval: float = 0,
+        keyzend: KeyzendClient = None,
+        share_with: "CaptchaManager" = None,
+        claim_interval: float = 1.0,
+        options_profiles: Dict[str, CaptchaOptions] = None,
+        registry_size: int = 10000,
+        registry_ttl: float = 300,
+        sweep_interval: float = 60,
     ) -> None:
         """
         The Captcha Manager
@@ -652,11 +1008,59 @@ class CaptchaManager:
         :param code_length: the lenght of the code. must be between 4-12 chars
         :param default_options: options profile to use if not defined in `send_random_captcha`.
             Overrides all other settings (except fonts)!
+        :param pool_size: how many pre-rendered captchas to keep ready per options profile.
+            0 disables the pool and renders every captcha when it is sent.
+        :param pool_low_water: refill a profile in the background if it has this many captchas or less left.
+            Default: pool_size // 2
+        :param pool_workers: how many background threads render captchas for the pool
+        :param render_processes: if > 0, render the captcha images in this many worker processes,
+            so a burst of joins uses more than one core. 0 renders in the calling thread.
+        :param timeout_workers: how many `on_timeout` handlers can run at the same time.
+            All timeouts are scheduled by a single thread, not one thread per captcha.
+        :param storage: where to persist pending captchas, so they survive a restart.
+            `DirectoryStorage` (default), `SQLiteStorage`, `MemoryStorage` or your own `CaptchaStorage`.
+            With a shared storage (`RedisStorage`) several processes of the bot handle the same captchas.
+        :param write_behind_interval: if > 0, the users input is not saved on every button press.
+            Changed captchas are saved in batches every `write_behind_interval` seconds instead.
+            New, reset and deleted captchas are still saved immediately.
+        :param write_behind_batch: save the changed captchas as soon as this many are waiting
+        :param recovery_grace: saved captchas that timed out more than `recovery_grace` seconds
+            before the start are deleted without calling `on_captcha_timeout` (logged as a warning).
+            `float("inf")` keeps them all and runs their timeouts.
+            The others are loaded when they are needed, not at startup.
+        :param library_size: if > 0, keep this many captchas per options profile that are uploaded
+            to Telegram only once and then sent by their `file_id`. 0 uploads every captcha image.
+        :param library_max_uses: send a captcha of the library to this many users before it is replaced
+        :param library_ttl: replace a captcha of the library after this many seconds
+        :param edit_interval: if > 0, the caption of a captcha is edited at most once per `edit_interval`
+            seconds while the user types. The input is applied at once and the last edit always
+            shows the latest code. 0 edits the caption on every button press.
+        :param keyzend: the client of the `keyzend` generator, to set its timeouts, prefetching and
+            circuit breaker. Default: `KeyzendClient()`, created when the first keyzend captcha is rendered.
+            It is closed with the manager (with the last one if it is shared with `share_with`).
+        :param share_with: another manager, e.g. of another bot in the same process, whose captcha pool,
+            render processes and timeout threads this manager uses too. `pool_size`, `pool_low_water`,
+            `pool_workers`, `render_processes` and `timeout_workers` are ignored then.
+            They are stopped when the last manager that uses them is closed.
+            The captchas are rendered with the `fonts` and `keyzend` client of the other manager,
+            passing different ones raises a `ValueError`.
+        :param claim_interval: with a shared storage, how often (in seconds) this process looks for
+            timed out captchas. Exactly one process fires the `on_timeout` of a captcha.
+        :param options_profiles: your options profiles by name. A captcha sent with one of them
+            is saved with the name of the profile instead of all its options.
+            Keep the names when you change a profile, captchas saved before use the changed one.
+        :param registry_size: the most captchas to keep in memory. Finished captchas are dropped
+            first, then the oldest pending ones, which are loaded from the storage again if needed.
+            0: no limit
+        :param registry_ttl: captchas that are solved or timed out but not deleted by your handler
+            are dropped from memory and the storage after this many seconds
+        :param sweep_interval: how often (in seconds) finished captchas are dropped and saved
+            captchas that timed out more than `recovery_grace` seconds ago are deleted. 0: never
         """
-        if self.__class__._instance:
-            raise ValueError("Only one instance of CaptchaManager can exist.")
-        self.__class__._instance = self
-        self.__class__._bot_id = bot_id
+        CaptchaManager._instance = self
+        self._bot_id = bot_id
+        self._handlers = {"on_correct": None, "on_not_correct": None, "on_timeout": None}
+        self._closed = False
 
         if not default_options:
             self.default_options: CaptchaOptions = CaptchaOptions()
@@ -665,24 +1069,230 @@ class CaptchaManager:
             self.default_options.code_length = code_length
         else:
             self.default_options = default_options
+        self.options_profiles: Dict[str, CaptchaOptions] = dict(options_profiles or {})
+        self._profile_names = {id(o): name for name, o in self.options_profiles.items()}
+
+        if share_with is not None:
+            self._shared = share_with._shared
+            if (fonts and list(fonts) != self._shared.fonts) or (
+                keyzend is not None and keyzend is not self._shared.keyzend
+            ):
+                raise ValueError(
+                    "share_with renders with the fonts and keyzend client of the "
+                    "other manager"
+                )
+        else:
+            self._shared = _Shared(
+                pool_size,
+                pool_low_water,
+                pool_workers,
+                render_processes,
+                timeout_workers,
+                list(fonts) if fonts else _default_fonts(),
+                keyzend,
+            )
+        preload_fonts(self._shared.fonts)
+        self._shared.acquire()
+        self._scheduler = self._shared.scheduler
+        self._render_threads = self._shared.render_threads
+        self.pool: Optional[CaptchaPool] = self._shared.pool
+
+        self.metrics = Metrics()
+        # the render times of all managers that share the renderers
+        self.metrics.add(self._shared.render_seconds)
+        self._api_seconds = self.metrics.add(
+            Histogram(
+                "captcha_telegram_request_seconds",
+                "Latency of the Bot API requests by method",
+                ("method",),
+            )
+        )
+        self._api_failures = self.metrics.add(
+            Counter(
+                "captcha_telegram_request_failures_total",
+                "Failed Bot API requests by method",
+                ("method",),
+            )
+        )
+        self._storage_seconds = self.metrics.add(
+            Histogram(
+                "captcha_storage_write_seconds",
+                "Time to write captchas to the storage by operation",
+                ("operation",),
+                buckets=_STORAGE_BUCKETS,
+            )
+        )
+        self._results = self.metrics.add(
+            Counter(
+                "captcha_results_total",
+                "Finished captchas by result: solved, failed or timeout",
+                ("result",),
+            )
+        )
+        self._evictions = self.metrics.add(
+            Counter(
+                "captcha_evictions_total",
+                "Captchas dropped from memory by reason: ttl, finished or pending",
+                ("reason",),
+            )
+        )
+        self._purged = self.metrics.add(
+            Counter(
+                "captcha_purged_total",
+                "Saved captchas deleted by the sweep because they timed out long ago",
+            )
+        )
+        self._stale_callbacks = self.metrics.add(
+            Counter(
+                "captcha_stale_callbacks_total",
+                "Button presses on captchas that were deleted or are unknown",
+            )
+        )
+        self.metrics.add(
+            Gauge(
+                "captcha_pending",
+                "Captchas of this process that are not finished nor deleted",
+                lambda: (
+                    len(self.captchas) - self.captchas.finished + len(self._unloaded)
+                ),
+            )
+        )
+        self.metrics.add(
+            Gauge(
+                "captcha_timers",
+                "Scheduled captcha timeouts of this process",
+                lambda: self.pending_timeouts,
+            )
+        )
+
+        self.library: Optional[CaptchaLibrary] = None
+        if library_size > 0:
+            self.library = CaptchaLibrary(
+                self.pool.get if self.pool else self._render,
+                size=library_size,
+                max_uses=library_max_uses,
+                ttl=library_ttl,
+            )
 
-        global _fonts
-        _fonts = fonts or _fonts
-        if not _fonts:
-            for f in os.listdir(_fonts_path):
-                if f.endswith(".ttf") and not f.startswith("."):
-                    _fonts.append(str(_fonts_path / f))
-
-        self.captchas: Dict[str, Captcha] = {}
-        if os.path.exists(_captcha_saves):
-            saved_captchas = os.listdir(_captcha_saves)
-            for f in saved_captchas:
-                if f.startswith(f"{self._bot_id}=") and f.endswith(".json"):
-                    filepath = _captcha_saves / f
-                    with filepath.open("r") as f:
-                        json_str = f.read()
-                        captcha = Captcha.de_json(json_str)
-                        self.captchas[captcha._captcha_id] = captcha
+        self.storage: CaptchaStorage = storage or DirectoryStorage(_captcha_saves)
+        if self.storage.shared and write_behind_interval > 0:
+            # the other processes must see every button press at once
+            raise ValueError(
+                "write_behind_interval can not be used with a shared storage"
+            )
+        self._write_behind: Optional[WriteBehind] = None
+        if write_behind_interval > 0:
+            self._write_behind = WriteBehind(
+                self.storage,
+                write_behind_interval,
+                write_behind_batch,
+                on_flush=lambda seconds: self._storage_seconds.observe(
+                    seconds, "flush"
+                ),
+            )
+            atexit.register(self._write_behind.close)
+
+        self.edit_interval = edit_interval
+        self._edit_lock = Lock()
+        self._edit_counts = {"edits": 0, "coalesced": 0, "skipped": 0, "failed": 0}
+
+        self.captchas: CaptchaRegistry = CaptchaRegistry(
+            registry_size,
+            registry_ttl,
+            on_evict=self._evicted,
+            is_live=self._timeout_pending,
+        )
+        # saved captchas are loaded on first access: captcha_id -> [deadline, timeout handle]
+        self._unloaded: Dict[str, List] = {}
+        self._load_lock = Lock()
+        self.recovery_grace = recovery_grace
+        purged = self.storage.purge(
+            self._bot_id, datetime.now().timestamp() - recovery_grace
+        )
+        if purged:
+            # their timeout handlers do not run, e.g. restricted users stay restricted
+            logger.warning(
+                "Deleted %d saved captchas that timed out more than %s seconds ago",
+                purged,
+                recovery_grace,
+            )
+            self._purged.inc(amount=purged)
+        self.sweep_interval = sweep_interval
+        self._sweep_handle: Optional[TimeoutHandle] = None
+        if sweep_interval > 0:
+            self._sweep_handle = self._scheduler.schedule(sweep_interval, self._sweep)
+        self.claim_interval = claim_interval
+        self._claim_handle: Optional[TimeoutHandle] = None
+        if not self.storage.shared:
+            # a shared storage is read on every access and its timeouts are claimed
+            for captcha_id, deadline in self.storage.index(self._bot_id):
+                self._unloaded[captcha_id] = [deadline, None]
+
+    def warm_up(self, *options: CaptchaOptions, timeout: float = None) -> None:
+        """
+        Fills the captcha pool for the given options profiles (default: `default_options`).
+        Call it once at startup, before `bot.polling()`, so the first captchas do not wait for rendering.
+        Does nothing if the pool is disabled (`pool_size=0`).
+        :param options: the options profiles you are going to use
+        :param timeout: stop waiting after this many seconds
+        """
+        if self.pool:
+            self.pool.warm_up(*(options or [self.default_options]), timeout=timeout)
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """
+        Hits, misses and refill latency of the captcha pool. Empty if the pool is disabled.
+        """
+        return self.pool.stats() if self.pool else {}
+
+    def library_stats(self) -> Dict[str, int]:
+        """
+        Uploads, reuses and replaced captchas of the file_id library. Empty if the library is disabled.
+        """
+        return self.library.stats() if self.library else {}
+
+    def edit_stats(self) -> Dict[str, int]:
+        """
+        Caption edits while users type: sent `edits`, edits `coalesced` into a later one,
+        `skipped` button presses that did not change the code and `failed` edits.
+        """
+        with self._edit_lock:
+            return dict(self._edit_counts)
+
+    def close(self) -> None:
+        """
+        Saves all changed captchas and stops the background threads of the manager.
+        Call it when your bot shuts down.
+        Threads and processes shared with other managers run until the last of them is closed.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._claim_handle:
+            self._claim_handle.cancel()
+        if self._sweep_handle:
+            self._sweep_handle.cancel()
+        for captcha in list(self.captchas.values()):
+            self._cancel_timeout(captcha)
+        with self._load_lock:
+            for _, timeout_handle in self._unloaded.values():
+                if timeout_handle:
+                    self._cancel_handle(timeout_handle)
+        if self._write_behind:
+            # the hook would keep the manager alive until the process exits
+            atexit.unregister(self._write_behind.close)
+            self._write_behind.close()
+        self.storage.close()
+        self._shared.release()
+
+    @property
+    def pending_timeouts(self) -> int:
+        """
+        The number of captchas of this manager with a running timeout.
+        """
+        handles = [captcha._timeout_handle for captcha in list(self.captchas.values())]
+        handles += [timeout_handle for _, timeout_handle in list(self._unloaded.values())]
+        return sum(1 for handle in handles if handle and handle.pending)
 
     def send_new_captcha(
         self,
@@ -699,33 +1309,71 @@ class CaptchaManager:
         :param options: options profile to use
         :return: the generated Captcha object
         """
+        self._check_handlers()
 
-        if not self._handlers["on_correct"]:
-            raise MissingHandler("No event handler declared for `on_correct`.")
-        if not self._handlers["on_not_correct"]:
-            raise MissingHandler("No event handler declared for `on_not_correct`.")
-        if not self._handlers["on_timeout"]:
-            raise MissingHandler("No event handler declared for `on_timeout`.")
-
-        captcha = Captcha(bot, chat, user, options)
+        # a saved captcha of the same user must be loaded before it is overwritten
+        self._get_captcha(f"{self._bot_id}={chat.id}={user.id}")
+        photo = self._new_photo(options or self.default_options)
+        captcha = self._send_captcha(bot, chat, user, options, *photo)
 
-        if captcha._captcha_id in self.captchas.keys():
-            old_captcha: Captcha = self.captchas.pop(captcha._captcha_id)
-            if old_captcha._timeout_thread:
-                old_captcha._timeout_thread.cancel()
+        old_captcha = self.captchas.pop(captcha._captcha_id, None)
+        if old_captcha:
+            self._cancel_timeout(old_captcha)
             self.delete_captcha(bot, old_captcha)
 
-        captcha._timeout_thread = Timer(
-            interval=captcha.options.timeout,
-            function=self._handlers["on_timeout"],
-            args=[captcha],
-        )
-        captcha._timeout_thread.start()
-        captcha._save_file()
+        self._schedule_timeout(captcha, captcha.options.timeout)
+        self._save(captcha)
 
         self.captchas[captcha._captcha_id] = captcha
         return captcha
 
+    def send_new_captchas(
+        self,
+        bot: TeleBot,
+        chat: types.Chat,
+        users: List[types.User],
+        options: CaptchaOptions = None,
+    ) -> Tuple[List[Captcha], Dict[int, Exception]]:
+        """
+        sends a captcha to every user of a mass join, e.g. `message.new_chat_members`.
+        The images are rendered in parallel, the new captchas are saved in one batch
+        and their timeouts are scheduled at once.
+        A user whose captcha could not be rendered or sent does not stop the others.
+        A user who is in `users` more than once gets a single captcha.
+        :param bot: your TeleBot instance
+        :param chat: the chat (chat not chat_id)
+        :param users: the users who must solve a captcha (users not user_ids)
+        :param options: options profile to use
+        :return: the generated Captcha objects and the exception per user_id of the users without one
+        """
+        self._check_handlers()
+
+        users = _unique_users(users)
+        photos = self._new_photos(options or self.default_options, len(users))
+        captchas: List[Captcha] = []
+        errors: Dict[int, Exception] = {}
+        for user, photo in zip(users, photos):
+            try:
+                if isinstance(photo, Exception):
+                    raise photo
+                # a saved captcha of the same user must be loaded before it is overwritten
+                self._get_captcha(f"{self._bot_id}={chat.id}={user.id}")
+                captchas.append(self._send_captcha(bot, chat, user, options, *photo))
+            except Exception as e:
+                errors[user.id] = e
+
+        for captcha in captchas:
+            old_captcha = self.captchas.pop(captcha._captcha_id, None)
+            if old_captcha:
+                self._cancel_timeout(old_captcha)
+                self.delete_captcha(bot, old_captcha)
+
+        self._schedule_timeouts(captchas)
+        for captcha in captchas:
+            self.captchas[captcha._captcha_id] = captcha
+        self._save_many(captchas)
+        return captchas, errors
+
     def send_random_captcha(
         self,
         bot: TeleBot,
@@ -814,45 +1462,85 @@ class CaptchaManager:
         :param bot: your TeleBot instance
         :param callback: the CallbackQuery
         """
-        if not callback.data.startswith("?cap="):
+        parsed = self._parse_callback(callback)
+        if parsed is None:
             return
-
-        user_id, btn = int(callback.data.split("=")[1]), callback.data.split("=")[2]
-        captcha_id = f"{self.__class__._bot_id}={callback.message.chat.id}={user_id}"
-        captcha: Captcha = self.captchas[captcha_id]
-
-        if captcha.user.id != callback.from_user.id:
-            bot.answer_callback_query(
-                callback.id, text=languages[captcha.options.language]["wrong_user"]
-            )
+        captcha_id, captcha, btn = parsed
+        if captcha_id is None:
+            self._stale_callbacks.inc()
+            bot.answer_callback_query(callback.id)
             return
-        if btn == "OK":
-            if len(captcha.users_code) < captcha.options.code_length:
+
+        # other processes of the bot must not change the captcha in the meantime
+        with self.storage.lock(captcha_id):
+            if captcha is None:
+                captcha = self._get_captcha(captcha_id)
+            if captcha is None:
+                # a button of a captcha that was deleted, answered to stop the spinner
+                self._stale_callbacks.inc()
+                bot.answer_callback_query(callback.id)
+                return
+
+            if captcha.user.id != callback.from_user.id:
                 bot.answer_callback_query(
-                    callback.id,
-                    text=languages[captcha.options.language]["too_short"],
-                    show_alert=True,
-                )
-            else:
-                user_id = int(callback.data.split("=")[1])
-                captcha_id = (
-                    f"{self.__class__._bot_id}={callback.message.chat.id}={user_id}"
+                    callback.id, text=languages[captcha.options.language]["wrong_user"]
                 )
-                if captcha_id in self.captchas:
-                    self._check_captcha(self.captchas[captcha_id], bot)
-        elif btn == "RELOAD":
-            if captcha.user_reloads_left > 0:
-                captcha.user_reloads_left -= 1
-                self.refresh_captcha(bot, captcha)
+                return
+            if btn == "OK":
+                if len(captcha.users_code) < captcha.code_length:
+                    bot.answer_callback_query(
+                        callback.id,
+                        text=languages[captcha.options.language]["too_short"],
+                        show_alert=True,
+                    )
+                else:
+                    self._check_captcha(captcha, bot)
+            elif btn == "RELOAD":
+                if captcha.user_reloads_left > 0:
+                    captcha.user_reloads_left -= 1
+                    self.refresh_captcha(bot, captcha)
+                else:
+                    bot.answer_callback_query(
+                        callback.id,
+                        text=languages[captcha.options.language]["maxreloadlimit"],
+                    )
+                    return
             else:
-                bot.answer_callback_query(
-                    callback.id, languages[captcha.language]["maxreloadlimit"]
-                )
+                captcha._update(bot, callback, btn)
 
-        else:
-            captcha._update(bot, callback)
+            bot.answer_callback_query(callback.id)
 
-        bot.answer_callback_query(callback.id)
+    def _parse_callback(
+        self, callback: types.CallbackQuery
+    ) -> Optional[Tuple[Optional[str], Optional[Captcha], str]]:
+        """
+        Parses the callback data of a captcha button.
+        :return: None if it is not from a captcha, else (captcha_id, captcha, button).
+            The captcha is None if it must be loaded, the captcha_id if the data is invalid.
+        """
+        data = callback.data
+        if data.startswith(_CALLBACK_PREFIX):
+            btn, handle = data[3:4], data[4:]
+            btn = _BUTTON_NAMES.get(btn, btn)
+            chat_id = callback.message.chat.id
+            if not self.storage.shared:
+                captcha = self.captchas.by_handle(chat_id, handle)
+                if captcha is not None:
+                    return captcha._captcha_id, captcha, btn
+            try:
+                user_id = int(handle, 36)
+            except ValueError:
+                return None, None, btn
+            return f"{self._bot_id}={chat_id}={user_id}", None, btn
+        if data.startswith("?cap="):
+            # the buttons of captchas sent by older versions
+            try:
+                _, user_id, btn = data.split("=", 2)
+                user_id = int(user_id)
+            except ValueError:
+                return None, None, data[5:]
+            return f"{self._bot_id}={callback.message.chat.id}={user_id}", None, btn
+        return None
 
     def reset_captcha(self, bot: TeleBot, captcha: Captcha) -> None:
         """
@@ -861,17 +1549,11 @@ class CaptchaManager:
         :param bot:
         :param captcha:
         """
-        if captcha._timeout_thread:
-            captcha._timeout_thread.cancel()
-            captcha._timeout_thread = None
+        self._cancel_timeout(captcha)
+        self._cancel_edit(captcha)
         captcha._reset(bot)
-        if captcha._timeout_thread is None:
-            captcha._timeout_thread = Timer(
-                interval=captcha.options.timeout,
-                function=self._handlers["on_timeout"],
-                args=[captcha],
-            )
-            captcha._timeout_thread.start()
+        self.captchas.unfinish(captcha)
+        self._schedule_timeout(captcha, captcha.options.timeout)
 
     def refresh_captcha(
         self,
@@ -890,10 +1572,10 @@ class CaptchaManager:
         self.reset_captcha(bot, captcha)
 
     def delete_captcha(self, bot: TeleBot, captcha: Captcha) -> None:
-        # self.captchas.pop(captcha._captcha_id)
+        self._cancel_edit(captcha)
         captcha._delete_file()
         try:
-            bot.delete_message(captcha.chat.id, captcha.message_id)
+            self._api(bot, "delete_message", captcha.chat.id, captcha.message_id)
         except:
             pass
         del captcha
@@ -918,7 +1600,7 @@ class CaptchaManager:
             rv = function(*args, **kwargs)
             return rv
 
-        self.__class__._handlers["on_correct"] = wrapper
+        self._handlers["on_correct"] = wrapper
         return wrapper
 
     def on_captcha_not_correct(self, function):
@@ -941,7 +1623,7 @@ class CaptchaManager:
             rv = function(*args, **kwargs)
             return rv
 
-        self.__class__._handlers["on_not_correct"] = wrapper
+        self._handlers["on_not_correct"] = wrapper
         return wrapper
 
     def on_captcha_timeout(self, function):
@@ -975,12 +1657,426 @@ class CaptchaManager:
             rv = function(*args, **kwargs)
             return rv
 
-        self.__class__._handlers["on_timeout"] = wrapper
+        self._handlers["on_timeout"] = wrapper
+        if self.storage.shared and self._claim_handle is None:
+            self._claim_handle = self._scheduler.schedule(0, self._claim_timeouts)
         for captcha in self.captchas.values():
             captcha._continue_timeout()
+        now = datetime.now().timestamp()
+        with self._load_lock:
+            for captcha_id, unloaded in self._unloaded.items():
+                if unloaded[1]:
+                    unloaded[1].cancel()
+                delay = max(unloaded[0] - now, 1) if unloaded[0] is not None else 1
+                unloaded[1] = self._scheduler.schedule(
+                    delay, self._recovered_timeout, captcha_id
+                )
         return wrapper
 
+    def _check_handlers(self) -> None:
+        if not self._handlers["on_correct"]:
+            raise MissingHandler("No event handler declared for `on_correct`.")
+        if not self._handlers["on_not_correct"]:
+            raise MissingHandler("No event handler declared for `on_not_correct`.")
+        if not self._handlers["on_timeout"]:
+            raise MissingHandler("No event handler declared for `on_timeout`.")
+
+    def _new_captcha(
+        self,
+        chat: types.Chat,
+        user: types.User,
+        options: Optional[CaptchaOptions],
+        code: str,
+    ) -> Captcha:
+        # a captcha that is not sent yet
+        captcha = Captcha(
+            None,
+            chat,
+            user,
+            options,
+            manager=self,
+            captcha_id=f"{self._bot_id}={chat.id}={user.id}",
+            previous_tries=0,
+            correct_code=code,
+            users_code="",
+            message_id=None,
+            date=None,
+            user_reloads_left=(options or self.default_options).max_user_reloads,
+        )
+        captcha.reply_markup = _code_input_markup(captcha)
+        return captcha
+
+    def _send_captcha(
+        self,
+        bot: TeleBot,
+        chat: types.Chat,
+        user: types.User,
+        options: Optional[CaptchaOptions],
+        code: str,
+        photo: Any,
+        entry: Any,
+    ) -> Captcha:
+        captcha = self._new_captcha(chat, user, options, code)
+        m = self._api(
+            bot,
+            "send_photo",
+            chat_id=chat.id,
+            photo=photo,
+            caption=captcha._caption(),
+            reply_markup=captcha.reply_markup,
+            parse_mode="HTML",
+        )
+        self._photo_sent(entry, m)
+        captcha.message_id = m.message_id
+        captcha.date = m.date
+        return captcha
+
+    def _new_photos(self, options: CaptchaOptions, count: int) -> List:
+        # `_new_photo` for many captchas in parallel, or the exception that stopped one
+        futures = [
+            self._render_threads.submit(self._new_photo, options) for _ in range(count)
+        ]
+        photos = []
+        for future in futures:
+            try:
+                photos.append(future.result())
+            except Exception as e:
+                photos.append(e)
+        return photos
+
+    def _new_codeimage(self, options: CaptchaOptions) -> Tuple:
+        return self.pool.get(options) if self.pool else self._render(options)
+
+    def _render(self, options: CaptchaOptions) -> Tuple:
+        return self._shared.render(options)
+
+    def _new_photo(self, options: CaptchaOptions, exclude: str = None) -> Tuple:
+        # (code, photo, library entry): photo is the image or the file_id of an uploaded image
+        # `exclude`: the code of a captcha that is reloaded, the library picks another
+        if not self.library:
+            return (*self._new_codeimage(options), None)
+        entry = self.library.get(options, exclude)
+        # the image is dropped after the file_id is set
+        image = entry.image
+        return entry.code, entry.file_id or image, entry
+
+    def _photo_sent(self, entry, message) -> None:
+        if entry is None or not getattr(message, "photo", None):
+            return
+        self.library.uploaded(entry, message.photo[-1].file_id)
+
+    def _options_reference(self, options: CaptchaOptions) -> Union[str, List]:
+        # the name of a profile, or the values of options that are not one
+        name = self._profile_names.get(id(options))
+        return name if name is not None else options._to_record()
+
+    def _options_profile(self, name: str) -> CaptchaOptions:
+        options = self.options_profiles.get(name)
+        if options is None:
+            logger.warning("Unknown options profile %r, using the default options", name)
+            return self.default_options
+        return options
+
+    def _get_captcha(self, captcha_id: str) -> Optional[Captcha]:
+        if self.storage.shared:
+            return self._refresh_captcha(captcha_id)
+        captcha = self.captchas.get(captcha_id)
+        if captcha is not None or captcha_id not in self._unloaded:
+            return captcha
+        with self._load_lock:
+            if captcha_id not in self._unloaded:
+                return self.captchas.get(captcha_id)
+            _, timeout_handle = self._unloaded.pop(captcha_id)
+            json_str = self._load(captcha_id)
+            if not json_str:
+                if timeout_handle:
+                    self._cancel_handle(timeout_handle)
+                return None
+            captcha = Captcha.from_record(json_str, manager=self)
+            captcha._timeout_handle = timeout_handle
+            self.captchas[captcha_id] = captcha
+            return captcha
+
+    def _recovered_timeout(self, captcha_id: str) -> None:
+        captcha = self._get_captcha(captcha_id)
+        if captcha is None or captcha.solved:
+            return
+        remaining = captcha.deadline - datetime.now().timestamp()
+        if remaining > 1:
+            if self.storage.shared:
+                # reset after it was claimed, the save puts its new deadline back
+                self._save(captcha)
+            else:
+                self._schedule_timeout(captcha, remaining)
+        elif not self._purge_loaded(captcha):
+            captcha._timeout_handle = None
+            self._timed_out(captcha)
+
+    def _purge_loaded(self, captcha: Captcha) -> bool:
+        # the deadline of captchas saved by older versions is only known once they are
+        # loaded, they are purged like the others if it passed `recovery_grace` ago
+        if captcha.deadline >= datetime.now().timestamp() - self.recovery_grace:
+            return False
+        captcha._timeout_handle = None
+        self._delete(captcha)
+        self._purged.inc()
+        return True
+
+    def _refresh_captcha(self, captcha_id: str) -> Optional[Captcha]:
+        # another process may have changed the captcha, the storage has the latest state
+        loaded = Captcha.from_record(self.storage.load(captcha_id), manager=self)
+        if loaded is None:
+            self.captchas.pop(captcha_id, None)
+            return None
+        captcha = self.captchas.get(captcha_id)
+        if captcha is None:
+            self.captchas[captcha_id] = loaded
+            return loaded
+        # the cached captcha keeps its pending caption edit
+        if any(getattr(captcha, n) != getattr(loaded, n) for n in _KEYBOARD_STATE):
+            captcha.reply_markup = None
+        for name in _SAVED_STATE:
+            setattr(captcha, name, getattr(loaded, name))
+        return captcha
+
+    def _claim_timeouts(self) -> None:
+        # every process takes the due captchas off the shared storage,
+        # each captcha is claimed by one of them
+        if self._closed:
+            return
+        try:
+            while True:
+                claimed = self.storage.claim_expired(
+                    self._bot_id, datetime.now().timestamp(), _CLAIM_BATCH
+                )
+                for captcha_id in claimed:
+                    self._scheduler.schedule(0, self._claimed_timeout, captcha_id)
+                if len(claimed) < _CLAIM_BATCH:
+                    break
+        except Exception:
+            logger.exception("Could not claim the timed out captchas")
+        if not self._closed:
+            self._claim_handle = self._scheduler.schedule(
+                self.claim_interval, self._claim_timeouts
+            )
+
+    def _claimed_timeout(self, captcha_id: str) -> None:
+        with self.storage.lock(captcha_id):
+            self._recovered_timeout(captcha_id)
+
+    def _load(self, captcha_id: str) -> Optional[str]:
+        if self._write_behind:
+            return self._write_behind.load(captcha_id)
+        return self.storage.load(captcha_id)
+
+    def _save(self, captcha: Captcha, force: bool = True) -> None:
+        if self._write_behind:
+            self._write_behind.save(captcha._captcha_id, captcha, force)
+        else:
+            with self._storage_seconds.time("save"):
+                self.storage.save(
+                    captcha._captcha_id, captcha.to_record(), captcha.deadline
+                )
+
+    def _save_many(self, captchas: List[Captcha]) -> None:
+        if self._write_behind:
+            for captcha in captchas:
+                self._write_behind.save(captcha._captcha_id, captcha)
+            self._write_behind.flush()
+        else:
+            with self._storage_seconds.time("save_many"):
+                self.storage.save_many(
+                    (captcha._captcha_id, captcha.to_record(), captcha.deadline)
+                    for captcha in captchas
+                )
+
+    def _delete(self, captcha: Captcha) -> None:
+        if self.captchas.get(captcha._captcha_id) is captcha:
+            del self.captchas[captcha._captcha_id]
+        self._delete_record(captcha._captcha_id)
+
+    def _delete_record(self, captcha_id: str) -> None:
+        if self._write_behind:
+            self._write_behind.delete(captcha_id, force=True)
+        else:
+            with self._storage_seconds.time("delete"):
+                self.storage.delete(captcha_id)
+
+    def _evicted(self, captcha: Captcha, reason: str) -> None:
+        # called by the registry, the captcha is not in it any more
+        self._evictions.inc(reason)
+        if reason == "pending":
+            self._unload(captcha)
+        else:
+            # its buttons are answered as stale from now on
+            self._delete_record(captcha._captcha_id)
+
+    def _unload(self, captcha: Captcha) -> None:
+        # the captcha stays saved, it is loaded again on its next button press or timeout
+        if self.storage.shared:
+            # its timeout is claimed from the storage
+            return
+        timeout_handle = None
+        if self._timeout_pending(captcha):
+            self._cancel_timeout(captcha)
+            timeout_handle = self._scheduler.schedule(
+                max(captcha.deadline - datetime.now().timestamp(), 0),
+                self._recovered_timeout,
+                captcha._captcha_id,
+            )
+        self._unloaded[captcha._captcha_id] = [captcha.deadline, timeout_handle]
+
+    def _sweep(self) -> None:
+        # drops the finished captchas and deletes saves that no timeout fires for
+        if self._closed:
+            return
+        try:
+            self.captchas.sweep()
+            before = datetime.now().timestamp() - self.recovery_grace
+            purged = self.storage.purge(self._bot_id, before)
+            with self._load_lock:
+                for captcha_id, unloaded in list(self._unloaded.items()):
+                    if unloaded[0] is not None and unloaded[0] < before:
+                        del self._unloaded[captcha_id]
+                        if unloaded[1]:
+                            self._cancel_handle(unloaded[1])
+            if purged:
+                self._purged.inc(amount=purged)
+        except Exception:
+            logger.exception("Could not sweep the captchas")
+        if not self._closed:
+            self._sweep_handle = self._scheduler.schedule(
+                self.sweep_interval, self._sweep
+            )
+
+    def _api(self, bot: TeleBot, method: str, *args, **kwargs) -> Any:
+        # calls a Bot API method of `bot` and records its latency and failures
+        start = time.perf_counter()
+        try:
+            return getattr(bot, method)(*args, **kwargs)
+        except Exception:
+            self._api_failures.inc(method)
+            raise
+        finally:
+            self._api_seconds.observe(time.perf_counter() - start, method)
+
+    def _schedule_timeout(self, captcha: Captcha, delay: float) -> None:
+        self._cancel_timeout(captcha)
+        if self.storage.shared:
+            # the deadline is saved with the captcha, a process claims it when it is due
+            return
+        captcha._timeout_handle = self._scheduler.schedule(
+            delay, self._timed_out, captcha
+        )
+
+    def _schedule_timeouts(self, captchas: List[Captcha]) -> None:
+        if self.storage.shared:
+            return
+        handles = self._scheduler.schedule_many(
+            (captcha.options.timeout, self._timed_out, (captcha,))
+            for captcha in captchas
+        )
+        for captcha, handle in zip(captchas, handles):
+            captcha._timeout_handle = handle
+
+    def _timed_out(self, captcha: Captcha) -> None:
+        self._results.inc("timeout")
+        date = captcha.date
+        try:
+            self._handlers["on_timeout"](captcha)
+        finally:
+            if self._is_finished(captcha, date):
+                self.captchas.finish(captcha)
+                if self.storage.shared:
+                    # its deadline is kept while it is claimed
+                    self._save_finished(captcha)
+
+    def _is_finished(self, captcha: Captcha, date: float) -> bool:
+        # False if a handler reset the captcha (new code and timeout) for another try
+        return captcha.date == date and not self._timeout_pending(captcha)
+
+    def _timeout_pending(self, captcha: Captcha) -> bool:
+        handle = captcha._timeout_handle
+        return handle is not None and handle.pending
+
+    def _cancel_timeout(self, captcha: Captcha) -> None:
+        if captcha._timeout_handle:
+            captcha._timeout_handle.cancel()
+            captcha._timeout_handle = None
+
+    def _cancel_handle(self, handle: TimeoutHandle) -> None:
+        # the timeout of an unloaded captcha, cancelled in any thread
+        handle.cancel()
+
+    def _edit_caption(
+        self,
+        bot: TeleBot,
+        captcha: Captcha,
+        reply_markup: types.JsonSerializable,
+        changed: bool = True,
+    ) -> None:
+        # the first edit of a window is sent at once, later ones are merged into one trailing edit
+        with self._edit_lock:
+            if not changed:
+                self._edit_counts["skipped"] += 1
+                return
+            if self.edit_interval > 0:
+                if captcha._edit_handle is not None:
+                    self._edit_counts["coalesced"] += 1
+                    return
+                delay = captcha._edited_at + self.edit_interval - time.monotonic()
+                if delay > 0:
+                    captcha._edit_handle = self._scheduler.schedule(
+                        delay, self._flush_caption, bot, captcha, reply_markup
+                    )
+                    return
+                captcha._edited_at = time.monotonic()
+        self._send_caption(bot, captcha, reply_markup)
+
+    def _flush_caption(
+        self, bot: TeleBot, captcha: Captcha, reply_markup: types.JsonSerializable
+    ) -> None:
+        with self._edit_lock:
+            if captcha._edit_handle is None:
+                return
+            captcha._edit_handle = None
+            if captcha.solved or self.captchas.is_finished(captcha):
+                # it finished in the meantime, the caption is not edited any more
+                return
+            captcha._edited_at = time.monotonic()
+        self._send_caption(bot, captcha, reply_markup)
+
+    def _send_caption(
+        self, bot: TeleBot, captcha: Captcha, reply_markup: types.JsonSerializable
+    ) -> None:
+        try:
+            self._api(
+                bot,
+                "edit_message_caption",
+                caption=captcha._caption(show_code=True),
+                chat_id=captcha.chat.id,
+                message_id=captcha.message_id,
+                reply_markup=reply_markup,
+                parse_mode="HTML",
+            )
+        except Exception as e:
+            with self._edit_lock:
+                self._edit_counts["failed"] += 1
+            logger.debug(
+                "Could not edit the caption of captcha %s: %s", captcha._captcha_id, e
+            )
+            return
+        with self._edit_lock:
+            self._edit_counts["edits"] += 1
+
+    def _cancel_edit(self, captcha: Captcha) -> None:
+        with self._edit_lock:
+            if captcha._edit_handle:
+                captcha._edit_handle.cancel()
+                captcha._edit_handle = None
+
     def _check_captcha(self, captcha: Captcha, bot: TeleBot):
+        self._cancel_edit(captcha)
         is_correct = captcha.users_code == captcha.correct_code
         captcha.previous_tries += 1
 
@@ -991,19 +2087,131 @@ class CaptchaManager:
         ):
             captcha._reset(bot)
         else:
-            if captcha._timeout_thread:
-                captcha._timeout_thread.cancel()
-                captcha._timeout_thread = None
+            self._cancel_timeout(captcha)
 
+            self._results.inc("solved" if is_correct else "failed")
+            date = captcha.date
             if is_correct:
                 self._handlers["on_correct"](captcha)
             else:
                 self._handlers["on_not_correct"](captcha)
+            if not self._is_finished(captcha, date):
+                return
             captcha.solved = True
+            self.captchas.finish(captcha)
+            if self.storage.shared:
+                self._save_finished(captcha)
 
+    def _save_finished(self, captcha: Captcha) -> None:
+        # a finished captcha that the handler did not delete
+        # must not time out (again) in another process
+        if self.storage.load(captcha._captcha_id) is not None:
+            with self._storage_seconds.time("save"):
+                self.storage.save(captcha._captcha_id, captcha.to_record(), None)
 
-def _code_input_markup(captcha: Captcha) -> types.InlineKeyboardMarkup:
-    values = {}
+
+class _KeyboardMarkup(types.JsonSerializable, types.Dictionaryable):
+    def __init__(self, template: Tuple[str, ...], handle: str) -> None:
+        """
+        The inline keyboard of a captcha: a serialized keyboard template with the handle of
+        the captcha filled in. telebot sends it as is, the buttons are not built again.
+        """
+        self._template = template
+        self._handle = handle
+
+    def to_json(self) -> str:
+        return self._handle.join(self._template)
+
+    def to_dict(self) -> Dict:
+        return json.loads(self.to_json())
+
+
+class _Shared:
+    def __init__(
+        self,
+        pool_size: int,
+        pool_low_water: Optional[int],
+        pool_workers: int,
+        render_processes: int,
+        timeout_workers: int,
+        fonts: List[str],
+        keyzend: Optional[KeyzendClient],
+    ) -> None:
+        """
+        The captcha pool, render processes and timeout scheduler of one or more
+        managers, and the fonts and keyzend client they render with.
+        Everything in here is independent of the bot, the file_id library is not.
+        """
+        self._lock = Lock()
+        self._users = 0
+        self.fonts = fonts
+        self.keyzend = keyzend
+
+        self.render_executor: Optional[ProcessPoolExecutor] = None
+        if render_processes > 0:
+            self.render_executor = ProcessPoolExecutor(render_processes)
+            # the workers are started now, before the manager starts its own threads
+            self.render_executor.submit(int)
+        # renders the captchas of `send_new_captchas` in parallel, threads are started on demand
+        self.render_threads = ThreadPoolExecutor(
+            max_workers=max(4, render_processes), thread_name_prefix="CaptchaRender"
+        )
+        self.render_seconds = Histogram(
+            "captcha_render_seconds",
+            "Time to render a captcha image by generator",
+            ("generator",),
+        )
+
+        self.scheduler = TimeoutScheduler(max_workers=timeout_workers)
+
+        self.pool: Optional[CaptchaPool] = None
+        if pool_size > 0:
+            self.pool = CaptchaPool(
+                self.render,
+                size=pool_size,
+                low_water=pool_low_water,
+                workers=pool_workers,
+            )
+
+    def render(self, options: CaptchaOptions) -> Tuple:
+        with self.render_seconds.time(options.generator):
+            if options.generator == "keyzend":
+                # fetched by the client of the managers, a process would not help
+                return _random_codeimage(options, self.fonts, self.keyzend_client())
+            if not self.render_executor:
+                return _random_codeimage(options, self.fonts)
+            return self.render_executor.submit(
+                _render_process, tuple(self.fonts), options
+            ).result()
+
+    def keyzend_client(self) -> KeyzendClient:
+        if self.keyzend is None:
+            with self._lock:
+                if self.keyzend is None:
+                    self.keyzend = KeyzendClient()
+        return self.keyzend
+
+    def acquire(self) -> None:
+        with self._lock:
+            self._users += 1
+
+    def release(self) -> None:
+        with self._lock:
+            self._users -= 1
+            if self._users > 0:
+                return
+        self.scheduler.close()
+        if self.pool:
+            self.pool.close()
+        if self.keyzend is not None:
+            # stops its prefetch thread
+            self.keyzend.close()
+        self.render_threads.shutdown(wait=False)
+        if self.render_executor:
+            self.render_executor.shutdown(wait=False)
+
+
+def _code_input_markup(captcha: Captcha) -> _KeyboardMarkup:
     row_width = 5
     display_attempts_left = captcha.options.max_attempts - captcha.previous_tries
     if captcha.options.max_incorrect_to_auto_reload <= 0:
@@ -1012,25 +2220,41 @@ def _code_input_markup(captcha: Captcha) -> types.InlineKeyboardMarkup:
         "" if display_attempts_left <= 0 else str(display_attempts_left)
     )
     if captcha.options.generator == "keyzend":
+        # the keys depend on the code, there is nothing to share with other captchas
         chars = extend_code(captcha.correct_code, 10)
-        for char in chars:
-            values[char] = {"callback_data": f"?cap={captcha.user.id}={char}"}
-    else:
-        chars = digits if captcha.options.only_digits else hexdigits
-        for char in chars:
-            values[char] = {"callback_data": f"?cap={captcha.user.id}={char}"}
-        if not captcha.options.only_digits:
-            row_width = 4
-    if captcha.user_reloads_left > 0:
-        values[f"🔄 {captcha.user_reloads_left}"] = {
-            "callback_data": f"?cap={captcha.user.id}=RELOAD"
-        }
+        template = _keyboard_template(
+            chars, row_width, captcha.user_reloads_left, display_attempts_left
+        )
+        return _KeyboardMarkup(template, captcha.handle)
+
+    chars = digits if captcha.options.only_digits else hexdigits
+    if not captcha.options.only_digits:
+        row_width = 4
+    key = (chars, row_width, captcha.user_reloads_left, display_attempts_left)
+    template = _keyboard_templates.get(key)
+    if template is None:
+        template = _keyboard_templates[key] = _keyboard_template(*key)
+    return _KeyboardMarkup(template, captcha.handle)
+
+
+def _keyboard_template(
+    chars: str, row_width: int, reloads_left: int, attempts_left: str
+) -> Tuple[str, ...]:
+    values = {}
+    for char in chars:
+        values[char] = {"callback_data": _callback_data(char)}
+    if reloads_left > 0:
+        values[f"🔄 {reloads_left}"] = {"callback_data": _callback_data("RELOAD")}
     values = {
         **values,
-        "⬅️": {"callback_data": f"?cap={captcha.user.id}=BACK"},
-        f"✅ {display_attempts_left}": {"callback_data": f"?cap={captcha.user.id}=OK"},
+        "⬅️": {"callback_data": _callback_data("BACK")},
+        f"✅ {attempts_left}": {"callback_data": _callback_data("OK")},
     }
-    return _quick_markup(values, row_width)
+    return tuple(_quick_markup(values, row_width).to_json().split(_HANDLE))
+
+
+def _callback_data(button: str) -> str:
+    return _CALLBACK_PREFIX + _BUTTON_CODES.get(button, button) + _HANDLE
 
 
 def _quick_markup(values, row_width=4) -> types.InlineKeyboardMarkup:
@@ -1072,24 +2296,64 @@ def extend_code(
     return result
 
 
-def _random_codeimage(options: CaptchaOptions) -> Tuple:
+def preload_fonts(
+    fonts: List[str],
+    font_sizes: Tuple[int, ...] = FONT_SIZES,
+    size: Tuple[int, int] = IMAGE_SIZE,
+) -> None:
+    """
+    Parses the given .ttf fonts once and caches them together with a renderer.
+    Captchas rendered with the same fonts later on do not load the font files again.
+    :param fonts: paths of .ttf fonts
+    :param font_sizes: the font sizes to load every font with
+    :param size: the image size (width, height) of the renderer
+    """
+    _image_captcha(fonts, font_sizes, size)
+
+
+def _image_captcha(
+    fonts: Optional[List[str]] = None,
+    font_sizes: Tuple[int, ...] = FONT_SIZES,
+    size: Tuple[int, int] = IMAGE_SIZE,
+) -> ImageCaptcha:
+    if fonts is None:
+        fonts = _default_fonts()
+    key = (tuple(fonts), tuple(font_sizes), tuple(size))
+    renderer = _renderer_cache.get(key)
+    if renderer is None:
+        with _render_cache_lock:
+            renderer = _renderer_cache.get(key)
+            if renderer is None:
+                fonts, font_sizes, (width, height) = key
+                renderer = ImageCaptcha(width, height, list(fonts), list(font_sizes))
+                # `generate_image` only reads the fonts, so the renderer can be
+                # used by several threads once they are loaded
+                renderer.truefonts
+                _renderer_cache[key] = renderer
+    return renderer
+
+
+def _random_codeimage(
+    options: CaptchaOptions,
+    fonts: Optional[List[str]] = None,
+    keyzend: Optional[KeyzendClient] = None,
+) -> Tuple:
+    # renders with the fonts of the package and a default client if none are given
     image, code = None, None
     if options.generator == "keyzend":
-        r = requests.get("https://tyt.keyzend.pw/captcha.png")
-        if r.status_code == 200:
-            code = r.headers["answer"].upper()
-            image = r.content
-        else:
-            raise requests.RequestException(
-                "Could not get the CAPTCHA from https://tyt.keyzend.pw/captcha.png"
-            )
+        client = keyzend or _keyzend_client()
+        try:
+            code, image = client.get()
+        except KeyzendUnavailable:
+            if not client.fallback:
+                raise
+            code, image = _local_keyzend(options, fonts)
 
     elif options.generator == "default":
-        image = ImageCaptcha(300, 128, _fonts, [48, 42, 54])
         code = _random_code(
             digits if options.only_digits else hexdigits, options.code_length
         )
-        image = image.generate_image(code)
+        image = _image_captcha(fonts).generate_image(code)
 
         if options.add_noise:
             image = _add_noise(image)
@@ -1107,30 +2371,132 @@ def _random_codeimage(options: CaptchaOptions) -> Tuple:
         captcha = captcha_generator.gen_math_captcha_image()
         image = captcha["image"]
         code = captcha["equation_result"]
-        options.code_length = len(code)
+
+    if isinstance(image, Image.Image):
+        image = _encode_image(image, options.image_format, options.image_quality)
     return (code, image)
 
 
+def _render_process(fonts: Tuple[str, ...], options: CaptchaOptions) -> Tuple:
+    # runs in a worker process of `render_processes`, the fonts are loaded by the first call
+    return _random_codeimage(options, list(fonts))
+
+
+def _default_fonts() -> List[str]:
+    if not _fonts:
+        for f in os.listdir(_fonts_path):
+            if f.endswith(".ttf") and not f.startswith("."):
+                _fonts.append(str(_fonts_path / f))
+    return _fonts
+
+
+def _keyzend_client() -> KeyzendClient:
+    global _keyzend
+    if _keyzend is None:
+        with _render_cache_lock:
+            if _keyzend is None:
+                _keyzend = KeyzendClient()
+    return _keyzend
+
+
+def _local_keyzend(options: CaptchaOptions, fonts: Optional[List[str]] = None) -> Tuple:
+    # a letter code that fits the keyzend keyboard, rendered by the default generator
+    code = _random_code("ABCDEFGHIJKLMNOPQRSTUVWXYZ", options.code_length)
+    image = _image_captcha(fonts).generate_image(code)
+    if options.add_noise:
+        image = _add_noise(image)
+    return code, image
+
+
+def _encode_image(image: Image.Image, image_format: str, quality: int) -> bytes:
+    buffer = BytesIO()
+    if image_format == "PNG":
+        image.save(buffer, "PNG")
+    else:
+        image.convert("RGB").save(buffer, image_format, quality=quality)
+    return buffer.getvalue()
+
+
 def _add_noise(im: Image.Image, mean=12, sigma=48) -> Image.Image:
-    for x in range(im.size[0]):
-        for y in range(im.size[1]):
-            r, g, b = im.getpixel((x, y))
-            im.putpixel(
-                (x, y),
-                (
-                    int(min(max(0, r + random.normalvariate(mean, sigma)), 255)),
-                    int(min(max(0, g + random.normalvariate(mean, sigma)), 255)),
-                    int(min(max(0, b + random.normalvariate(mean, sigma)), 255)),
-                ),
-            )
-    return im
+    """
+    Adds gaussian noise with the given `mean` and `sigma` to every channel of every pixel.
+    The noise is generated and applied by Pillow in C instead of per pixel in Python.
+    """
+    if im.mode != "RGB":
+        im = im.convert("RGB")
+    # `effect_noise` is centered on 128, so the offset shifts it to `mean`.
+    # `ImageChops.add` clamps the result to 0-255 like the per-pixel loop did.
+    noise = Image.merge(
+        "RGB", [Image.effect_noise(im.size, sigma) for _ in range(3)]
+    )
+    return ImageChops.add(im, noise, 1.0, int(mean) - 128)
+
+
+def _caption_template(language: Dict) -> Tuple[Tuple[str, ...], str, str]:
+    """
+    The compiled caption of a language: (text split on #USER, end of the first try, end of later tries).
+    Keyed by the texts, so a changed `CustomLanguage` gets a new template.
+    """
+    key = (language["text"], language["try_again"], language["your_code"])
+    template = _caption_templates.get(key)
+    if template is None:
+        text, try_again, your_code = key
+        template = _caption_templates[key] = (
+            tuple(text.split("#USER")),
+            "\n" + your_code,
+            "\n" + try_again + "\n" + your_code,
+        )
+    return template
+
+
+if orjson is not None:
+
+    def _dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode()
+
+    _loads = orjson.loads
+elif json.__name__ == "json":
+
+    def _dumps(obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+    _loads = json.loads
+else:
+    # ujson writes without spaces
+    def _dumps(obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False)
+
+    _loads = json.loads
+
+
+def _unique_users(users: List[types.User]) -> List[types.User]:
+    # the captcha_id is per user, a second captcha would orphan the first one
+    unique: Dict[int, types.User] = {}
+    for user in users:
+        unique.setdefault(user.id, user)
+    return list(unique.values())
+
+
+_BASE36 = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def _base36(number: int) -> str:
+    # the inverse of int(text, 36)
+    if number < 0:
+        return "-" + _base36(-number)
+    text = ""
+    while True:
+        number, digit = divmod(number, 36)
+        text = _BASE36[digit] + text
+        if not number:
+            return text
+
+
+_escape_table = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt"})
 
 
 def _escape(text: str) -> str:
-    chars = {"&": "&amp;", "<": "&lt;", ">": "&gt"}
-    for old, new in chars.items():
-        text = text.replace(old, new)
-    return text
+    return text.translate(_escape_table)
 
 
 def _user_link(user: types.User, include_id: bool = False) -> str:
@@ -19,8 +19,10 @@ setup(
     url="https://github.com/SwissCorePy/pyTelegramBotCAPTCHA",
     download_url="https://github.com/SwissCorePy/pyTelegramBotCAPTCHA/archive/refs/heads/main.zip",
     keywords=["Telegram", "Captcha", "pyTelegramBotAPI"],
+    # AsyncCaptchaManager needs Python 3.7
+    python_requires=">=3.6",
     install_requires=["pyTelegramBotAPI>=3.8.1", "captcha", "Pillow"],
-    extras_require={"json": "ujson"},
+    extras_require={"json": ["ujson", "orjson"]},
     classifiers=[
         "Development Status :: 5 - Production/Stable",
         "Environment :: Console",
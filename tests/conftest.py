@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+The tests use the fake Bot API and Redis stand-ins of the benchmarks.
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+_benchmarks = str(Path(__file__).parent.parent.absolute() / "benchmarks")
+if _benchmarks not in sys.path:
+    sys.path.insert(0, _benchmarks)
+
+from _common import FakeBot, FakeChat, new_manager  # noqa: E402
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--slow", action="store_true", help="also run the long, timing based tests"
+    )
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: long, timing based, needs --slow")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--slow"):
+        return
+    skip = pytest.mark.skip(reason="needs --slow")
+    for item in items:
+        if "slow" in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture
+def bot():
+    return FakeBot()
+
+
+@pytest.fixture
+def chat():
+    return FakeChat(-100)
+
+
+@pytest.fixture
+def manager():
+    manager = new_manager()
+    yield manager
+    manager.close()
+
+
+def wrong_code(captcha):
+    """
+    A code of the right length in which every char is wrong.
+    """
+    return "".join("1" if c == "0" else "0" for c in captcha.correct_code)
+
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import sys
+
+import pytest
+
+from _common import FakeAsyncBot, fake_user, find_fonts
+from pyTelegramBotCaptcha import AsyncCaptchaManager, CaptchaOptions
+from pyTelegramBotCaptcha.storage import MemoryStorage
+
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 7), reason="asyncio.run")
+
+
+def new_async_manager(timeouts, **kwargs):
+    manager = AsyncCaptchaManager(
+        1, storage=MemoryStorage(), fonts=find_fonts(), **kwargs
+    )
+    manager.on_captcha_correct(lambda captcha: None)
+    manager.on_captcha_not_correct(lambda captcha: None)
+    manager.on_captcha_timeout(timeouts.append)
+    return manager
+
+
+def test_close_in_another_thread_cancels_the_timeouts(chat):
+    async def main():
+        bot, timeouts = FakeAsyncBot(), []
+        manager = new_async_manager(timeouts)
+        options = CaptchaOptions()
+        options._timeout = 0.3
+        for user_id in range(1, 6):
+            await manager.send_new_captcha(bot, chat, fake_user(user_id), options)
+        assert manager.pending_timeouts == 5
+        await asyncio.get_running_loop().run_in_executor(None, manager.close)
+        await asyncio.sleep(0.5)
+        assert manager.pending_timeouts == 0
+        assert timeouts == []
+
+    asyncio.run(main())
+
+
+def test_timeouts_fire_in_tasks_that_are_kept(chat):
+    async def main():
+        bot, timeouts = FakeAsyncBot(), []
+        manager = new_async_manager(timeouts)
+        options = CaptchaOptions()
+        options._timeout = 0.1
+        try:
+            captcha = await manager.send_new_captcha(bot, chat, fake_user(1), options)
+            await asyncio.sleep(0.15)
+            # the handler runs in a task that the manager holds until it is done
+            assert timeouts == [captcha]
+            await asyncio.sleep(0)
+            assert not manager._tasks
+        finally:
+            manager.close()
+
+    asyncio.run(main())
+
+
+def test_a_user_twice_in_a_batch_gets_one_captcha(chat):
+    async def main():
+        bot = FakeAsyncBot()
+        manager = new_async_manager([])
+        try:
+            users = [fake_user(1), fake_user(1)]
+            captchas, errors = await manager.send_new_captchas(bot, chat, users)
+            assert not errors and len(captchas) == 1
+            assert bot.calls["send_photo"] == 1
+            assert manager.pending_timeouts == 1
+        finally:
+            manager.close()
+
+    asyncio.run(main())
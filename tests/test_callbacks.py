@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import sys
+
+import pytest
+
+from _common import FakeAsyncBot, FakeBot, FakeCallback, fake_user, new_manager, press
+from pyTelegramBotCaptcha import CaptchaOptions
+from pyTelegramBotCaptcha.storage import MemoryStorage
+from test_async import new_async_manager
+
+
+class AnsweringBot(FakeBot):
+    def __init__(self):
+        super().__init__()
+        self.answers = []
+
+    def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+        self.answers.append(text)
+        return super().answer_callback_query(callback_query_id, text, **kwargs)
+
+
+class AnsweringAsyncBot(FakeAsyncBot, AnsweringBot):
+    pass
+
+
+def stale(manager):
+    return manager.metrics["captcha_stale_callbacks_total"].value()
+
+
+def test_callback_data_fits_in_64_bytes(manager, bot, chat):
+    options = CaptchaOptions(only_digits=False)
+    for user_id in (1, 2 ** 40, 2 ** 52 - 1):
+        captcha = manager.send_new_captcha(bot, chat, fake_user(user_id), options)
+        buttons = captcha.reply_markup.to_dict()["inline_keyboard"]
+        for button in [button for row in buttons for button in row]:
+            assert len(button["callback_data"].encode()) <= 64
+
+
+def test_presses_find_the_captcha_by_its_handle(monkeypatch, bot, chat):
+    manager = new_manager(storage=MemoryStorage())
+    try:
+        captcha = manager.send_new_captcha(bot, chat, fake_user(1))
+
+        def get_captcha(captcha_id):
+            raise AssertionError("loaded by captcha_id")
+
+        monkeypatch.setattr(manager, "_get_captcha", get_captcha)
+        press(manager, bot, captcha, captcha.correct_code[0])
+        assert captcha.users_code == captcha.correct_code[0]
+    finally:
+        manager.close()
+
+
+@pytest.mark.parametrize("data", ["?c:0zzzz", "?cap=garbage", "?cap=x=1", "?cap=7=1"])
+def test_stale_and_malformed_callbacks_are_answered(manager, chat, data):
+    bot = AnsweringBot()
+    captcha = manager.send_new_captcha(bot, chat, fake_user(1))
+    manager.update_captcha(bot, FakeCallback(captcha, data))
+    assert bot.answers == [None]
+    assert stale(manager) == 1
+
+
+def test_reload_without_reloads_left_is_answered(manager, chat):
+    bot = AnsweringBot()
+    options = CaptchaOptions(max_user_reloads=0)
+    captcha = manager.send_new_captcha(bot, chat, fake_user(1), options)
+    press(manager, bot, captcha, "RELOAD")
+    press(manager, bot, captcha, "RELOAD")
+    assert len(bot.answers) == 2 and all(bot.answers)
+    assert bot.calls.get("edit_message_media", 0) == 0
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="asyncio.run")
+def test_async_reload_without_reloads_left_is_answered(chat):
+    async def main():
+        bot = AnsweringAsyncBot()
+        manager = new_async_manager([])
+        options = CaptchaOptions(max_user_reloads=0)
+        try:
+            captcha = await manager.send_new_captcha(
+                bot, chat, fake_user(1), options
+            )
+            data = f"?c:*{captcha.handle}"
+            await manager.update_captcha(bot, FakeCallback(captcha, data))
+            assert len(bot.answers) == 1 and bot.answers[0]
+        finally:
+            manager.close()
+
+    asyncio.run(main())
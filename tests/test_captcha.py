@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+import pytest
+from telebot import types
+
+from _common import fake_user
+from pyTelegramBotCaptcha import Captcha
+
+
+def test_chat_has_the_fields_of_a_telegram_chat(manager, bot, chat):
+    captcha = manager.send_new_captcha(bot, chat, fake_user(1))
+    assert captcha.chat.id == chat.id
+    # not kept by the captcha, like in a chat that does not have them
+    assert captcha.chat.first_name is None
+    assert captcha.chat.invite_link is None
+    with pytest.raises(AttributeError):
+        captcha.chat.no_such_field
+    loaded = Captcha.from_record(captcha.to_record(), manager=manager)
+    assert loaded.chat.id == chat.id and loaded.chat.invite_link is None
+
+
+def test_handlers_can_set_attributes(manager, bot, chat):
+    captcha = manager.send_new_captcha(bot, chat, fake_user(1))
+    captcha.welcome_message_id = 42
+    assert captcha.welcome_message_id == 42
+
+
+def test_captcha_is_a_telebot_json_type(manager, bot, chat):
+    captcha = manager.send_new_captcha(bot, chat, fake_user(1))
+    assert isinstance(captcha, types.JsonSerializable)
+    assert isinstance(captcha, types.JsonDeserializable)
+    # the state is kept in slots, the dict is only created by handlers
+    assert captcha.__dict__ == {}
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import time
+
+from _common import fake_user, new_manager, press
+from pyTelegramBotCaptcha import CaptchaOptions
+
+OPTIONS = CaptchaOptions(only_digits=True)
+
+
+def edits(bot):
+    return bot.calls.get("edit_message_caption", 0)
+
+
+def test_edits_are_coalesced_into_a_trailing_edit(bot, chat):
+    manager = new_manager(edit_interval=0.1)
+    try:
+        captcha = manager.send_new_captcha(bot, chat, fake_user(1), OPTIONS)
+        for button in captcha.correct_code[:4]:
+            press(manager, bot, captcha, button)
+        # the first press is sent at once, the others wait for the window
+        assert edits(bot) == 1
+        time.sleep(0.3)
+        assert edits(bot) == 2
+        assert captcha._edit_handle is None
+    finally:
+        manager.close()
+
+
+def test_caption_is_edited_after_a_solved_captcha_is_reset(bot, chat):
+    manager = new_manager(edit_interval=0.1)
+    try:
+        captcha = manager.send_new_captcha(bot, chat, fake_user(1), OPTIONS)
+        for button in list(captcha.correct_code) + ["OK"]:
+            press(manager, bot, captcha, button)
+        assert captcha.solved
+        manager.reset_captcha(bot, captcha)
+        assert not captcha.solved
+        for _ in range(3):
+            before = edits(bot)
+            for button in captcha.correct_code[:3]:
+                press(manager, bot, captcha, button)
+            press(manager, bot, captcha, "BACK")
+            time.sleep(0.3)
+            assert edits(bot) > before
+            assert captcha._edit_handle is None
+            for _ in range(2):
+                press(manager, bot, captcha, "BACK")
+    finally:
+        manager.close()
+
+
+def test_skipped_trailing_edit_does_not_block_later_edits(bot, chat):
+    manager = new_manager(edit_interval=0.1)
+    try:
+        captcha = manager.send_new_captcha(bot, chat, fake_user(1), OPTIONS)
+        for button in captcha.correct_code[:2]:
+            press(manager, bot, captcha, button)
+        # finished while the trailing edit waits, e.g. by another thread
+        captcha.solved = True
+        time.sleep(0.3)
+        assert captcha._edit_handle is None
+        assert edits(bot) == 1
+        captcha.solved = False
+        press(manager, bot, captcha, captcha.correct_code[2])
+        assert edits(bot) == 2
+    finally:
+        manager.close()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import pytest
+
+from _common import find_fonts, new_manager
+from bench_keyzend import start_keyzend
+from pyTelegramBotCaptcha import CaptchaOptions, KeyzendClient, telebot_captcha
+from pyTelegramBotCaptcha.keyzend import KeyzendUnavailable
+
+OPTIONS = CaptchaOptions(generator="keyzend")
+
+
+@pytest.fixture
+def keyzend():
+    server, url = start_keyzend()
+    yield server, url
+    server.shutdown()
+
+
+def render(client):
+    return telebot_captcha._random_codeimage(OPTIONS, find_fonts(), client)
+
+
+def prefetch_threads():
+    return [t for t in threading.enumerate() if t.name == "KeyzendPrefetch"]
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_circuit_breaker_falls_back_and_recovers(keyzend):
+    server, url = keyzend
+    client = KeyzendClient(
+        url, timeout=(0.5, 0.5), failure_threshold=2, reset_timeout=0.3
+    )
+    try:
+        assert render(client)[0] == "ABCDE"
+
+        server.mode = "down"
+        codes = [render(client)[0] for _ in range(5)]
+        # rendered locally, after two failures keyzend is not asked any more
+        assert "ABCDE" not in codes
+        assert client.state == "open"
+        assert server.requests == 3
+
+        server.mode = "ok"
+        time.sleep(0.4)
+        assert client.state == "half-open"
+        assert render(client)[0] == "ABCDE"
+        assert client.state == "closed"
+    finally:
+        client.close()
+
+
+def test_without_fallback_the_error_is_raised(keyzend):
+    server, url = keyzend
+    server.mode = "down"
+    client = KeyzendClient(url, timeout=(0.5, 0.5), fallback=False)
+    try:
+        with pytest.raises(KeyzendUnavailable):
+            render(client)
+    finally:
+        client.close()
+
+
+def test_prefetched_captchas_are_used_first(keyzend):
+    server, url = keyzend
+    client = KeyzendClient(url, timeout=(0.5, 0.5), prefetch=3)
+    try:
+        assert wait_for(lambda: client.stats()["ready"] == 3)
+        assert render(client)[0] == "ABCDE"
+        assert client.prefetch_hits == 1
+        # the buffer is filled up again in the background
+        assert wait_for(lambda: client.stats()["ready"] == 3)
+        assert server.requests == 4
+    finally:
+        client.close()
+
+
+def test_manager_close_stops_the_prefetch_thread(keyzend):
+    _, url = keyzend
+    before = len(prefetch_threads())
+    manager = new_manager(keyzend=KeyzendClient(url, timeout=(0.5, 0.5), prefetch=2))
+    assert len(prefetch_threads()) == before + 1
+    manager.close()
+    assert wait_for(lambda: len(prefetch_threads()) == before)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import itertools
+import time
+from threading import Thread
+
+from _common import fake_user, new_manager
+from bench_file_id import raid
+from pyTelegramBotCaptcha import CaptchaOptions
+from pyTelegramBotCaptcha.pool import CaptchaLibrary
+
+
+def test_library_cuts_the_uploads():
+    uploads = {}
+    for name, kwargs in (
+        ("without", {}),
+        ("with", {"library_size": 16, "library_max_uses": 10}),
+    ):
+        manager = new_manager(**kwargs)
+        try:
+            bot, _ = raid(manager, joins=200)
+        finally:
+            manager.close()
+        uploads[name] = bot.uploads
+    # 220 sends: 200 joins and 20 reloads
+    assert uploads["without"] == 220
+    assert uploads["with"] <= 16 + 220 // 10
+
+
+def test_reload_picks_another_captcha(bot, chat):
+    manager = new_manager(library_size=2, library_max_uses=1000)
+    try:
+        captcha = manager.send_new_captcha(bot, chat, fake_user(1))
+        for _ in range(20):
+            code = captcha.correct_code
+            manager.reset_captcha(bot, captcha)
+            assert captcha.correct_code != code
+    finally:
+        manager.close()
+
+
+def test_excluded_code_of_a_single_entry_is_rendered_again():
+    codes = itertools.count()
+    library = CaptchaLibrary(lambda options: (str(next(codes)), b""), size=1)
+    options = CaptchaOptions()
+    first = library.get(options)
+    assert library.get(options) is first
+    second = library.get(options, exclude=first.code)
+    assert second.code != first.code
+    assert library.stats()["rotated"] == 1
+
+
+def test_concurrent_renders_do_not_grow_the_library():
+    codes = itertools.count()
+
+    def render(options):
+        time.sleep(0.005)
+        return str(next(codes)), b""
+
+    library = CaptchaLibrary(render, size=4, max_uses=1)
+    options = CaptchaOptions()
+    threads = [
+        Thread(target=lambda: [library.get(options) for _ in range(20)])
+        for _ in range(16)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert library.stats()["entries"] == 4
+    assert library.stats()["uploads"] == 16 * 20
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import time
+
+import pytest
+
+from pyTelegramBotCaptcha import CaptchaOptions
+from pyTelegramBotCaptcha.pool import CaptchaPool, profile_key
+
+PROFILES = [
+    CaptchaOptions(code_length=4, only_digits=True),
+    CaptchaOptions(code_length=6, only_digits=True),
+    CaptchaOptions(code_length=4, only_digits=False),
+    CaptchaOptions(code_length=6, only_digits=False),
+]
+
+
+def render(options):
+    # the pair tells the options it was rendered for
+    char = "1" if options.only_digits else "A"
+    return char * options.code_length, (options.code_length, options.only_digits)
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def pool():
+    pool = CaptchaPool(render, size=4, low_water=1, workers=2)
+    yield pool
+    pool.close()
+
+
+def ready(pool, options):
+    return pool.stats()["ready"].get(profile_key(options), 0)
+
+
+def test_hits_and_misses_are_counted(pool):
+    options = PROFILES[0]
+    assert pool.get(options) == render(options)
+    assert pool.stats()["misses"] == 1
+    # the miss started a refill
+    wait_for(lambda: ready(pool, options) == 4)
+    pool.get(options)
+    pool.get(options)
+    stats = pool.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 1)
+
+
+def test_refills_when_a_profile_drops_to_the_low_water_mark(pool):
+    options = PROFILES[0]
+    pool.warm_up(options, timeout=2)
+    assert ready(pool, options) == 4
+    pool.get(options)
+    pool.get(options)
+    time.sleep(0.05)
+    # 2 left, more than the low water mark
+    assert ready(pool, options) == 2 and pool.stats()["rendered"] == 4
+    pool.get(options)
+    wait_for(lambda: ready(pool, options) == 4)
+    assert pool.stats()["rendered"] == 7
+
+
+def test_warm_up_fills_every_profile(pool):
+    pool.warm_up(*PROFILES, timeout=2)
+    assert pool.stats()["ready"] == {profile_key(o): 4 for o in PROFILES}
+    assert pool.stats()["misses"] == 0
+
+
+def test_profiles_do_not_share_pairs(pool):
+    pool.warm_up(*PROFILES, timeout=2)
+    assert len({profile_key(o) for o in PROFILES}) == len(PROFILES)
+    for _ in range(3):
+        for options in PROFILES:
+            code, image = pool.get(options)
+            assert image == (options.code_length, options.only_digits)
+            assert code == render(options)[0]
+    assert pool.stats()["hits"] == 3 * len(PROFILES)
+
+
+def test_warm_up_does_not_wait_for_a_failing_render():
+    def failing(options):
+        raise OSError("keyzend is down")
+
+    pool = CaptchaPool(failing, size=2)
+    try:
+        start = time.monotonic()
+        pool.warm_up(PROFILES[0], timeout=5)
+        assert time.monotonic() - start < 4
+        assert pool.stats()["failed"] >= 1
+        with pytest.raises(OSError):
+            pool.get(PROFILES[0])
+    finally:
+        pool.close()
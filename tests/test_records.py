@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import importlib.util
+import json
+import logging
+import sys
+
+import pytest
+
+from _common import fake_user, new_manager
+from pyTelegramBotCaptcha import Captcha, CaptchaOptions, telebot_captcha
+
+STRICT = CaptchaOptions(only_digits=True, max_attempts=1)
+FIELDS = (
+    "_captcha_id",
+    "users_code",
+    "correct_code",
+    "message_id",
+    "date",
+    "previous_tries",
+    "user_reloads_left",
+    "solved",
+)
+
+
+def same_state(first, second):
+    assert [getattr(first, n) for n in FIELDS] == [getattr(second, n) for n in FIELDS]
+    assert first.chat.id == second.chat.id and first.chat.title == second.chat.title
+    assert first.user.to_dict() == second.user.to_dict()
+
+
+def test_records_and_legacy_json_load_by_their_first_char(manager, bot, chat):
+    captcha = manager.send_new_captcha(bot, chat, fake_user(1, "Ünïcödé"), STRICT)
+    captcha.users_code = "12"
+    record = captcha.to_record()
+    assert json.loads(record)[0] == telebot_captcha.RECORD_VERSION
+    # both entry points read both formats
+    for load in (Captcha.from_record, Captcha.de_json):
+        same_state(load(record, manager=manager), captcha)
+        legacy = load(captcha.to_json(), manager=manager)
+        same_state(legacy, captcha)
+        assert legacy.options._to_record() == STRICT._to_record()
+    assert Captcha.from_record("", manager=manager) is None
+
+
+def test_legacy_json_with_the_default_options(manager, bot, chat):
+    captcha = manager.send_new_captcha(bot, chat, fake_user(1))
+    assert json.loads(captcha.to_json())["options"] is None
+    loaded = Captcha.de_json(captcha.to_json(), manager=manager)
+    same_state(loaded, captcha)
+    assert loaded.options is manager.default_options
+
+
+def test_unknown_record_version_raises(manager, bot, chat):
+    captcha = manager.send_new_captcha(bot, chat, fake_user(1))
+    record = json.loads(captcha.to_record())
+    record[0] = telebot_captcha.RECORD_VERSION + 1
+    with pytest.raises(ValueError, match="record version"):
+        Captcha.from_record(json.dumps(record), manager=manager)
+
+
+def test_unregistered_profile_loads_the_default_options(bot, chat, caplog):
+    manager = new_manager(options_profiles={"strict": STRICT})
+    other = new_manager()
+    try:
+        captcha = manager.send_new_captcha(bot, chat, fake_user(1), STRICT)
+        record = captcha.to_record()
+        assert json.loads(record)[-1] == "strict"
+        assert Captcha.from_record(record, manager=manager).options is STRICT
+        with caplog.at_level(logging.WARNING):
+            loaded = Captcha.from_record(record, manager=other)
+        assert loaded.options is other.default_options
+        assert "Unknown options profile 'strict'" in caplog.text
+    finally:
+        manager.close()
+        other.close()
+
+
+def test_stdlib_json_writes_the_same_records(monkeypatch, manager, bot, chat):
+    # a copy of the module imported while orjson and ujson are missing
+    monkeypatch.setitem(sys.modules, "orjson", None)
+    monkeypatch.setitem(sys.modules, "ujson", None)
+    spec = importlib.util.spec_from_file_location(
+        "pyTelegramBotCaptcha._stdlib_telebot_captcha", telebot_captcha.__file__
+    )
+    stdlib = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(stdlib)
+    assert stdlib.orjson is None and stdlib.json.__name__ == "json"
+
+    captcha = manager.send_new_captcha(bot, chat, fake_user(1, "Ünïcödé"), STRICT)
+    record = captcha.to_record()
+    assert stdlib._loads(record) == telebot_captcha._loads(record)
+    assert stdlib._dumps(stdlib._loads(record)) == record
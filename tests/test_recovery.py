@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import time
+
+from _common import fake_user, new_manager, press
+from pyTelegramBotCaptcha import CaptchaOptions
+from pyTelegramBotCaptcha.storage import DirectoryStorage
+
+OPTIONS = CaptchaOptions(only_digits=True)
+OPTIONS._timeout = 600
+
+
+def purged(manager):
+    return manager.metrics["captcha_purged_total"].value()
+
+
+def test_saved_captchas_are_loaded_on_first_access(tmp_path, bot, chat):
+    storage = DirectoryStorage(tmp_path)
+    first = new_manager(storage=storage)
+    captchas = [
+        first.send_new_captcha(bot, chat, fake_user(user_id), OPTIONS)
+        for user_id in range(1, 4)
+    ]
+    first.close()
+
+    manager = new_manager(storage=storage)
+    try:
+        assert len(manager.captchas) == 0
+        assert sorted(manager._unloaded) == sorted(c._captcha_id for c in captchas)
+        press(manager, bot, captchas[0], captchas[0].correct_code[0])
+        loaded = manager.captchas.get(captchas[0]._captcha_id)
+        assert loaded.users_code == captchas[0].correct_code[0]
+        assert loaded.correct_code == captchas[0].correct_code
+        assert len(manager.captchas) == 1 and len(manager._unloaded) == 2
+    finally:
+        manager.close()
+
+
+def test_captchas_past_the_grace_are_purged_at_start(tmp_path, bot, chat, caplog):
+    storage = DirectoryStorage(tmp_path)
+    first = new_manager(storage=storage)
+    old = first.send_new_captcha(bot, chat, fake_user(1), OPTIONS)
+    pending = first.send_new_captcha(bot, chat, fake_user(2), OPTIONS)
+    first.close()
+    now = time.time()
+    storage.save(old._captcha_id, old.to_record(), now - 700)
+
+    timeouts = []
+    with caplog.at_level(logging.WARNING):
+        manager = new_manager(storage=storage, recovery_grace=600)
+    try:
+        manager.on_captcha_timeout(timeouts.append)
+        assert storage.load(old._captcha_id) is None
+        assert storage.load(pending._captcha_id) is not None
+        assert purged(manager) == 1
+        assert "Deleted 1 saved captchas" in caplog.text
+        assert list(manager._unloaded) == [pending._captcha_id]
+        time.sleep(1.3)
+        assert timeouts == []
+    finally:
+        manager.close()
+
+
+def _legacy_file(storage, captcha, date):
+    # saved by `to_json()` of older versions, the file is written on every change
+    captcha.date = date
+    path = storage._filepath(captcha._captcha_id)
+    path.write_text(captcha.to_json(), encoding="utf8")
+    os.utime(str(path), (date, date))
+
+
+def test_legacy_files_are_purged_by_their_real_deadline(tmp_path, bot, chat):
+    storage = DirectoryStorage(tmp_path)
+    first = new_manager(storage=storage)
+    recent = first.send_new_captcha(bot, chat, fake_user(1), OPTIONS)
+    old = first.send_new_captcha(bot, chat, fake_user(2), OPTIONS)
+    first.close()
+    now = time.time()
+    # saved 700 seconds ago, it timed out 100 seconds ago
+    _legacy_file(storage, recent, now - 700)
+    # it timed out 1400 seconds ago
+    _legacy_file(storage, old, now - 2000)
+
+    timeouts = []
+    manager = new_manager(storage=storage, recovery_grace=600)
+    try:
+        assert dict(manager.storage.index(1)) == {
+            recent._captcha_id: None,
+            old._captcha_id: None,
+        }
+        manager.on_captcha_timeout(timeouts.append)
+        time.sleep(1.3)
+        assert [captcha._captcha_id for captcha in timeouts] == [recent._captcha_id]
+        assert storage.load(old._captcha_id) is None
+        assert purged(manager) == 1
+    finally:
+        manager.close()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import sys
+import time
+
+import pytest
+
+from _common import (
+    FakeAsyncBot,
+    fake_user,
+    find_fonts,
+    new_manager,
+    press,
+    press_async,
+)
+from conftest import wrong_code
+from pyTelegramBotCaptcha import AsyncCaptchaManager, CaptchaOptions
+from pyTelegramBotCaptcha.storage import MemoryStorage
+
+OPTIONS = CaptchaOptions(only_digits=True, max_incorrect_to_auto_reload=0)
+
+
+def test_finished_captchas_are_evicted_after_the_ttl(bot, chat):
+    manager = new_manager(registry_ttl=0.2, sweep_interval=0.05)
+    try:
+        captcha = manager.send_new_captcha(bot, chat, fake_user(1), OPTIONS)
+        for button in list(captcha.correct_code) + ["OK"]:
+            press(manager, bot, captcha, button)
+        assert captcha.solved
+        assert manager.captchas.finished == 1
+        time.sleep(0.5)
+        assert captcha._captcha_id not in manager.captchas
+        assert manager.storage.load(captcha._captcha_id) is None
+        assert manager.metrics["captcha_evictions_total"].value("ttl") == 1
+    finally:
+        manager.close()
+
+
+def test_refreshed_captcha_survives_the_ttl(bot, chat):
+    # the retry flow of examples/captcha_gatekeeper_bot.py
+    manager = new_manager(registry_ttl=0.2, sweep_interval=0.05)
+    solved = []
+    manager.on_captcha_not_correct(
+        lambda captcha: manager.refresh_captcha(bot, captcha)
+    )
+    manager.on_captcha_correct(solved.append)
+    try:
+        captcha = manager.send_new_captcha(bot, chat, fake_user(1), OPTIONS)
+        for button in list(wrong_code(captcha)) + ["OK"]:
+            press(manager, bot, captcha, button)
+        assert not captcha.solved
+        time.sleep(0.5)
+        assert manager.captchas.get(captcha._captcha_id) is captcha
+        for button in list(captcha.correct_code) + ["OK"]:
+            press(manager, bot, captcha, button)
+        assert solved == [captcha]
+        assert manager.metrics["captcha_stale_callbacks_total"].value() == 0
+    finally:
+        manager.close()
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="asyncio.run")
+def test_refreshed_captcha_survives_the_ttl_async(chat):
+    async def main():
+        bot = FakeAsyncBot()
+        manager = AsyncCaptchaManager(
+            1,
+            storage=MemoryStorage(),
+            fonts=find_fonts(),
+            registry_ttl=0.2,
+            sweep_interval=0.05,
+        )
+        solved = []
+
+        async def on_not_correct(captcha):
+            await manager.refresh_captcha(bot, captcha)
+
+        manager.on_captcha_not_correct(on_not_correct)
+        manager.on_captcha_correct(solved.append)
+        manager.on_captcha_timeout(lambda captcha: None)
+        try:
+            captcha = await manager.send_new_captcha(bot, chat, fake_user(1), OPTIONS)
+            for button in list(wrong_code(captcha)) + ["OK"]:
+                await press_async(manager, bot, captcha, button)
+            await asyncio.sleep(0.5)
+            assert manager.captchas.get(captcha._captcha_id) is captcha
+            for button in list(captcha.correct_code) + ["OK"]:
+                await press_async(manager, bot, captcha, button)
+            assert solved == [captcha]
+        finally:
+            manager.close()
+
+    asyncio.run(main())
+
+
+def test_pending_captchas_are_evicted_last_and_reloaded(bot, chat):
+    manager = new_manager(storage=MemoryStorage(), registry_size=3)
+    try:
+        captchas = [
+            manager.send_new_captcha(bot, chat, fake_user(i), OPTIONS)
+            for i in range(1, 6)
+        ]
+        assert len(manager.captchas) == 3
+        assert manager.metrics["captcha_evictions_total"].value("pending") == 2
+        first = captchas[0]
+        for button in list(first.correct_code) + ["OK"]:
+            press(manager, bot, first, button)
+        loaded = manager.captchas.get(first._captcha_id)
+        assert loaded is not first and loaded.solved
+    finally:
+        manager.close()
+
+
+def test_pending_gauge_does_not_count_finished_captchas(bot, chat):
+    manager = new_manager(registry_ttl=60)
+    pending = manager.metrics["captcha_pending"]
+    try:
+        first = manager.send_new_captcha(bot, chat, fake_user(1), OPTIONS)
+        manager.send_new_captcha(bot, chat, fake_user(2), OPTIONS)
+        assert pending.value() == 2
+        for button in list(first.correct_code) + ["OK"]:
+            press(manager, bot, first, button)
+        assert manager.captchas.finished == 1
+        assert pending.value() == 1
+    finally:
+        manager.close()
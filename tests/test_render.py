@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import captcha.image
+import pytest
+from PIL import Image
+
+from _common import fake_user, find_fonts, new_manager, press
+from pyTelegramBotCaptcha import CaptchaOptions, KeyzendClient, telebot_captcha
+from pyTelegramBotCaptcha.storage import MemoryStorage
+
+
+def test_managers_keep_their_fonts_and_keyzend_client():
+    fonts = find_fonts()
+    first_client, second_client = KeyzendClient(), KeyzendClient()
+    first = new_manager(fonts=fonts[:1], keyzend=first_client)
+    second = new_manager(fonts=fonts[1:2], keyzend=second_client)
+    try:
+        assert first._shared.fonts == fonts[:1]
+        assert first._shared.keyzend_client() is first_client
+        assert second._shared.fonts == fonts[1:2]
+        assert second._shared.keyzend_client() is second_client
+    finally:
+        first.close()
+        second.close()
+
+
+def test_share_with_rejects_other_fonts_and_keyzend_client():
+    fonts = find_fonts()
+    first = new_manager(fonts=fonts[:1])
+    try:
+        with pytest.raises(ValueError):
+            new_manager(fonts=fonts[1:2], share_with=first)
+        with pytest.raises(ValueError):
+            new_manager(fonts=fonts[:1], keyzend=KeyzendClient(), share_with=first)
+        shared = new_manager(fonts=fonts[:1], share_with=first)
+        assert shared._shared.fonts == fonts[:1]
+        shared.close()
+    finally:
+        first.close()
+
+
+def test_math_captchas_of_a_batch_keep_their_code_length(monkeypatch, bot, chat):
+    results = iter(["7", "42", "512"])
+
+    def gen_math_captcha_image():
+        return {
+            "image": Image.new("RGB", (60, 30)),
+            "equation_str": "",
+            "equation_result": next(results),
+        }
+
+    monkeypatch.setattr(
+        telebot_captcha.captcha_generator,
+        "gen_math_captcha_image",
+        gen_math_captcha_image,
+    )
+    manager = new_manager(storage=MemoryStorage())
+    options = CaptchaOptions(generator="math")
+    try:
+        captchas, errors = manager.send_new_captchas(
+            bot, chat, [fake_user(i) for i in range(1, 4)], options
+        )
+        assert not errors
+        assert sorted(c.code_length for c in captchas) == [1, 2, 3]
+        assert options.code_length == CaptchaOptions().code_length
+        for captcha in captchas:
+            assert captcha.code_length == len(captcha.correct_code)
+            for button in list(captcha.correct_code) + ["OK"]:
+                press(manager, bot, captcha, button)
+            assert captcha.solved
+    finally:
+        manager.close()
+
+
+def test_send_new_captcha_saves_once(bot, chat):
+    saves = []
+
+    class CountingStorage(MemoryStorage):
+        def save(self, captcha_id, data, deadline=None):
+            saves.append(captcha_id)
+            super().save(captcha_id, data, deadline)
+
+    manager = new_manager(storage=CountingStorage())
+    try:
+        captcha = manager.send_new_captcha(bot, chat, fake_user(1))
+        assert saves == [captcha._captcha_id]
+        assert bot.calls["send_photo"] == 1
+    finally:
+        manager.close()
+
+
+def test_preloaded_fonts_are_not_parsed_again(monkeypatch):
+    fonts = find_fonts()
+    telebot_captcha._renderer_cache.clear()
+    telebot_captcha.preload_fonts(fonts)
+    renderer = telebot_captcha._image_captcha(fonts)
+
+    def truetype(*args):
+        raise AssertionError("font parsed again")
+
+    monkeypatch.setattr(captcha.image, "truetype", truetype)
+    assert telebot_captcha._image_captcha(list(fonts)) is renderer
+    assert len(renderer.truefonts) == len(fonts) * len(telebot_captcha.FONT_SIZES)
+    telebot_captcha._random_codeimage(CaptchaOptions(), fonts=fonts)
+
+
+def test_a_user_twice_in_a_batch_gets_one_captcha(bot, chat):
+    manager = new_manager(storage=MemoryStorage())
+    try:
+        users = [fake_user(1), fake_user(2), fake_user(1)]
+        captchas, errors = manager.send_new_captchas(bot, chat, users)
+        assert not errors
+        assert [captcha.user.id for captcha in captchas] == [1, 2]
+        assert captchas[0].user is users[0]
+        assert bot.calls["send_photo"] == 2
+        assert manager.pending_timeouts == 2
+        assert manager.captchas.get(captchas[0]._captcha_id) is captchas[0]
+    finally:
+        manager.close()
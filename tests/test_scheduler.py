@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import time
+from threading import Event, Lock
+
+from pyTelegramBotCaptcha.scheduler import TimeoutScheduler
+
+
+def test_cancelled_timeouts_do_not_fire():
+    scheduler = TimeoutScheduler()
+    fired = []
+    try:
+        cancelled = scheduler.schedule(0.1, fired.append, "cancelled")
+        scheduler.schedule(0.1, fired.append, "fired")
+        cancelled.cancel()
+        cancelled.cancel()
+        assert not cancelled.pending
+        assert scheduler.pending == 1
+        time.sleep(0.3)
+        assert fired == ["fired"]
+        assert scheduler.pending == 0
+    finally:
+        scheduler.close()
+
+
+def test_fired_handle_can_not_be_cancelled():
+    scheduler = TimeoutScheduler()
+    done = Event()
+    try:
+        handle = scheduler.schedule(0, done.set)
+        assert done.wait(1)
+        assert not handle.pending
+        handle.cancel()
+        assert not handle.cancelled
+        assert scheduler.pending == 0
+    finally:
+        scheduler.close()
+
+
+def test_pending_counts_scheduled_and_not_cancelled_timeouts():
+    scheduler = TimeoutScheduler()
+    try:
+        handles = scheduler.schedule_many((60, print, ()) for _ in range(10))
+        assert scheduler.pending == 10
+        for handle in handles[:3]:
+            handle.cancel()
+        assert scheduler.pending == 7
+        assert sum(handle.pending for handle in handles) == 7
+    finally:
+        scheduler.close()
+    assert scheduler.pending == 0
+
+
+def test_heap_drops_cancelled_timeouts_when_they_take_half_of_it():
+    scheduler = TimeoutScheduler()
+    try:
+        handles = scheduler.schedule_many((60, print, ()) for _ in range(200))
+        # the cancelled handles stay in the heap until they are more than half
+        for handle in handles[:100]:
+            handle.cancel()
+        assert len(scheduler._heap) == 200
+        handles[100].cancel()
+        assert len(scheduler._heap) == 99
+        assert scheduler._cancelled == 0
+        assert scheduler.pending == 99
+        assert all(entry[2].pending for entry in scheduler._heap)
+    finally:
+        scheduler.close()
+
+
+def test_a_burst_of_due_timeouts_runs_on_max_workers_threads():
+    scheduler = TimeoutScheduler(max_workers=3)
+    lock = Lock()
+    running, most, calls = [0], [0], []
+
+    def handler(i):
+        with lock:
+            running[0] += 1
+            most[0] = max(most[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+            calls.append(i)
+
+    try:
+        scheduler.schedule_many((0, handler, (i,)) for i in range(30))
+        time.sleep(0.05)
+        # the scheduler thread handed the whole burst over, it waits for the workers
+        assert scheduler.pending == 0
+        assert len(calls) < 30
+        deadline = time.monotonic() + 2
+        while len(calls) < 30 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert sorted(calls) == list(range(30))
+        assert most[0] == 3
+    finally:
+        scheduler.close()
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import bench_soak
+
+# each run takes 6 seconds and its bound depends on the timing of the machine
+pytestmark = pytest.mark.slow
+
+ARGS = (
+    "--duration 6 --rate 100 --timeout 1 --registry-ttl 1 --sweep-interval 0.5 "
+    "--interval 1 --orphans 1000"
+).split()
+
+
+def kept(args):
+    samples = bench_soak.soak(args)
+    half = [sample for sample in samples if sample[0] >= args.duration / 2]
+    return max(max(in_memory, records) for _, in_memory, records, _ in half)
+
+
+def test_the_registry_limits_bound_the_captchas_kept(capsys):
+    args = bench_soak.parse_args(ARGS)
+    assert kept(args) <= bench_soak.bound(args)
+
+
+def test_without_eviction_the_captchas_grow_past_the_bound(capsys):
+    args = bench_soak.parse_args(ARGS + ["--no-eviction"])
+    assert kept(args) > bench_soak.bound(args)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from _fake_redis import start_fake_redis
+from pyTelegramBotCaptcha import RedisStorage
+from pyTelegramBotCaptcha.storage import DirectoryStorage, MemoryStorage, SQLiteStorage
+
+
+@pytest.fixture(params=["directory", "memory", "sqlite", "redis"])
+def storage(request, tmp_path):
+    if request.param == "directory":
+        yield DirectoryStorage(tmp_path / "saves")
+    elif request.param == "memory":
+        yield MemoryStorage()
+    elif request.param == "sqlite":
+        storage = SQLiteStorage(tmp_path / "saves.sqlite3")
+        yield storage
+        storage.close()
+    else:
+        server, url = start_fake_redis()
+        storage = RedisStorage(url)
+        yield storage
+        storage.close()
+        server.shutdown()
+
+
+def test_round_trip(storage):
+    deadline = 1_700_000_000.0
+    storage.save("1=-100=1", "a", deadline)
+    storage.save("1=-200=1", "b", deadline + 1)
+    storage.save_many([("1=-100=2", "c", deadline + 2), ("2=-100=1", "d", deadline)])
+    assert storage.load("1=-100=1") == "a"
+    assert storage.load("1=-100=3") is None
+    storage.save("1=-100=1", "e", deadline + 3)
+    assert storage.load("1=-100=1") == "e"
+
+    assert sorted(storage.load_all(1)) == ["b", "c", "e"]
+    assert sorted(storage.load_all(2)) == ["d"]
+    index = dict(storage.index(1))
+    assert sorted(index) == ["1=-100=1", "1=-100=2", "1=-200=1"]
+    assert index["1=-100=1"] == pytest.approx(deadline + 3)
+    assert index["1=-200=1"] == pytest.approx(deadline + 1)
+
+    storage.delete("1=-100=1")
+    storage.delete("1=-100=3")
+    storage.delete_many(["1=-200=1", "2=-100=1"])
+    assert storage.load("1=-100=1") is None
+    assert list(storage.load_all(1)) == ["c"]
+    assert list(storage.index(2)) == []
+
+
+def test_purge_deletes_only_the_expired_captchas_of_the_bot(storage):
+    storage.save_many(
+        [("1=-100=1", "a", 100.0), ("1=-100=2", "b", 300.0), ("2=-100=1", "c", 100.0)]
+    )
+    assert storage.purge(1, before=200.0) == 1
+    assert sorted(storage.load_all(1)) == ["b"]
+    assert list(storage.load_all(2)) == ["c"]
+
+
+def _pages(storage):
+    return {
+        pragma: storage._db.execute(f"PRAGMA {pragma}").fetchone()[0]
+        for pragma in ("page_count", "freelist_count")
+    }
+
+
+def test_sqlite_compaction_frees_the_pages_of_deleted_captchas(tmp_path):
+    storage = SQLiteStorage(tmp_path / "saves.sqlite3", compact_every=0)
+    try:
+        ids = [f"1=-100={user_id}" for user_id in range(2000)]
+        storage.save_many([(captcha_id, "x" * 500, 0.0) for captcha_id in ids])
+        full = _pages(storage)["page_count"]
+        storage.delete_many(ids[:1900])
+        assert _pages(storage)["freelist_count"] > full // 2
+        storage.compact()
+        pages = _pages(storage)
+        assert pages["freelist_count"] == 0
+        assert pages["page_count"] < full // 2
+        assert len(list(storage.index(1))) == 100
+    finally:
+        storage.close()
+    assert os.path.getsize(tmp_path / "saves.sqlite3") < full * 4096 // 2
+
+
+def test_sqlite_compacts_after_compact_every_deletes(tmp_path):
+    storage = SQLiteStorage(tmp_path / "saves.sqlite3", compact_every=500)
+    try:
+        ids = [f"1=-100={user_id}" for user_id in range(1000)]
+        storage.save_many([(captcha_id, "x" * 500, 0.0) for captcha_id in ids])
+        storage.delete_many(ids[:400])
+        assert _pages(storage)["freelist_count"] > 0
+        # the purge brings the deletes to 1000
+        assert storage.purge(1, before=1.0) == 600
+        assert _pages(storage)["freelist_count"] == 0
+    finally:
+        storage.close()
+
+
+def test_sqlite_lookups_use_the_indexes():
+    storage = SQLiteStorage(":memory:")
+    try:
+        plans = {
+            sql: " ".join(
+                row[-1] for row in storage._db.execute("EXPLAIN QUERY PLAN " + sql, args)
+            )
+            for sql, args in (
+                (
+                    "SELECT data FROM captchas "
+                    "WHERE bot_id = ? AND chat_id = ? AND user_id = ?",
+                    (1, -100, 1),
+                ),
+                (
+                    "DELETE FROM captchas WHERE bot_id = ? AND deadline < ?",
+                    (1, 0.0),
+                ),
+            )
+        }
+        for plan in plans.values():
+            assert "USING" in plan and "SCAN" not in plan
+    finally:
+        storage.close()
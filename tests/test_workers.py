@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import sys
+import time
+from collections import Counter
+from threading import Lock, Thread
+
+import pytest
+
+from _common import (
+    FakeAsyncBot,
+    FakeBot,
+    FakeChat,
+    fake_user,
+    find_fonts,
+    new_manager,
+    press_async,
+)
+from _fake_redis import start_fake_redis
+from bench_workers import solve, start_workers
+from pyTelegramBotCaptcha import AsyncCaptchaManager, CaptchaOptions, RedisStorage
+
+
+@pytest.fixture
+def redis():
+    server, url = start_fake_redis()
+    yield server, url
+    server.shutdown()
+
+
+def test_lock_taken_over_is_not_released(redis):
+    server, url = redis
+    first, second = RedisStorage(url, lock_ttl=0.1), RedisStorage(url, lock_ttl=0.1)
+    with first.lock("1=-100=1"):
+        # the lock of the first process expires, the second one takes it
+        time.sleep(0.2)
+        lock = second.lock("1=-100=1")
+        lock.__enter__()
+    # the first process left its block late, the lock of the second one stays
+    assert len(server.db.strings) == 1
+    lock.__exit__(None, None, None)
+    assert not server.db.strings
+    first.close()
+    second.close()
+
+
+def test_claimed_timeout_is_claimed_again_after_the_lease(redis):
+    _, url = redis
+    storage = RedisStorage(url, claim_ttl=0.3)
+    storage.save("1=-100=1", "{}", time.time() - 1)
+    assert storage.claim_expired(1, time.time()) == ["1=-100=1"]
+    # the claiming process died before the timeout was handled
+    assert storage.claim_expired(1, time.time()) == []
+    time.sleep(0.4)
+    assert storage.claim_expired(1, time.time()) == ["1=-100=1"]
+    storage.close()
+
+
+def test_workers_solve_and_time_out_each_captcha_once(redis):
+    _, url = redis
+    events, lock = [], Lock()
+    bot, chat = FakeBot(), FakeChat(-100)
+    workers = start_workers(url, 3, bot, events, lock)
+    try:
+        captchas = [
+            workers[0].send_new_captcha(bot, chat, fake_user(user_id))
+            for user_id in range(1, 11)
+        ]
+        threads = [
+            Thread(target=solve, args=(workers, bot, captcha)) for captcha in captchas
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        solved = Counter(c for kind, _, c, _ in events if kind == "correct")
+        assert solved == Counter(c._captcha_id for c in captchas)
+
+        options = CaptchaOptions()
+        options._timeout = 0.5
+        del events[:]
+        sent = [
+            workers[i % 3].send_new_captcha(bot, chat, fake_user(i), options)
+            for i in range(100, 110)
+        ]
+        time.sleep(1.5)
+        fired = Counter(c for kind, _, c, _ in events if kind == "timeout")
+        assert fired == Counter(c._captcha_id for c in sent)
+    finally:
+        for worker in workers:
+            worker.close()
+
+
+def test_timeout_kept_by_the_handler_fires_once(redis):
+    # the handler does not delete the captcha, its saved deadline is cleared
+    _, url = redis
+    bot, chat = FakeBot(), FakeChat(-100)
+    fired, lock = [], Lock()
+    workers = []
+    for _ in range(2):
+        manager = new_manager(
+            storage=RedisStorage(url, claim_ttl=0.3), claim_interval=0.1
+        )
+
+        def on_timeout(captcha):
+            with lock:
+                fired.append(captcha._captcha_id)
+
+        manager.on_captcha_timeout(on_timeout)
+        workers.append(manager)
+    try:
+        options = CaptchaOptions()
+        options._timeout = 0.2
+        captcha = workers[0].send_new_captcha(bot, chat, fake_user(1), options)
+        time.sleep(1.2)
+        assert fired == [captcha._captcha_id]
+    finally:
+        for worker in workers:
+            worker.close()
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="asyncio.run")
+def test_async_workers_share_captchas(redis):
+    _, url = redis
+
+    async def main():
+        bot, chat = FakeAsyncBot(), FakeChat(-100)
+        events = []
+        workers = []
+        for worker in range(2):
+            manager = AsyncCaptchaManager(
+                1, storage=RedisStorage(url), fonts=find_fonts(), claim_interval=0.1
+            )
+
+            async def record(captcha, worker=worker, manager=manager):
+                events.append((worker, captcha._captcha_id))
+                await manager.delete_captcha(bot, captcha)
+
+            manager.on_captcha_correct(record)
+            manager.on_captcha_not_correct(record)
+            manager.on_captcha_timeout(record)
+            await manager.start()
+            workers.append(manager)
+        try:
+            # sent by one worker, solved on the other one
+            captcha = await workers[0].send_new_captcha(bot, chat, fake_user(1))
+            for button in list(captcha.correct_code) + ["OK", "OK"]:
+                await press_async(workers[1], bot, captcha, button)
+            assert events == [(1, captcha._captcha_id)]
+
+            options = CaptchaOptions()
+            options._timeout = 0.3
+            del events[:]
+            sent = [
+                await workers[i % 2].send_new_captcha(bot, chat, fake_user(i), options)
+                for i in range(10, 16)
+            ]
+            await asyncio.sleep(1.2)
+            fired = Counter(captcha_id for _, captcha_id in events)
+            assert fired == Counter(c._captcha_id for c in sent)
+        finally:
+            for worker in workers:
+                worker.close()
+
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+from _common import fake_user, new_manager, press, telebot_captcha
+from pyTelegramBotCaptcha.storage import MemoryStorage, WriteBehind
+
+
+class CountingStorage(MemoryStorage):
+    def __init__(self, fail=0):
+        super().__init__()
+        self.writes = []
+        self.fail = fail
+
+    def save_many(self, items):
+        if self.fail:
+            self.fail -= 1
+            raise OSError("disk full")
+        items = list(items)
+        self.writes.append(("save", [captcha_id for captcha_id, _, _ in items]))
+        super().save_many(items)
+
+    def delete_many(self, captcha_ids):
+        captcha_ids = list(captcha_ids)
+        if not captcha_ids:
+            return
+        self.writes.append(("delete", captcha_ids))
+        super().delete_many(captcha_ids)
+
+
+class Record:
+    deadline = None
+
+    def __init__(self, data):
+        self.data = data
+
+    def to_record(self):
+        return self.data
+
+
+def test_presses_are_not_written_until_a_flush(bot, chat):
+    storage = CountingStorage()
+    manager = new_manager(storage=storage, write_behind_interval=60)
+    try:
+        captcha = manager.send_new_captcha(bot, chat, fake_user(1))
+        assert storage.writes == [("save", [captcha._captcha_id])]
+        for button in captcha.correct_code[:3] + "0":
+            press(manager, bot, captcha, button)
+        assert len(storage.writes) == 1
+        assert manager._write_behind.dirty == 1
+        # the pending input can be loaded before it is written
+        loaded = manager._load(captcha._captcha_id)
+        assert loaded == captcha.to_record()
+    finally:
+        manager.close()
+    assert storage.writes[-1] == ("save", [captcha._captcha_id])
+    assert storage.load(captcha._captcha_id) == captcha.to_record()
+
+
+def test_create_reset_and_delete_are_written_at_once(bot, chat):
+    storage = CountingStorage()
+    manager = new_manager(storage=storage, write_behind_interval=60)
+    try:
+        captcha = manager.send_new_captcha(bot, chat, fake_user(1))
+        press(manager, bot, captcha, captcha.correct_code[0])
+        manager.reset_captcha(bot, captcha)
+        assert len(storage.writes) == 2
+        assert storage.load(captcha._captcha_id) == captcha.to_record()
+        manager.delete_captcha(bot, captcha)
+        assert storage.writes[-1] == ("delete", [captcha._captcha_id])
+        assert storage.load(captcha._captcha_id) is None
+    finally:
+        manager.close()
+
+
+def test_failed_flush_is_retried():
+    storage = CountingStorage(fail=1)
+    write_behind = WriteBehind(storage, interval=60)
+    try:
+        write_behind.save("1=-100=1", Record("a"))
+        write_behind.flush()
+        assert storage.load("1=-100=1") is None
+        assert write_behind.dirty == 1
+        assert write_behind.load("1=-100=1") == "a"
+        write_behind.flush()
+        assert storage.load("1=-100=1") == "a"
+        assert write_behind.dirty == 0
+    finally:
+        write_behind.close()
+
+
+def test_newer_writes_win_over_a_retried_flush():
+    storage = CountingStorage(fail=1)
+    write_behind = WriteBehind(storage, interval=60)
+    try:
+        write_behind.save("1=-100=1", Record("a"))
+        write_behind.flush()
+        write_behind.delete("1=-100=1")
+        write_behind.flush()
+        assert storage.writes == [("delete", ["1=-100=1"])]
+    finally:
+        write_behind.close()
+
+
+def test_close_removes_the_exit_hook(monkeypatch, bot, chat):
+    hooks = []
+    monkeypatch.setattr(telebot_captcha.atexit, "register", hooks.append)
+    monkeypatch.setattr(telebot_captcha.atexit, "unregister", hooks.remove)
+    manager = new_manager(write_behind_interval=60)
+    assert hooks == [manager._write_behind.close]
+    manager.close()
+    assert hooks == []